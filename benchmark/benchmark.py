@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Times the interpreter on the programs in resources/ and reports interpreted
+# instructions and calls per second. Pass --interpreter more than once to
+# compare builds (for instance one configured with -Dthreaded_dispatch=false)
+# or options (for instance --interpreter "builddir/interpreter --no-fusion").
+import argparse
+import os
+import os.path
+import shlex
+import subprocess
+import sys
+import time
+
+def resolve_filename(filename):
+    return os.path.join(os.path.split(os.path.abspath(__file__))[0], filename)
+
+tmpdir = resolve_filename("tmp")
+
+def compile_benchmark(filename):
+    if not os.path.isdir(tmpdir):
+        os.makedirs(tmpdir)
+    outfile = os.path.join(tmpdir, os.path.splitext(os.path.split(filename)[1])[0] + ".slb")
+    arguments = ["python3", resolve_filename("../compiler/compiler.py"), "-o", outfile, filename]
+    completed_process = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if completed_process.returncode != 0:
+        print(completed_process.stdout.decode("utf8"))
+        sys.exit("Failed to compile %s" % filename)
+    return outfile
+
+def run_once(interpreter, path, *arguments):
+    start = time.perf_counter()
+    completed_process = subprocess.run(shlex.split(interpreter) + [path] + list(arguments), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+    stdout = completed_process.stdout.decode("utf8")
+    if completed_process.returncode != 0:
+        print(stdout)
+        sys.exit("Benchmark %s failed" % path)
+    return elapsed, stdout
+
+def count_instructions(interpreter, path):
+    # Returns the number of instructions and calls executed. Older builds
+    # don't report calls, in which case the number of calls is None.
+    _, stdout = run_once(interpreter, path, "--print-instruction-count")
+    instructions = None
+    calls = None
+    for line in stdout.splitlines():
+        if line.startswith("Executed ") and line.endswith(" instructions"):
+            instructions = int(line.split()[1])
+        elif line.startswith("Executed ") and line.endswith(" calls"):
+            calls = int(line.split()[1])
+    if instructions is None:
+        sys.exit("Interpreter %s didn't report an instruction count" % interpreter)
+    return instructions, calls
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the Slang interpreter.")
+    argparser.add_argument("benchmarks", nargs="*", help="Slang source files to benchmark (default: everything in resources/)")
+    argparser.add_argument("--interpreter", action="append", help="Interpreter command line to benchmark (may be repeated)")
+    argparser.add_argument("--repeat", type=int, default=5, help="Number of timed runs; the fastest is reported")
+    args = argparser.parse_args()
+
+    interpreters = args.interpreter or [resolve_filename("../interpreter/builddir/interpreter")]
+    benchmarks = args.benchmarks or sorted(
+        os.path.join(resolve_filename("resources"), name)
+        for name in os.listdir(resolve_filename("resources"))
+        if name.endswith(".slg")
+    )
+
+    print("%-24s %-48s %14s %10s %14s %14s" % ("benchmark", "interpreter", "instructions", "seconds", "instrs/sec", "calls/sec"))
+    for benchmark in benchmarks:
+        path = compile_benchmark(benchmark)
+        for interpreter in interpreters:
+            instructions, calls = count_instructions(interpreter, path)
+            elapsed = min(run_once(interpreter, path)[0] for _ in range(args.repeat))
+            print("%-24s %-48s %14d %10.3f %14.0f %14s" % (
+                os.path.split(benchmark)[1],
+                interpreter,
+                instructions,
+                elapsed,
+                instructions / elapsed,
+                "%.0f" % (calls / elapsed) if calls is not None else "-"
+            ))
+
+if __name__ == "__main__":
+    main()
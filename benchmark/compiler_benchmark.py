@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Times the compiler on generated programs full of deeply nested expressions,
+# which is where the type checker used to go quadratic, and on programs declaring
+# lots of classes, which is where resolving types did, as well as on the
+# standard library, where tokenizing and parsing take a good share of the time.
+# The compiler's peak RSS is reported too. Like benchmark.py, pass --compiler
+# more than once to compare compilers (for instance an older checkout's
+# compiler.py).
+import argparse
+import os
+import os.path
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchmark
+
+def chain(depth):
+    # a + b + a + ... parses left-associatively, so the tree is depth deep
+    return " + ".join("a" if i % 2 == 0 else "b" for i in range(depth))
+
+def nested(depth):
+    ret = "a"
+    for _ in range(depth):
+        ret = "(b * %s + a)" % ret
+    return ret
+
+shapes = {
+    "chain": chain,
+    "nested": nested
+}
+
+stdlib_path = benchmark.resolve_filename("../compiler/stdlib/src/stdlib.slg")
+
+def write_program(name, lines):
+    if not os.path.isdir(benchmark.tmpdir):
+        os.makedirs(benchmark.tmpdir)
+    path = os.path.join(benchmark.tmpdir, "%s.slg" % name)
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def generate_program(shape, depth, statements):
+    lines = ["fn compute(a: int, b: int): int {", "    let total = 0;"]
+    for i in range(statements):
+        lines.append("    let x%d = %s;" % (i, shapes[shape](depth)))
+        lines.append("    total += x%d;" % i)
+    lines += ["    return total;", "}", "entrypoint fn main(): int {", "    return compute(1, 2);", "}"]
+    return write_program("%s_%d" % (shape, depth), lines)
+
+def generate_classes_program(count):
+    # Each class refers to the one before it, and to an array of itself
+    lines = []
+    for i in range(count):
+        lines += [
+            "class C%d {" % i,
+            "    value: int;",
+            "    items: [C%d];" % i,
+            "    previous: C%d;" % (i - 1) if i > 0 else "    previous: C0;",
+            "    ctor(value: int) {",
+            "        this.value = value;",
+            "        this.items = [this];",
+            "    }",
+            "    fn next(): C%d {" % i,
+            "        let ret: C%d = new C%d(this.value + 1);" % (i, i),
+            "        ret.items[0] = this;",
+            "        return ret;",
+            "    }",
+            "}"
+        ]
+    lines += ["entrypoint fn main(): int {", "    let last: C%d = new C%d(1);" % (count - 1, count - 1), "    return last.next().value;", "}"]
+    return write_program("classes_%d" % count, lines)
+
+def compile_once(compiler, path):
+    # This returns the time taken and the compiler's peak RSS in KiB, which
+    # os.wait4 gives us for just that process
+    outfile = os.path.join(benchmark.tmpdir, os.path.splitext(os.path.basename(path))[0] + ".slb")
+    # The standard library can't include itself
+    flags = ["--no-stdlib"] if path == stdlib_path else []
+    with tempfile.TemporaryFile() as output:
+        start = time.perf_counter()
+        process = subprocess.Popen(shlex.split(compiler) + flags + ["-o", outfile, path], stdout=output, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        if status != 0:
+            output.seek(0)
+            print(output.read().decode("utf8"))
+            sys.exit("Failed to compile %s with %s" % (path, compiler))
+    return elapsed, rusage.ru_maxrss
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the time and memory taken by the Slang compiler.")
+    argparser.add_argument("--compiler", action="append", help="Compiler command line to benchmark (may be repeated)")
+    argparser.add_argument("--depth", type=int, action="append", help="Depth of the generated expressions (may be repeated)")
+    argparser.add_argument("--statements", type=int, default=10, help="Number of expressions in each generated program")
+    argparser.add_argument("--classes", type=int, action="append", help="Number of classes declared by the generated program (may be repeated)")
+    argparser.add_argument("--repeat", type=int, default=3, help="Number of timed runs; the fastest is reported")
+    args = argparser.parse_args()
+
+    compilers = args.compiler or ["python3 %s" % benchmark.resolve_filename("../compiler/compiler.py")]
+    # Much deeper than 100, the parser runs out of stack on the nested programs
+    depths = args.depth or [25, 50, 100]
+    class_counts = args.classes or [50, 100, 200]
+
+    paths = [generate_program(shape, depth, args.statements) for shape in sorted(shapes) for depth in depths]
+    paths += [generate_classes_program(count) for count in class_counts]
+    paths.append(stdlib_path)
+
+    print("%-16s %-48s %10s %14s" % ("program", "compiler", "seconds", "peak RSS (KiB)"))
+    for path in paths:
+        for compiler in compilers:
+            runs = [compile_once(compiler, path) for _ in range(args.repeat)]
+            elapsed = min(run[0] for run in runs)
+            peak_rss = max(run[1] for run in runs)
+            print("%-16s %-48s %10.3f %14d" % (os.path.splitext(os.path.basename(path))[0], compiler, elapsed, peak_rss))
+
+if __name__ == "__main__":
+    main()
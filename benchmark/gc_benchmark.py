@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Runs the allocation-heavy programs in resources/gc/ with --gc-verbose and
+# reports how quickly major collections mark live objects, and the longest
+# pause that major collections caused. Like benchmark.py, pass --interpreter more than once to
+# compare builds or options (for instance --gc-pause-target).
+import argparse
+import os
+import os.path
+import re
+import sys
+
+import benchmark
+
+marked_pattern = re.compile(r"^Marked (\d+) objects in ([0-9.]+)ms$")
+pause_pattern = re.compile(r", pause ([0-9.]+)ms$")
+
+def parse_collections(stdout):
+    objects = 0
+    mark_ms = 0.0
+    pause_ms = 0.0
+    collections = 0
+    for line in stdout.splitlines():
+        match = marked_pattern.match(line)
+        if match is not None:
+            objects += int(match.group(1))
+            mark_ms += float(match.group(2))
+            collections += 1
+        match = pause_pattern.search(line)
+        if match is not None and not line.startswith("Garbage collecting (minor)"):
+            pause_ms = max(pause_ms, float(match.group(1)))
+    return collections, objects, mark_ms, pause_ms
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the Slang garbage collector.")
+    argparser.add_argument("benchmarks", nargs="*", help="Slang source files to benchmark (default: everything in resources/gc/)")
+    argparser.add_argument("--interpreter", action="append", help="Interpreter command line to benchmark (may be repeated)")
+    argparser.add_argument("--repeat", type=int, default=5, help="Number of timed runs; the one with the fastest marking is reported")
+    args = argparser.parse_args()
+
+    interpreters = args.interpreter or [benchmark.resolve_filename("../interpreter/builddir/interpreter")]
+    benchmarks = args.benchmarks or sorted(
+        os.path.join(benchmark.resolve_filename("resources/gc"), name)
+        for name in os.listdir(benchmark.resolve_filename("resources/gc"))
+        if name.endswith(".slg")
+    )
+
+    print("%-24s %-48s %6s %12s %10s %10s %14s" % ("benchmark", "interpreter", "majors", "marked", "mark ms", "max pause", "objects/sec"))
+    for source in benchmarks:
+        path = benchmark.compile_benchmark(source)
+        for interpreter in interpreters:
+            runs = [parse_collections(benchmark.run_once(interpreter, path, "--gc-verbose")[1]) for _ in range(args.repeat)]
+            collections, objects, mark_ms, pause_ms = min(runs, key=lambda run: run[2])
+            if collections == 0:
+                sys.exit("Interpreter %s didn't report any major collections for %s" % (interpreter, source))
+            print("%-24s %-48s %6d %12d %10.3f %10.3f %14.0f" % (
+                os.path.split(source)[1],
+                interpreter,
+                collections,
+                objects,
+                mark_ms,
+                pause_ms,
+                objects / (mark_ms / 1000) if mark_ms > 0 else float("inf")
+            ))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Compiles lots of files in one process. Running compiler.py for each file
+# means importing the whole compiler (and loading opcodes.json) and reading the
+# standard library's headers every time, which is most of the time taken to
+# compile a small file. Here, that's only done once. Files to link against are
+# read again if their contents change, since a file compiled earlier in the
+# batch could be one of them.
+import argparse
+import compiler
+import hashlib
+import itertools
+import os.path
+import sys
+import time
+import traceback
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import header
+
+class HeaderCache:
+    def __init__(self) -> None:
+        # This maps the path of each file to link against, and whether it's
+        # JSON, to a hash of its contents and its headers
+        self.headers: "Dict[Tuple[str, bool], Tuple[bytes, header.HeaderRepresentation]]" = dict()
+
+    def read_header(self, path: str, is_json: bool) -> "header.HeaderRepresentation":
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).digest()
+        key = (os.path.abspath(path), is_json)
+        if key not in self.headers or self.headers[key][0] != digest:
+            self.headers[key] = (digest, compiler.read_header(path, is_json))
+        return self.headers[key][1]
+
+def read_manifest(path: str) -> Iterator[str]:
+    # A manifest lists a file on each line, relative to the manifest. Blank
+    # lines and lines starting with # are ignored. If the manifest is -, files
+    # are read from standard input as they come, which lets a build keep one
+    # batch compiler running and feed it files.
+    if path == "-":
+        directory = ""
+        lines: Iterator[str] = iter(sys.stdin)
+    else:
+        directory = os.path.dirname(path)
+        with open(path, "r") as f:
+            lines = iter(f.readlines())
+    for line in lines:
+        line = line.strip()
+        if line != "" and not line.startswith("#"):
+            yield os.path.join(directory, line)
+
+def output_path(path: str, output_dir: Optional[str]) -> str:
+    filename = "%s.slb" % path[:-4]
+    if output_dir is not None:
+        return os.path.join(output_dir, os.path.basename(filename))
+    return filename
+
+def main() -> None:
+    argparser = argparse.ArgumentParser(description="Compile several files in a single process.")
+    argparser.add_argument("files", nargs="*", help="files to compile, in order")
+    argparser.add_argument("--manifest", metavar="file", action="append", help="file listing more files to compile, or - for standard input")
+    argparser.add_argument("--output-dir", metavar="dir", help="directory for bytecode output (by default, next to each file)")
+    compiler.add_arguments(argparser)
+    args = argparser.parse_args()
+
+    headers = HeaderCache()
+    sources: List[Iterator[str]] = [iter(args.files)] + [read_manifest(manifest) for manifest in args.manifest or []]
+    start = time.perf_counter()
+    compiled = 0
+    failed = 0
+    for path in itertools.chain.from_iterable(sources):
+        file_args = argparse.Namespace(**vars(args))
+        file_args.file = path
+        file_args.output = output_path(path, args.output_dir)
+        file_start = time.perf_counter()
+        try:
+            compiler.compile_file(file_args, headers.read_header)
+            status = "ok"
+            compiled += 1
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            status = "failed"
+            failed += 1
+        print("%-6s %8.3fs  %s" % (status, time.perf_counter() - file_start, path), flush=True)
+    print("Compiled %d files in %.3fs, %d failed" % (compiled, time.perf_counter() - start, failed))
+    if failed > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# An on-disk cache of compiled files, for --cache-dir.
+#
+# Each entry is the bytecode compiled from a source file, keyed by a hash of
+# everything that goes into it: the source, the headers of everything it's
+# linked against (including the standard library), the options that affect
+# the output, and the compiler itself. So an entry can only be reused if
+# compiling again would produce exactly the same bytes, and there's never any
+# need to invalidate anything. Entries are written to a temporary file and
+# then renamed, so compilers sharing a cache directory never see half of one.
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+from typing import Dict, List, Optional
+
+def fingerprint_compiler() -> bytes:
+    # Changing the compiler (or the opcodes it emits) can change its output
+    compiler_dir = os.path.dirname(os.path.abspath(__file__))
+    ret = hashlib.sha256()
+    for filename in sorted(os.listdir(compiler_dir)):
+        if filename.endswith(".py") or filename == "opcodes.json":
+            ret.update(filename.encode("utf8"))
+            with open(os.path.join(compiler_dir, filename), "rb") as f:
+                ret.update(hashlib.sha256(f.read()).digest())
+    return ret.digest()
+
+class BuildCache:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.stats_path = os.path.join(directory, "stats.json")
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source: bytes, includes: List[bytes], options: List[str]) -> str:
+        ret = hashlib.sha256(fingerprint_compiler())
+        for part in [source] + includes + [json.dumps(options).encode("utf8")]:
+            # Hashing the hash of each part means there's no way for the end
+            # of one part to be confused with the start of the next
+            ret.update(hashlib.sha256(part).digest())
+        return ret.hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], "%s.slb" % key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.entry_path(key), "rb") as f:
+                ret = f.read()
+        except FileNotFoundError:
+            self.record("misses")
+            return None
+        self.record("hits")
+        return ret
+
+    def put(self, key: str, outbytes: bytes) -> None:
+        self.write_atomically(self.entry_path(key), outbytes)
+
+    def write_atomically(self, path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def read_stats(self) -> Dict[str, int]:
+        try:
+            with open(self.stats_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+    def record(self, outcome: str) -> None:
+        # Compilers running at the same time can lose each other's updates,
+        # but these are only statistics
+        stats = self.read_stats()
+        stats[outcome] += 1
+        self.write_atomically(self.stats_path, json.dumps(stats).encode("utf8"))
+
+    def describe(self) -> str:
+        stats = self.read_stats()
+        entries = 0
+        size = 0
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(".slb"):
+                    entries += 1
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+        return "%d hits, %d misses, %d entries (%d bytes)" % (stats["hits"], stats["misses"], entries, size)
@@ -95,6 +95,8 @@ class SegmentEmitterMethod(SegmentEmitter[emitter.MethodSegment]):
         SegmentEmitter.__init__(self, "method")
 
     def emit(self, segment: emitter.MethodSegment) -> bytes:
+        if segment.encoded is not None:
+            return segment.encoded
         ret = SegmentEmitter.emit(self, segment)
         header = struct.pack("!IIII", segment.num_registers, segment.signature.nargs, len(segment.opcodes), len(segment.emitter.type_references)) + encode_str(segment.signature.name)
         body_header = b""
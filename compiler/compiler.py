@@ -1,94 +1,154 @@
-import emitter
-import parser
-import header
+import buildcache
 import argparse
 import os.path
-
-argparser = argparse.ArgumentParser()
-argparser.add_argument("file")
-argparser.add_argument("--no-metadata", action="store_true", help="don't include metadata")
-argparser.add_argument("--ast", action="store_true", help="display AST (for debugging)")
-argparser.add_argument("--ast-after", action="store_true", help="display AST after bytecode generation (for debugging)")
-argparser.add_argument("--segments", action="store_true", help="display segments (for debugging)")
-argparser.add_argument("--static-values", action="store_true", help="display values of static variables")
-argparser.add_argument("--hexdump", action="store_true", help="display hexdump (for debugging)")
-argparser.add_argument("--headers", action="store_true", help="display headers (for debugging)")
-argparser.add_argument("--signatures", action="store_true", help="display signatures (for debugging)")
-argparser.add_argument("--directives", action="store_true", help="display using and namespace directives (for debugging)")
-argparser.add_argument("--parse-only", action="store_true", help="parse only, don't compile (for debugging)")
-argparser.add_argument("--no-stdlib", action="store_true", help="don't link against standard library")
-argparser.add_argument("-o", "--output", metavar="file", help="file for bytecode output")
-argparser.add_argument("-i", "--include", metavar="file", action="append", help="files to link against")
-argparser.add_argument("-j", "--include-json", metavar="file", action="append", help="json to link against")
-args = argparser.parse_args()
-
-if args.output is None:
-    args.output = "%s.slb" % args.file[:-4]
-
-with open(args.file, "r") as f:
-    tree = parser.Parser(parser.Toker("\n" + f.read())).parse()
-
-if args.ast:
-    tree.output()
-
-if args.parse_only:
-    import sys
-    sys.exit(0)
-
-compiler = emitter.Emitter(tree)
-program = compiler.emit_program()
-
-# This used to come after the other includes. Why did I change it? With the
-# current implementation, If an include depends on something else, that
-# something else needs to be included first. That might seem like a problem,
-# but it really isn't: I already don't allow cyclic dependencies
-if not args.no_stdlib:
-    compiler_dir = os.path.dirname(__file__)
-    program.add_include(header.from_slb(os.path.join(compiler_dir, "stdlib/bin/stdlib.slb")))
-
-if args.include:
-    for include in args.include:
-        program.add_include(header.from_slb(include))
-
-if args.include_json:
-    for include in args.include_json:
-        program.add_include(header.from_json(include))
-
-program.prescan()
-if args.directives:
-    if program.namespace is not None:
-        print("Namespace: '%s'" % program.namespace)
-    for using_directive in program.using_directives:
-        print("Using: '%s'" % using_directive)
-if args.signatures:
-    for signature in program.top.xattrs["signatures"]:
-        print("    %s" % signature)
-program.evaluate()
-
-if not args.no_metadata:
-    program.add_metadata()
-
-if args.segments:
-    for segment in program.segments:
-        segment.print_()
-
-if args.static_values:
-    print("Static variables:")
-    for variable in program.static_variables.variables.values():
-        print("%s = %s" % (variable, variable.initializer.human_representation()))
-
-if args.headers:
-    import json
-    print(json.dumps(program.get_header_representation().serialize(), indent=4))
-if args.ast_after:
-    tree.output()
-
-outbytes = compiler.emit_bytes(program)
-
-if args.hexdump:
-    import binascii
-    print(binascii.hexlify(outbytes).decode("ascii"))
-
-# I don't really know what's going on here, but it's some sort of mypy quirk
-with open(args.output, "wb") as f: # type: ignore
-    f.write(outbytes) # type: ignore
+import sys
+from typing import Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import header
+
+stdlib_path = os.path.join(os.path.dirname(__file__), "stdlib/bin/stdlib.slb")
+
+def add_arguments(argparser: argparse.ArgumentParser) -> None:
+    # These are the options for compiling a file, which batch.py shares
+    argparser.add_argument("--no-metadata", action="store_true", help="don't include metadata")
+    argparser.add_argument("--ast", action="store_true", help="display AST (for debugging)")
+    argparser.add_argument("--ast-after", action="store_true", help="display AST after bytecode generation (for debugging)")
+    argparser.add_argument("--segments", action="store_true", help="display segments (for debugging)")
+    argparser.add_argument("--static-values", action="store_true", help="display values of static variables")
+    argparser.add_argument("--hexdump", action="store_true", help="display hexdump (for debugging)")
+    argparser.add_argument("--headers", action="store_true", help="display headers (for debugging)")
+    argparser.add_argument("--signatures", action="store_true", help="display signatures (for debugging)")
+    argparser.add_argument("--directives", action="store_true", help="display using and namespace directives (for debugging)")
+    argparser.add_argument("--parse-only", action="store_true", help="parse only, don't compile (for debugging)")
+    argparser.add_argument("--no-stdlib", action="store_true", help="don't link against standard library")
+    argparser.add_argument("--no-register-allocation", action="store_true", help="give every temporary its own register (for debugging)")
+    argparser.add_argument("--no-dead-code-elimination", action="store_true", help="keep unreachable code and redundant jumps (for debugging)")
+    argparser.add_argument("--no-copy-propagation", action="store_true", help="keep redundant MOVs and unused results (for debugging)")
+    argparser.add_argument("-i", "--include", metavar="file", action="append", help="files to link against")
+    argparser.add_argument("-j", "--include-json", metavar="file", action="append", help="json to link against")
+    argparser.add_argument("--jobs", metavar="N", type=int, default=1, help="emit methods in N processes (ignored with --segments)")
+    argparser.add_argument("--cache-dir", metavar="dir", help="reuse the output of an earlier identical compilation from this directory")
+    argparser.add_argument("--cache-stats", action="store_true", help="display build cache statistics")
+
+def read_header(path: str, is_json: bool) -> "header.HeaderRepresentation":
+    import header
+    return header.from_json(path) if is_json else header.from_slb(path)
+
+def compile_file(args: argparse.Namespace, read_header: Callable[[str, bool], "header.HeaderRepresentation"] = read_header) -> None:
+    # This compiles args.file to args.output. read_header is given the path of
+    # each file to link against, and whether it's JSON, and returns its
+    # headers, which batch.py uses to only read each file once.
+    cache = None
+    cache_key = None
+    if args.cache_dir is not None:
+        cache = buildcache.BuildCache(args.cache_dir)
+        include_paths = ([] if args.no_stdlib else [stdlib_path]) + (args.include or []) + (args.include_json or [])
+        includes = []
+        for include_path in include_paths:
+            with open(include_path, "rb") as f:
+                includes.append(f.read())
+        # These are the options that affect the output
+        options = ["--include"] * len(args.include or []) + ["--include-json"] * len(args.include_json or [])
+        options += [flag for flag in ["no_metadata", "no_stdlib", "no_register_allocation", "no_dead_code_elimination", "no_copy_propagation"] if getattr(args, flag)]
+        with open(args.file, "rb") as f:
+            cache_key = cache.key(f.read(), includes, options)
+        # The debugging output needs an actual compilation
+        debugging = any([args.ast, args.ast_after, args.segments, args.static_values, args.hexdump, args.headers, args.signatures, args.directives, args.parse_only])
+        cached = cache.get(cache_key) if not debugging else None
+        if cached is not None:
+            with open(args.output, "wb") as f: # type: ignore
+                f.write(cached) # type: ignore
+            if args.cache_stats:
+                print("Build cache hit: %s" % cache.describe())
+            return
+
+    # These take a while to import, which there's no need to do for a cache hit
+    import emitter
+    import parser
+
+    with open(args.file, "r") as f:
+        tree = parser.Parser(parser.Toker("\n" + f.read())).parse()
+
+    if args.ast:
+        tree.output()
+
+    if args.parse_only:
+        return
+
+    compiler = emitter.Emitter(tree)
+    program = compiler.emit_program()
+    program.register_allocation = not args.no_register_allocation
+    program.dead_code_elimination = not args.no_dead_code_elimination
+    program.copy_propagation = not args.no_copy_propagation
+    # Segments emitted by another process can't be displayed
+    program.jobs = args.jobs if not args.segments else 1
+
+    # This used to come after the other includes. Why did I change it? With the
+    # current implementation, If an include depends on something else, that
+    # something else needs to be included first. That might seem like a problem,
+    # but it really isn't: I already don't allow cyclic dependencies
+    if not args.no_stdlib:
+        program.add_include(read_header(stdlib_path, False))
+
+    if args.include:
+        for include in args.include:
+            program.add_include(read_header(include, False))
+
+    if args.include_json:
+        for include in args.include_json:
+            program.add_include(read_header(include, True))
+
+    program.prescan()
+    if args.directives:
+        if program.namespace is not None:
+            print("Namespace: '%s'" % program.namespace)
+        for using_directive in program.using_directives:
+            print("Using: '%s'" % using_directive)
+    if args.signatures:
+        for signature in program.top.xattrs["signatures"]:
+            print("    %s" % signature)
+    program.evaluate()
+
+    if not args.no_metadata:
+        program.add_metadata()
+
+    if args.segments:
+        for segment in program.segments:
+            segment.print_()
+
+    if args.static_values:
+        print("Static variables:")
+        for variable in program.static_variables.variables.values():
+            print("%s = %s" % (variable, variable.initializer.human_representation()))
+
+    if args.headers:
+        import json
+        print(json.dumps(program.get_header_representation().serialize(), indent=4))
+    if args.ast_after:
+        tree.output()
+
+    outbytes = compiler.emit_bytes(program)
+
+    if args.hexdump:
+        import binascii
+        print(binascii.hexlify(outbytes).decode("ascii"))
+
+    # I don't really know what's going on here, but it's some sort of mypy quirk
+    with open(args.output, "wb") as f: # type: ignore
+        f.write(outbytes) # type: ignore
+
+    if cache is not None and cache_key is not None:
+        cache.put(cache_key, outbytes)
+        if args.cache_stats:
+            print("Build cache %s: %s" % ("bypassed" if debugging else "miss", cache.describe()))
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("file")
+    argparser.add_argument("-o", "--output", metavar="file", help="file for bytecode output")
+    add_arguments(argparser)
+    args = argparser.parse_args()
+    if args.output is None:
+        args.output = "%s.slb" % args.file[:-4]
+    compile_file(args)
@@ -0,0 +1,117 @@
+# Copy propagation and dead store elimination over the opcodes of a single
+# method.
+#
+# MethodEmitter puts the result of every expression in a fresh register, so
+# reading a local MOVs it into a temporary for whatever reads it, and
+# assigning to a local computes the value into a temporary and then MOVs it
+# over. Where the temporary is only used by the MOV and one other opcode,
+# this has that opcode use the local directly. Which registers an opcode reads
+# and writes comes from the "reads" and "writes" in opcodes.json.
+import bisect
+import flow
+import opcodes as opcodes_module
+import emitter
+from typing import List, Dict, Set
+
+# These opcodes have no effect other than writing their result, and can't
+# fail, so they can be removed if nothing reads their result
+PURE_OPCODES = {
+    "LOAD", "ZERO", "MOV", "EQUALS", "LT", "LTEQ", "GT", "GTEQ", "ADD", "TWOCOMP",
+    "MULT", "XOR", "AND", "OR", "INVERT"
+}
+
+def locate_registers(registers: "List[List[emitter.RegisterHandle]]") -> Dict[int, List[int]]:
+    # This maps each register to the indices of the opcodes using it, in order
+    ret: Dict[int, List[int]] = dict()
+    for i, registers_of_opcode in enumerate(registers):
+        for register in registers_of_opcode:
+            ret.setdefault(id(register), []).append(i)
+    return ret
+
+def find_basic_blocks(opcodes: List[opcodes_module.OpcodeInstance]) -> List[int]:
+    # This numbers the basic block each opcode is in
+    jump_targets = flow.jump_targets(opcodes)
+    ret: List[int] = []
+    block = 0
+    for i, opcode in enumerate(opcodes):
+        if i > 0 and (id(opcode) in jump_targets or len(flow.instruction_params(opcodes[i - 1])) > 0 or opcodes[i - 1].opcode.mneumonic == "RETURN"):
+            block += 1
+        ret.append(block)
+    return ret
+
+def register_params(opcode: opcodes_module.OpcodeInstance, indices: List[int], register: "emitter.RegisterHandle") -> List[int]:
+    return [i for i in indices if isinstance(i, int) and opcode.opcode.params[i] == "register" and opcode.params[i] is register]
+
+def same_type(first: "emitter.RegisterHandle", second: "emitter.RegisterHandle") -> bool:
+    # The interpreter relies on register types, so a register can only stand
+    # in for another of the same type
+    return first.type.bytecode_name == second.type.bytecode_name
+
+def propagate_copies(opcodes: List[opcodes_module.OpcodeInstance]) -> bool:
+    reads = locate_registers([opcode.registers_read() for opcode in opcodes])
+    writes = locate_registers([opcode.registers_written() for opcode in opcodes])
+    blocks = find_basic_blocks(opcodes)
+    removed: Set[int] = set()
+    for i, mov in enumerate(opcodes):
+        if mov.opcode.mneumonic != "MOV":
+            continue
+        source = mov.params[0]
+        destination = mov.params[1]
+        assert isinstance(source, emitter.RegisterHandle) and isinstance(destination, emitter.RegisterHandle)
+        if not same_type(source, destination) or source is destination:
+            continue
+
+        # If the source is a temporary that was just written, write the
+        # destination directly instead. Every opcode reads its operands before
+        # writing its result, so this is fine even if it reads the destination.
+        if i > 0 and blocks[i - 1] == blocks[i] and reads[id(source)] == [i] and writes.get(id(source)) == [i - 1]:
+            previous = opcodes[i - 1]
+            written = register_params(previous, previous.opcode.writes, source)
+            if len(written) == 1 and len(register_params(previous, previous.opcode.reads, source)) == 0:
+                previous.params[written[0]] = destination
+                removed.add(id(mov))
+                reads[id(source)] = []
+                writes[id(source)] = []
+                writes[id(destination)].remove(i)
+                bisect.insort(writes[id(destination)], i - 1)
+                continue
+
+        # If the destination is a temporary that's read once further on in the
+        # same basic block, read the source there instead, as long as the
+        # source doesn't change in between
+        if len(reads.get(id(destination), [])) != 1 or writes[id(destination)] != [i]:
+            continue
+        consumer_index = reads[id(destination)][0]
+        if consumer_index <= i or blocks[consumer_index] != blocks[i]:
+            continue
+        source_writes = writes.get(id(source), [])
+        next_source_write = bisect.bisect_right(source_writes, i)
+        if next_source_write < len(source_writes) and source_writes[next_source_write] < consumer_index:
+            continue
+        consumer = opcodes[consumer_index]
+        for index in register_params(consumer, consumer.opcode.reads, destination):
+            consumer.params[index] = source
+        removed.add(id(mov))
+        reads[id(destination)] = []
+        writes[id(destination)] = []
+        reads[id(source)].remove(i)
+        bisect.insort(reads[id(source)], consumer_index)
+    flow.remove_opcodes(opcodes, removed)
+    return len(removed) > 0
+
+def eliminate_dead_stores(opcodes: List[opcodes_module.OpcodeInstance]) -> bool:
+    # The last opcode is never removed, since jumps to it would have nowhere to go
+    removable = [opcode.opcode.mneumonic in PURE_OPCODES for opcode in opcodes[:-1]] + [False]
+    liveness = flow.Liveness(flow.MethodFlow(opcodes), removable)
+    removed = set(id(opcode) for i, opcode in enumerate(opcodes) if removable[i] and not liveness.is_result_live(i))
+    flow.remove_opcodes(opcodes, removed)
+    return len(removed) > 0
+
+def optimize(opcodes: List[opcodes_module.OpcodeInstance]) -> None:
+    # This modifies opcodes in place. Removing a store can leave a MOV with
+    # nothing else using its source, and vice versa, so keep going until
+    # nothing changes.
+    changed = True
+    while changed:
+        changed = propagate_copies(opcodes)
+        changed = eliminate_dead_stores(opcodes) or changed
@@ -0,0 +1,97 @@
+# Dead code elimination over the opcodes of a single method.
+#
+# MethodEmitter emits every statement, even ones that can never run (after a
+# return, or in the body of an if(false)), and the jumps it emits for control
+# flow often go nowhere useful: an if statement without an else ends in a NOP,
+# and a loop nested at the end of another loop jumps straight to a GOTO. This
+# removes what can't be reached, and straightens out the jumps that are left.
+import flow
+import opcodes as opcodes_module
+from opcodes import opcodes as ops
+from typing import List, Optional, Set
+
+def fold_constant_jumps(opcodes: List[opcodes_module.OpcodeInstance]) -> bool:
+    # After constant folding, the condition of an if(false) or while(true) is
+    # LOADed right before its JF. As long as nothing jumps to the JF directly,
+    # we know which way it goes.
+    jump_targets = flow.jump_targets(opcodes)
+    changed = False
+    for i in range(1, len(opcodes)):
+        jf = opcodes[i]
+        load = opcodes[i - 1]
+        if jf.opcode.mneumonic != "JF" or load.opcode.mneumonic != "LOAD" or id(jf) in jump_targets or load.params[0] is not jf.params[0]:
+            continue
+        if load.params[1] == 0:
+            replacement = ops["goto"].ins(flow.cast_instruction(jf.params[1]), node=jf.node)
+        else:
+            replacement = ops["nop"].ins(node=jf.node)
+        replacement.annotations = jf.annotations
+        opcodes[i] = replacement
+        changed = True
+    return changed
+
+def remove_unreachable(opcodes: List[opcodes_module.OpcodeInstance]) -> bool:
+    method_flow = flow.MethodFlow(opcodes)
+    reachable = [False] * len(opcodes)
+    worklist = [0] if len(opcodes) > 0 else []
+    while len(worklist) > 0:
+        i = worklist.pop()
+        if reachable[i]:
+            continue
+        reachable[i] = True
+        worklist += method_flow.successors[i]
+    # Nothing that's reachable can jump to something that isn't, so there's
+    # nothing to retarget.
+    opcodes[:] = [opcode for opcode, keep in zip(opcodes, reachable) if keep]
+    return not all(reachable)
+
+def follow_gotos(opcode: opcodes_module.OpcodeInstance) -> opcodes_module.OpcodeInstance:
+    seen: Set[int] = set()
+    while opcode.opcode.mneumonic == "GOTO" and id(opcode) not in seen:
+        seen.add(id(opcode))
+        opcode = flow.cast_instruction(opcode.params[0])
+    return opcode
+
+def remove_redundant_jumps(opcodes: List[opcodes_module.OpcodeInstance]) -> bool:
+    # NOPs, and jumps to the next instruction, do nothing. They can be removed
+    # as long as there's an instruction after them for jumps to them to go to
+    # instead.
+    method_flow = flow.MethodFlow(opcodes)
+    # This is where jumps to each opcode end up after removing redundant ones
+    destinations: List[opcodes_module.OpcodeInstance] = list(opcodes)
+    next_kept: Optional[opcodes_module.OpcodeInstance] = None
+    removed: Set[int] = set()
+    for i in reversed(range(len(opcodes))):
+        opcode = opcodes[i]
+        redundant = opcode.opcode.mneumonic == "NOP"
+        if opcode.opcode.mneumonic in ("GOTO", "JF"):
+            target = destinations[method_flow.index_of(flow.cast_instruction(opcode.params[flow.instruction_params(opcode)[0]]))]
+            redundant = target is next_kept
+        if redundant and next_kept is not None:
+            destinations[i] = next_kept
+            removed.add(id(opcode))
+        else:
+            next_kept = opcode
+    flow.remove_opcodes(opcodes, removed)
+    return len(removed) > 0
+
+def thread_jumps(opcodes: List[opcodes_module.OpcodeInstance]) -> bool:
+    # A jump to a GOTO might as well go straight to where the GOTO goes
+    changed = False
+    for opcode in opcodes:
+        for i in flow.instruction_params(opcode):
+            target = follow_gotos(flow.cast_instruction(opcode.params[i]))
+            if target is not opcode.params[i]:
+                opcode.params[i] = target
+                changed = True
+    return changed
+
+def eliminate_dead_code(opcodes: List[opcodes_module.OpcodeInstance]) -> None:
+    # This modifies opcodes in place. Each of these can make more work for
+    # the others, so keep going until none of them change anything.
+    changed = True
+    while changed:
+        changed = fold_constant_jumps(opcodes)
+        changed = thread_jumps(opcodes) or changed
+        changed = remove_unreachable(opcodes) or changed
+        changed = remove_redundant_jumps(opcodes) or changed
@@ -7,9 +7,12 @@ import parser
 import util
 import claims as clms
 import interpreter
+import regalloc
+import deadcode
+import copyprop
 import hashlib
 import itertools
-from typing import ClassVar, List, Optional, Union, TypeVar, Dict, Tuple, Generic, NoReturn, Iterator, cast
+from typing import ClassVar, List, Optional, Union, TypeVar, Dict, Set, Tuple, Generic, NoReturn, Iterator, cast
 
 class RegisterHandle:
     def __init__(self, id: int, type: "typesys.AbstractType") -> None:
@@ -42,16 +45,23 @@ def annotate(opcode: AnnotateOpcodesGenericType, annotation: str) -> AnnotateOpc
         raise ValueError()
 
 class Scopes:
+    # Every time what a name resolves to might change, the scope gets a new
+    # generation. Generations are unique across every Scopes, so the types
+    # decided for expressions can be cached until the scope changes.
+    generations: ClassVar[Iterator[int]] = itertools.count()
+
     def __init__(self) -> None:
         self.locals: List[Dict[str, RegisterHandle]] = [dict()]
         self.register_ids = 0
         self.registers: List[RegisterHandle] = []
+        self.generation = next(Scopes.generations)
 
     def push(self) -> None:
         self.locals.append(dict())
 
     def pop(self) -> None:
         self.locals.pop()
+        self.generation = next(Scopes.generations)
 
     def allocate(self, typ: "typesys.AbstractType") -> RegisterHandle:
         ret = RegisterHandle(self.register_ids, typ)
@@ -71,6 +81,7 @@ class Scopes:
         for local in reversed(self.locals):
             if key in local:
                 local[key] = register
+                self.generation = next(Scopes.generations)
                 return
         node.compile_error("Assigned local before declaration: %s" % key)
 
@@ -94,6 +105,7 @@ class Scopes:
             node.compile_error("Redeclaring local: %s" % key)
 
         self.locals[len(self.locals) - 1][key] = register
+        self.generation = next(Scopes.generations)
 
 class StaticVariable:
     def __init__(self, variable_set: "StaticVariableSet", name: str, type: typesys.AbstractType, initializer: interpreter.AbstractInterpreterValue, included: bool = False) -> None:
@@ -357,6 +369,28 @@ class MethodEmitter(SegmentEmitter):
         # the constructor, but nothing that accesses it will be called before
         # it's initialized.
         self.return_type: typesys.AbstractType
+        # These are the locals whose values are known at compile time: they're
+        # initialized to a constant expression and never assigned to. Reading
+        # one is folded into a LOAD of its value.
+        self.constant_locals: Dict[RegisterHandle, interpreter.AbstractInterpreterValue] = {}
+        self.assigned_names = MethodEmitter.find_assigned_names(top)
+
+    @staticmethod
+    def find_assigned_names(node: parser.Node) -> "Set[str]":
+        ret: Set[str] = set()
+        if node.of("assignment", "+=", "*=", "-=", "/=", "++", "--") and node[0].i("ident"):
+            ret.add(node[0].data_strict)
+        for child in node:
+            ret |= MethodEmitter.find_assigned_names(child)
+        return ret
+
+    def resolve_constant_local(self, node: parser.Node) -> Optional[interpreter.AbstractInterpreterValue]:
+        if self.program.static_variables.has_variable(node.data_strict) or not self.scope.exists(node.data_strict):
+            return None
+        return self.constant_locals.get(self.scope.resolve(node.data_strict, node))
+
+    def fold_constant(self, node: parser.Node) -> Optional[interpreter.AbstractInterpreterValue]:
+        return self.program.interpreter.try_fold(node, self.resolve_constant_local, self.scope.generation)
 
     def emit_to_method_signature(self, node: parser.Node, opcodes: "List[opcodes_module.OpcodeInstance]") -> Tuple[MethodSignature, Optional[RegisterHandle]]:
         if util.get_flattened(node) is not None and self.program.get_method_signature_optional(util.nonnull(util.get_flattened(node))) is not None:
@@ -385,7 +419,12 @@ class MethodEmitter(SegmentEmitter):
 
     def emit_expr(self, node: parser.Node, register: RegisterHandle) -> List[opcodes_module.OpcodeInstance]:
         opcodes = []
-        if node.i("number"):
+        folded = self.fold_constant(node) if not node.of("number", "true", "false") else None
+        if isinstance(folded, interpreter.InterpreterValueInteger):
+            opcodes.append(annotate(ops["load"].ins(register, folded.value, node=node), "constant %d" % self.program.interpreter.to_signed(folded.value)))
+        elif isinstance(folded, interpreter.InterpreterValueBoolean):
+            opcodes.append(annotate(ops["load"].ins(register, 1 if folded.value else 0, node=node), "constant %s" % folded.human_representation()))
+        elif node.i("number"):
             nt = int(node.data_strict)
             opcodes.append(ops["load"].ins(register, abs(nt), node=node))
             if nt < 0:
@@ -393,16 +432,12 @@ class MethodEmitter(SegmentEmitter):
         elif node.i("string"):
             string_val = node.data_strict
 
-            numerical_values: List[interpreter.AbstractInterpreterValue] = []
-            for ch in string_val:
-                numerical_values.append(self.program.interpreter.create_int_value(ord(ch)))
             string_array_type = self.types.get_array_type(self.types.int_type)
-            interpreter_value = interpreter.InterpreterValueArray(string_array_type, numerical_values)
             # If we have the same string going into the same register multiple
             # times then we'll end up with duplication here, but it's fine
             # since StaticVariableSet implements a last-value-wins mapping
             static_var_name = "--string-%s-%d-%s" % (self.signature.name, register.id, hashlib.md5(string_val.encode("utf8")).hexdigest())
-            self.program.static_variables.add_variable(StaticVariable(self.program.static_variables, static_var_name, string_array_type, interpreter_value))
+            self.program.add_string_variable(static_var_name, string_val)
 
             string_array_register = self.scope.allocate(string_array_type)
             opcodes.append(annotate(ops["staticvarget"].ins(static_var_name, string_array_register, node=node), "string instantiation"))
@@ -586,6 +621,7 @@ class MethodEmitter(SegmentEmitter):
             ctor_signature = clazz_signature.ctor_signatures[0]
             if len(node["params"]) != len(ctor_signature.args) - 1:
                 node.compile_error("Expected %s arguments, got %s" % (len(ctor_signature.args), len(node.children) - 1 + 1))
+            ctor_param_registers: List[RegisterHandle] = []
             for param, index in zip(node["params"], itertools.count()):
                 inferred_type = self.types.decide_type(param, self.scope, self.generic_type_context)
                 declared_type = ctor_signature.args[index + 1]
@@ -593,7 +629,12 @@ class MethodEmitter(SegmentEmitter):
                     raise typesys.TypingError(node, "Invalid parameter type: '%s' is not assignable to '%s'" % (inferred_type, declared_type))
                 reg = self.scope.allocate(inferred_type)
                 opcodes += self.emit_expr(param, reg)
-                opcodes.append(ops["param"].ins(reg, index, node=node))
+                ctor_param_registers.append(reg)
+            # Evaluating every argument before the first PARAM matters: a
+            # nested call would clobber the parameters, and an allocation could
+            # move objects that the parameters still point to.
+            for i in range(len(ctor_param_registers)):
+                opcodes.append(ops["param"].ins(ctor_param_registers[i], i, node=node))
             opcodes.append(ops["classcall"].ins(result_register, ctor_signature, self.scope.allocate(self.types.bool_type), node=node))
             opcodes.append(ops["mov"].ins(result_register, register, node=node))
         elif node.i("["):
@@ -723,6 +764,10 @@ class MethodEmitter(SegmentEmitter):
 
             reg = self.scope.allocate(type)
             self.scope.let(node[0].data_strict, reg, node)
+            if len(node) > 2 and node[0].data_strict not in self.assigned_names:
+                value = self.fold_constant(node[2])
+                if value is not None:
+                    self.constant_locals[reg] = value
 
             if len(node) > 2:
                 opcodes += annotate(self.emit_expr(node[2], reg), "let %s" % node[0].data)
@@ -760,13 +805,16 @@ class MethodEmitter(SegmentEmitter):
                 raise typesys.TypingError(node, "LHS and RHS of arithmetic must be numerical, not %s and %s" % (lhs_reg.type, rhs_reg.type))
             if node.i("-="):
                 opcodes.append(ops["twocomp"].ins(rhs_reg, node=node))
+            # The result gets its own register, so that copy propagation can
+            # write it straight to the LHS
+            result_reg = self.scope.allocate(lhs_reg.type)
             opcodes.append(ops[{
                 "+=": "add",
                 "-=": "add",
                 "*=": "mult",
                 "/=": "div"
-            }[node.type]].ins(lhs_reg, rhs_reg, lhs_reg, node=node))
-            opcodes += self.assign_to_expr(node[0], lhs_reg)
+            }[node.type]].ins(lhs_reg, rhs_reg, result_reg, node=node))
+            opcodes += self.assign_to_expr(node[0], result_reg)
         elif node.i("while"):
             result_opcodes: List[opcodes_module.OpcodeInstance] = []
             condition_register = self.scope.allocate(self.types.decide_type(node[0], self.scope, self.generic_type_context))
@@ -840,11 +888,10 @@ class MethodEmitter(SegmentEmitter):
             lhs_reg = self.scope.allocate(lhs_type)
             opcodes += annotate(self.emit_expr(node[0], lhs_reg), "++ expression")
             reg = self.scope.allocate(self.types.int_type)
-            opcodes.append(ops["load"].ins(reg, 1, node=node))
-            if node.i("--"):
-                opcodes.append(ops["twocomp"].ins(reg, node=node))
-            opcodes.append(ops["add"].ins(reg, lhs_reg, reg, node=node))
-            opcodes += self.assign_to_expr(node[0], reg)
+            opcodes.append(ops["load"].ins(reg, 1 if node.i("++") else 0xffffffffffffffff, node=node))
+            result_reg = self.scope.allocate(lhs_type)
+            opcodes.append(ops["add"].ins(reg, lhs_reg, result_reg, node=node))
+            opcodes += self.assign_to_expr(node[0], result_reg)
         elif node.i("super"):
             emitted_opcodes: List[opcodes_module.OpcodeInstance] = []
             # Note that we don't check if we're in a constructor. Though I can't
@@ -915,10 +962,19 @@ class MethodSegment(Segment):
         self.num_registers: int
         self.scope: Scopes
         self.emitter: MethodEmitter
+        # When methods are emitted in parallel (see parallel.py), this is the
+        # bytecode the segment was emitted as, and the above aren't set
+        self.encoded: Optional[bytes] = None
 
     def emit_opcodes(self, program: "Program") -> List[opcodes_module.OpcodeInstance]:
         emitter = MethodEmitter(self.method, program, self.signature)
         ret = emitter.emit()
+        if program.dead_code_elimination:
+            deadcode.eliminate_dead_code(ret)
+        if program.copy_propagation:
+            copyprop.optimize(ret)
+        if program.register_allocation:
+            regalloc.allocate_registers(ret, emitter.scope, self.signature.nargs)
         # TODO: This is spaghetti code
         self.emitter = emitter
         self.num_registers = emitter.scope.register_ids
@@ -1054,6 +1110,8 @@ class ClazzSignature:
         self.implemented_interfaces = implemented_interfaces
         self.generic_type_context = generic_type_context
         self.specializations: "List[ClazzSignature]" = []
+        # This maps the type arguments of each specialization to it
+        self.specializations_by_arguments: "Dict[Tuple[typesys.AbstractType, ...], ClazzSignature]" = dict()
         self.type_arguments = type_arguments
         self.raw_signature = self if raw_signature is None else raw_signature
 
@@ -1242,10 +1300,11 @@ class ClazzSignature:
             parameters = self.type_arguments.compose(parameters)
         if self.raw_signature is not self:
             return self.raw_signature.specialize_with_parameters(parameters, types, node)
-        for specialization in self.specializations:
-            # A specialization can't have null type arguments
-            if util.nonnull(specialization.type_arguments).is_equivalent(parameters):
-                return specialization
+        # Types are never duplicated, so equivalent type arguments are the same
+        # types in the same order
+        existing = self.specializations_by_arguments.get(tuple(parameters.parameters))
+        if existing is not None:
+            return existing
         ret = ClazzSignature(
             self.name,
             [],
@@ -1260,7 +1319,9 @@ class ClazzSignature:
             self.is_included
         )
         ret.specializations = self.specializations
+        ret.specializations_by_arguments = self.specializations_by_arguments
         self.specializations.append(ret)
+        self.specializations_by_arguments[tuple(parameters.parameters)] = ret
         types.accept_class_signature(ret)
         parameters.verify_valid_arguments(node)
         if self.parent_type is not None:
@@ -1471,6 +1532,15 @@ class Program:
         self.static_variables: StaticVariableSet = StaticVariableSet(self)
         self.interpreter: interpreter.Interpreter = interpreter.Interpreter(self)
         self.interfaces: List[Interface] = []
+        # These are set from the command line, for debugging
+        self.register_allocation = True
+        self.dead_code_elimination = True
+        self.copy_propagation = True
+        # This is how many processes emit methods (see parallel.py)
+        self.jobs = 1
+        # These are the names and values of the static variables added for
+        # string literals, in the order they were added
+        self.string_variables: List[Tuple[str, str]] = []
 
     @property
     def search_paths(self) -> List[str]:
@@ -1532,10 +1602,21 @@ class Program:
             interface_segment = InterfaceSegment(interface)
             self.segments.append(interface_segment)
             interface_segment.evaluate(self)
-        for method in self.methods:
-            method.evaluate(self)
+        if self.jobs > 1:
+            import parallel
+            parallel.evaluate_methods(self)
+        else:
+            for method in self.methods:
+                method.evaluate(self)
         self.segments.append(StaticVariableSegment(self.static_variables))
 
+    def add_string_variable(self, name: str, value: str) -> None:
+        # String literals are stored in static variables, as arrays of characters
+        string_array_type = self.types.get_array_type(self.types.int_type)
+        characters: List[interpreter.AbstractInterpreterValue] = [self.interpreter.create_int_value(ord(ch)) for ch in value]
+        self.static_variables.add_variable(StaticVariable(self.static_variables, name, string_array_type, interpreter.InterpreterValueArray(string_array_type, characters)))
+        self.string_variables.append((name, value))
+
     def get_header_representation(self) -> header.HeaderRepresentation:
         return header.HeaderRepresentation.from_program(self)
 
@@ -0,0 +1,114 @@
+# Control flow and liveness analysis over the opcodes of a single method.
+import opcodes as opcodes_module
+import emitter
+from typing import List, Dict, Set, Optional
+
+class MethodFlow:
+    def __init__(self, opcodes: List[opcodes_module.OpcodeInstance]) -> None:
+        self.opcodes = opcodes
+        # Opcodes don't know their own index until the bytecode emitter numbers
+        # them, so we key on identity.
+        self.indices: Dict[int, int] = {id(opcode): i for i, opcode in enumerate(opcodes)}
+        self.successors: List[List[int]] = [self.find_successors(i) for i in range(len(opcodes))]
+
+    def index_of(self, opcode: opcodes_module.OpcodeInstance) -> int:
+        if id(opcode) not in self.indices:
+            raise ValueError("Jump to an opcode outside of the method. This is a compiler bug.")
+        return self.indices[id(opcode)]
+
+    def find_successors(self, i: int) -> List[int]:
+        opcode = self.opcodes[i]
+        mneumonic = opcode.opcode.mneumonic
+        fallthrough = [i + 1] if i + 1 < len(self.opcodes) else []
+        if mneumonic == "GOTO":
+            return [self.index_of(cast_instruction(opcode.params[0]))]
+        elif mneumonic == "JF":
+            return fallthrough + [self.index_of(cast_instruction(opcode.params[1]))]
+        elif mneumonic == "RETURN":
+            return []
+        return fallthrough
+
+def cast_instruction(param: opcodes_module.OpcodeParamType) -> opcodes_module.OpcodeInstance:
+    if not isinstance(param, opcodes_module.OpcodeInstance):
+        raise ValueError("Expected an instruction. This is a compiler bug.")
+    return param
+
+def instruction_params(opcode: opcodes_module.OpcodeInstance) -> List[int]:
+    return [i for i, param_type in enumerate(opcode.opcode.params) if param_type == "instruction"]
+
+def jump_targets(opcodes: List[opcodes_module.OpcodeInstance]) -> Set[int]:
+    ret: Set[int] = set()
+    for opcode in opcodes:
+        for i in instruction_params(opcode):
+            ret.add(id(opcode.params[i]))
+    return ret
+
+def remove_opcodes(opcodes: List[opcodes_module.OpcodeInstance], removed: Set[int]) -> None:
+    # This removes the opcodes whose ids are in removed from opcodes, in
+    # place. Jumps to a removed opcode go to the next opcode that's kept
+    # instead, so the last opcode can't be removed.
+    if len(removed) == 0:
+        return
+    method_flow = MethodFlow(opcodes)
+    destinations = list(opcodes)
+    next_kept: Optional[opcodes_module.OpcodeInstance] = None
+    for i in reversed(range(len(opcodes))):
+        if id(opcodes[i]) not in removed:
+            next_kept = opcodes[i]
+        elif next_kept is None:
+            raise ValueError("Attempt to remove the last opcode of a method. This is a compiler bug.")
+        else:
+            destinations[i] = next_kept
+    opcodes[:] = [opcode for opcode in opcodes if id(opcode) not in removed]
+    for opcode in opcodes:
+        for i in instruction_params(opcode):
+            opcode.params[i] = destinations[method_flow.index_of(cast_instruction(opcode.params[i]))]
+
+class Liveness:
+    # Sets of registers are represented as integer bitmasks, with one bit per
+    # register in `registers`, since methods in the standard library can get
+    # fairly long.
+    #
+    # If removable is given, the opcodes it marks as removable only read their
+    # registers if their result is live, so that opcodes which only compute
+    # values for other dead opcodes are dead as well.
+    def __init__(self, flow: MethodFlow, removable: Optional[List[bool]] = None) -> None:
+        self.flow = flow
+        self.registers: "List[emitter.RegisterHandle]" = []
+        self.bits: Dict[int, int] = dict()
+        count = len(flow.opcodes)
+        self.uses = [self.mask(opcode.registers_read()) for opcode in flow.opcodes]
+        self.defs = [self.mask(opcode.registers_written()) for opcode in flow.opcodes]
+        self.live_in = [0] * count
+        self.live_out = [0] * count
+        changed = True
+        while changed:
+            changed = False
+            for i in reversed(range(count)):
+                live_out = 0
+                for successor in flow.successors[i]:
+                    live_out |= self.live_in[successor]
+                uses = self.uses[i]
+                if removable is not None and removable[i] and live_out & self.defs[i] == 0:
+                    uses = 0
+                live_in = uses | (live_out & ~self.defs[i])
+                if live_in != self.live_in[i] or live_out != self.live_out[i]:
+                    self.live_in[i] = live_in
+                    self.live_out[i] = live_out
+                    changed = True
+
+    def bit(self, register: "emitter.RegisterHandle") -> int:
+        if id(register) not in self.bits:
+            self.bits[id(register)] = len(self.registers)
+            self.registers.append(register)
+        return self.bits[id(register)]
+
+    def mask(self, registers: "List[emitter.RegisterHandle]") -> int:
+        ret = 0
+        for register in registers:
+            ret |= 1 << self.bit(register)
+        return ret
+
+    def is_result_live(self, i: int) -> bool:
+        return self.live_out[i] & self.defs[i] != 0
+
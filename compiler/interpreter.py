@@ -1,8 +1,9 @@
-from typing import List, Generic, TypeVar
+from typing import Callable, List, Generic, Optional, TypeVar
 import typesys
 import emitter
 import parser
 import abc
+import util
 
 T = TypeVar("T", bound=typesys.AbstractType, covariant=True)
 # Not inheriting from abc.ABC: https://stackoverflow.com/a/48554367
@@ -81,12 +82,120 @@ class Interpreter:
     def create_array_value(self, type: typesys.ArrayType, values: List[AbstractInterpreterValue]) -> InterpreterValueArray:
         return InterpreterValueArray(type, values)
 
-    def normalize_negative(self, num: int) -> int:
+    def to_signed(self, num: int) -> int:
         bitmask = 0xffffffffffffffff
+        num &= bitmask
         if num & 0x8000000000000000 != 0:
-            num = (((~num) & bitmask) + 1) & bitmask
+            num -= bitmask + 1
         return num
 
+    def int_operation(self, operator: str, lhs: int, rhs: int) -> Optional[int]:
+        # This has the same semantics as the interpreter, which does all of
+        # its arithmetic on int64_t. Returns None if the result is undefined.
+        bitmask = 0xffffffffffffffff
+        lhs_value = self.to_signed(lhs)
+        rhs_value = self.to_signed(rhs)
+        if operator == "+":
+            ret = lhs_value + rhs_value
+        elif operator == "-":
+            ret = lhs_value - rhs_value
+        elif operator == "*":
+            ret = lhs_value * rhs_value
+        elif operator == "^":
+            ret = lhs_value ^ rhs_value
+        elif operator == "&":
+            ret = lhs_value & rhs_value
+        elif operator == "|":
+            ret = lhs_value | rhs_value
+        elif operator in ("/", "%"):
+            if rhs_value == 0 or (lhs_value == -0x8000000000000000 and rhs_value == -1):
+                return None
+            # Python rounds toward negative infinity, whereas C (and thus our
+            # language) rounds toward 0.
+            quotient = abs(lhs_value) // abs(rhs_value)
+            if (lhs_value < 0) != (rhs_value < 0):
+                quotient = -quotient
+            ret = quotient if operator == "/" else lhs_value - rhs_value * quotient
+        else:
+            raise ValueError("This is a compiler bug.")
+        return ret & bitmask
+
+    def int_comparison(self, operator: str, lhs: int, rhs: int) -> bool:
+        lhs_value = self.to_signed(lhs)
+        rhs_value = self.to_signed(rhs)
+        if operator == ">=":
+            return lhs_value >= rhs_value
+        elif operator == "<=":
+            return lhs_value <= rhs_value
+        elif operator == "<":
+            return lhs_value < rhs_value
+        elif operator == ">":
+            return lhs_value > rhs_value
+        raise ValueError("This is a compiler bug.")
+
+    def try_fold(self, node: parser.Node, resolve_ident: Callable[[parser.Node], Optional[InterpreterValueAny]], cache_key: Optional[int] = None) -> Optional[InterpreterValueAny]:
+        # This is like eval_expr, but only for integer and boolean expressions,
+        # and it returns None instead of raising for anything it can't
+        # evaluate, so the emitter can use it to fold constant expressions.
+        # Identifiers are looked up with resolve_ident.
+        # The emitter tries to fold every subexpression of an expression it
+        # couldn't fold, so if cache_key is given, the result for each node is
+        # cached on it (like decide_type) for as long as cache_key is the same.
+        if cache_key is None:
+            return self.try_fold_uncached(node, resolve_ident, cache_key)
+        cached = node.xattrs.get("folded")
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+        ret = self.try_fold_uncached(node, resolve_ident, cache_key)
+        node.xattrs["folded"] = (cache_key, ret)
+        return ret
+
+    def try_fold_uncached(self, node: parser.Node, resolve_ident: Callable[[parser.Node], Optional[InterpreterValueAny]], cache_key: Optional[int]) -> Optional[InterpreterValueAny]:
+        # '~' isn't folded: the emitter only inverts the low 32 bits.
+        if node.i("number"):
+            return self.create_int_value(int(node.data_strict) & 0xffffffffffffffff)
+        elif node.i("true"):
+            return self.true
+        elif node.i("false"):
+            return self.false
+        elif node.i("ident"):
+            return resolve_ident(node)
+        elif node.i("-") and len(node) == 1:
+            val = self.try_fold(node[0], resolve_ident, cache_key)
+            if not isinstance(val, InterpreterValueInteger):
+                return None
+            return self.create_int_value(-val.value & 0xffffffffffffffff)
+        elif node.i("not"):
+            val = self.try_fold(node[0], resolve_ident, cache_key)
+            if not isinstance(val, InterpreterValueBoolean):
+                return None
+            return self.false if val.value else self.true
+        elif node.of("+", "-", "*", "^", "&", "|", "/", "%", ">=", "<=", "<", ">", "==", "!=", "and", "or"):
+            lhs = self.try_fold(node[0], resolve_ident, cache_key)
+            if lhs is None:
+                return None
+            rhs = self.try_fold(node[1], resolve_ident, cache_key)
+            if rhs is None:
+                return None
+            if isinstance(lhs, InterpreterValueInteger) and isinstance(rhs, InterpreterValueInteger):
+                if node.of("==", "!="):
+                    return self.true if (lhs.value == rhs.value) ^ node.i("!=") else self.false
+                elif node.of(">=", "<=", "<", ">"):
+                    return self.true if self.int_comparison(node.type, lhs.value, rhs.value) else self.false
+                elif node.of("and", "or"):
+                    return None
+                result = self.int_operation(node.type, lhs.value, rhs.value)
+                return self.create_int_value(result) if result is not None else None
+            elif isinstance(lhs, InterpreterValueBoolean) and isinstance(rhs, InterpreterValueBoolean):
+                if node.of("==", "!="):
+                    return self.true if (lhs.value == rhs.value) ^ node.i("!=") else self.false
+                elif node.i("and"):
+                    return self.true if lhs.value and rhs.value else self.false
+                elif node.i("or"):
+                    return self.true if lhs.value or rhs.value else self.false
+            return None
+        return None
+
     def eval_expr(self, node: parser.Node) -> InterpreterValueAny:
         # TODO: Support referencing other static variables
         # Bitmask for 64-bit computation
@@ -104,17 +213,7 @@ class Interpreter:
             rhs = self.eval_expr(node[1])
             if not isinstance(lhs, InterpreterValueInteger) or not isinstance(rhs, InterpreterValueInteger):
                 raise typesys.TypingError(node, "Attempt to perform arithmetic on something that isn't an integers")
-            if node.i("+"):
-                ret = lhs.value + rhs.value
-            elif node.i("*"):
-                ret = lhs.value * rhs.value
-            elif node.i("^"):
-                ret = lhs.value ^ rhs.value
-            elif node.i("&"):
-                ret = lhs.value & rhs.value
-            elif node.i("|"):
-                ret = lhs.value | rhs.value
-            return self.create_int_value(ret & bitmask)
+            return self.create_int_value(util.nonnull(self.int_operation(node.type, lhs.value, rhs.value)))
         elif node.of("and", "or"):
             lhs = self.eval_expr(node[0])
             rhs = self.eval_expr(node[1])
@@ -135,19 +234,7 @@ class Interpreter:
             rhs = self.eval_expr(node[1])
             if not isinstance(lhs, InterpreterValueInteger) or not isinstance(rhs, InterpreterValueInteger):
                 raise typesys.TypingError(node, "Attempt to perform arithmetic on something that isn't an integers")
-            lhs_value = self.normalize_negative(lhs.value)
-            rhs_value = self.normalize_negative(rhs.value)
-            if node.i(">="):
-                ret = lhs_value >= rhs_value
-            elif node.i("<="):
-                ret = lhs_value <= rhs_value
-            elif node.i("<"):
-                ret = lhs_value < rhs_value
-            elif node.i(">"):
-                ret = lhs_value > rhs_value
-            else:
-                raise ValueError("This is a compiler bug")
-            return self.true if ret else self.false
+            return self.true if self.int_comparison(node.type, lhs.value, rhs.value) else self.false
         elif node.of("==", "!="):
             lhs = self.eval_expr(node[0])
             rhs = self.eval_expr(node[1])
@@ -159,31 +246,21 @@ class Interpreter:
             rhs = self.eval_expr(node[1])
             if not isinstance(lhs, InterpreterValueInteger) or not isinstance(rhs, InterpreterValueInteger):
                 raise typesys.TypingError(node, "Attempt to perform arithmetic on something that isn't an integers")
-            return self.create_int_value((lhs.value - rhs.value) & bitmask)
+            return self.create_int_value(util.nonnull(self.int_operation("-", lhs.value, rhs.value)))
         elif (node.i("-") and len(node) == 1) or node.i("~"):
             val = self.eval_expr(node[0])
             if not isinstance(val, InterpreterValueInteger):
                 raise typesys.TypingError(node, "Attempt to negate something that isn't an integer")
             return self.create_int_value((-val.value if node.i("-") else ~val.value) & bitmask)
-        elif node.i("/"):
+        elif node.of("/", "%"):
             lhs = self.eval_expr(node[0])
             rhs = self.eval_expr(node[1])
             if not isinstance(lhs, InterpreterValueInteger) or not isinstance(rhs, InterpreterValueInteger):
                 raise typesys.TypingError(node, "Attempt to perform arithmetic on something that isn't an integers")
-            lhs_value = lhs.value
-            rhs_value = rhs.value
-            # Make sure, if our value is negative, we're dividing by a
-            # negative rather than a very large value (due to two's
-            # complement)
-            lhs_value = self.normalize_negative(lhs_value)
-            rhs_value = self.normalize_negative(rhs_value)
-            res = lhs_value // rhs_value
-            if res * rhs.value != lhs.value:
-                # Python rounds toward negative infinity, whereas C
-                # (and thus our language) rounds toward 0.
-                if res < 0:
-                    res += 1
-            return self.create_int_value(res & bitmask)
+            result = self.int_operation(node.type, lhs.value, rhs.value)
+            if result is None:
+                node.compile_error("Division by zero or overflow in constant expression")
+            return self.create_int_value(util.nonnull(result))
         elif node.i("["):
             typ = self.program.types.decide_type(node, emitter.Scopes(), None)
             if not isinstance(typ, typesys.ArrayType):
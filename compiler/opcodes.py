@@ -19,6 +19,12 @@ class OpcodeInstance:
     def annotate(self, annotation: str) -> None:
         self.annotations.append(annotation)
 
+    def registers_read(self) -> "List[emitter.RegisterHandle]":
+        return [cast(emitter.RegisterHandle, self.params[i]) for i in self.opcode.reads if isinstance(i, int) and self.opcode.params[i] == "register"]
+
+    def registers_written(self) -> "List[emitter.RegisterHandle]":
+        return [cast(emitter.RegisterHandle, self.params[i]) for i in self.opcode.writes if isinstance(i, int) and self.opcode.params[i] == "register"]
+
     def __str__(self) -> str:
         firstpart = str(self.opcode)
         secondpart = ", ".join(str(param) if not isinstance(param, OpcodeInstance) else str(cast(OpcodeInstance, param).opcode) for param in self.params)
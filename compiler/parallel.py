@@ -0,0 +1,76 @@
+# Emitting methods in parallel, for --jobs.
+#
+# Once a program has been prescanned, emitting the body of a method only reads
+# the signatures and the type system, except that string literals add static
+# variables (see Program.add_string_variable). So the program is forked into a
+# pool of processes, which inherit it without it ever being serialized, and
+# each method is emitted in one of them. What comes back is the method's
+# bytecode, the string literals it added, and whatever it printed (such as
+# warnings), or the error it failed with. These are merged in the order the
+# methods are in, so the output is exactly what emitting them one at a time
+# would produce, except that the traceback of an error only goes as far back
+# as evaluate_methods, since its frames are in another process.
+import bytecode
+import contextlib
+import emitter
+import io
+import multiprocessing
+import sys
+from typing import List, NamedTuple, Optional, Tuple
+
+class EmittedMethod(NamedTuple):
+    # This is None iff emitting the method failed with error
+    encoded: Optional[bytes]
+    string_variables: List[Tuple[str, str]]
+    output: str
+    error: Optional[Exception]
+
+# This is the program being compiled, which pool processes get a copy of when
+# they're forked
+forked_program: "Optional[emitter.Program]" = None
+
+def emit_method(index: int) -> EmittedMethod:
+    program = forked_program
+    assert program is not None
+    method = program.methods[index]
+    string_variables_before = len(program.string_variables)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            method.evaluate(program)
+    except Exception as e:
+        # This is raised again by the parent, once it has printed the output
+        # of every method before this one
+        return EmittedMethod(None, [], output.getvalue(), e)
+    return EmittedMethod(
+        bytecode.SegmentEmitterMethod().emit(method),
+        program.string_variables[string_variables_before:],
+        output.getvalue(),
+        None
+    )
+
+def evaluate_methods(program: "emitter.Program") -> None:
+    global forked_program
+    if "fork" not in multiprocessing.get_all_start_methods():
+        # Without fork, each process would need the program to be pickled,
+        # which isn't worth it
+        for method in program.methods:
+            method.evaluate(program)
+        return
+    forked_program = program
+    # Otherwise, whatever's in the buffer would be printed again by every
+    # process in the pool when it exits
+    sys.stdout.flush()
+    try:
+        with multiprocessing.get_context("fork").Pool(program.jobs) as pool:
+            # Sending a few methods at a time keeps the overhead down
+            chunksize = max(1, len(program.methods) // (program.jobs * 4))
+            for method, emitted in zip(program.methods, pool.imap(emit_method, range(len(program.methods)), chunksize)):
+                print(emitted.output, end="")
+                if emitted.error is not None:
+                    raise emitted.error
+                method.encoded = emitted.encoded
+                for name, value in emitted.string_variables:
+                    program.add_string_variable(name, value)
+    finally:
+        forked_program = None
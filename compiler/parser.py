@@ -1,4 +1,4 @@
-import string
+import re
 from typing import NoReturn, Optional, Tuple, List, NewType, Any, Dict, Union, Iterator
 
 class ParseError(ValueError):
@@ -6,6 +6,7 @@ class ParseError(ValueError):
         ValueError.__init__(self, "%s (near line %s, char %s)" % (explanation, line, chr))
 
 class Token:
+    __slots__ = ("type", "data")
     def __init__(self, type: str, data: Optional[str]=None) -> None:
         self.type = type
         self.data = data
@@ -29,133 +30,120 @@ class Token:
     def __str__(self) -> str:
         return repr(self)
 
-TokerState = NewType("TokerState", Tuple[int, int, int])
+TokerState = NewType("TokerState", int)
 class Toker:
-    keywords = ["using", "namespace", "static", "class", "interface",
+    keywords = {"using", "namespace", "static", "class", "interface",
             "override", "entrypoint", "fn", "ctor", "extends", "implements",
             "let", "return", "while", "for", "if", "else", "new", "true",
             "false", "and", "or", "not", "null", "as", "instanceof", "super",
-            "abstract"]
+            "abstract"}
     escapes = {"n": "\n", "\\": "\\", "'": "'", "\"": "\"", "r": "\r", "0": "\0", "b": "\b", "v": "\v", "t": "\t", "f": "\f"}
-    ident_start_chars = string.ascii_letters + "_"
-    ident_chars = ident_start_chars + string.digits
+    # The alternatives are tried in order, so a comment comes before "/", and
+    # "<=" before "<". NOTE: If / does anything other than division and /=,
+    # then we need to make sure // always means a comment.
+    token_regex = re.compile(r"""
+        (?P<comment>//[^\n]*)
+        |(?P<newline>\n)
+        |(?P<space>[ \t]+)
+        |(?P<ident>[A-Za-z_][A-Za-z0-9_]*)
+        |(?P<char>'(?:\\.|[^\\])')
+        |(?P<unclosed_char>')
+        |(?P<string>"(?:\\.|[^"\\])*")
+        |(?P<unclosed_string>")
+        |(?P<number>[0-9]+)
+        |(?P<operator><=|>=|==|!=|\+=|-=|\*=|/=|\+\+|--|[][{}(),;=<>*/+\-^|&~%:.\#])
+        |(?P<unexpected>.)
+    """, re.VERBOSE | re.DOTALL)
+    escape_regex = re.compile(r"\\(.)", re.DOTALL)
+
     def __init__(self, src: str) -> None:
-        self.src = src
-        self.ptr = 0
-        self.line = 0
-        self.chn = 0
+        # The whole source is tokenized up front, so that looking ahead (and
+        # backtracking) is just indexing into these. lines and columns are
+        # where the toker is after each token, for error messages and
+        # Node.line.
+        self.tokens: List[Token] = []
+        self.lines: List[int] = []
+        self.columns: List[int] = []
+        self.index = 0
+        self.tokenize(src)
+
+    def tokenize(self, src: str) -> None:
+        line = 0
+        line_start = 0
+        for match in Toker.token_regex.finditer(src):
+            kind = match.lastgroup
+            text = match.group()
+            if kind == "newline":
+                line += 1
+                line_start = match.end()
+                continue
+            elif kind == "space" or kind == "comment":
+                continue
+            elif kind == "ident":
+                token = Token(text) if text in Toker.keywords else Token("ident", text)
+            elif kind == "number":
+                token = Token("number", text)
+            elif kind == "char":
+                token = Token("number", str(ord(self.unescape(text[1:-1], line, match.start() - line_start))))
+            elif kind == "string":
+                token = Token("string", self.unescape(text[1:-1], line, match.start() - line_start))
+            elif kind == "operator":
+                token = Token(text)
+            elif kind == "unclosed_char":
+                raise ParseError("Unclosed character literal.", line, match.start() - line_start)
+            elif kind == "unclosed_string":
+                raise ParseError("Unclosed string literal.", line, match.start() - line_start)
+            else:
+                raise ValueError("Unexpected character '%s'" % text)
+            self.tokens.append(token)
+            self.lines.append(line)
+            self.columns.append(match.end() - line_start)
+        self.tokens.append(Token("EOF"))
+        self.lines.append(line)
+        self.columns.append(len(src) - line_start)
+
+    @staticmethod
+    def unescape(body: str, line: int, column: int) -> str:
+        def replace(match: "re.Match[str]") -> str:
+            if match.group(1) not in Toker.escapes:
+                raise ParseError("Invalid escape sequence: '\\%s'" % match.group(1), line, column)
+            return Toker.escapes[match.group(1)]
+        return Toker.escape_regex.sub(replace, body)
 
-    def ch(self, num: int=1) -> str:
-        return self.src[self.ptr:self.ptr + num]
+    @property
+    def line(self) -> int:
+        return self.lines[self.index - 1] if self.index > 0 else 0
 
     @property
     def chi(self) -> int:
-        return self.ptr - self.chn
-
-    def adv(self, num: int=1) -> str:
-        self.ptr += num
-        return self.src[self.ptr - num:self.ptr]
-
-    def is_eof(self) -> bool:
-        return self.ptr >= len(self.src)
-
-    def tokenize_string_body_ch(self) -> str:
-        ch = self.adv()
-        ret = None
-        if ch == "\\":
-            ch = self.adv()
-            if ch in Toker.escapes:
-                return Toker.escapes[ch]
-            self.throw("Invalid escape sequence: '\\%s'" % ch)
-        return ch
+        return self.columns[self.index - 1] if self.index > 0 else 0
 
     def next(self) -> Token:
-        if not self.is_eof() and self.ch(2) == "//":
-            # NOTE: If / does anything other than division and /=, then we need
-            #       to make sure // always means a comment.
-            while self.ch() != "\n" and not self.is_eof():
-                self.adv()
-
-        if self.is_eof():
-            return Token("EOF")
-
-        if self.ch() in Toker.ident_start_chars:
-            s = ""
-            while self.ch() in Toker.ident_chars and not self.is_eof():
-                s += self.adv()
-            if s in self.keywords:
-                return Token(s)
-            else:
-                return Token("ident", s)
-        elif self.ch() == "'":
-            self.adv()
-            ret = ord(self.tokenize_string_body_ch())
-            if self.adv() != "'":
-                self.throw("Unclosed character literal.")
-            return Token("number", str(ret))
-        elif self.ch() == "\"":
-            self.adv()
-            s = ""
-            while self.ch() != "\"":
-                s += self.tokenize_string_body_ch()
-            self.adv()
-            return Token("string", s)
-        elif self.ch() in string.digits:
-            s = ""
-            while self.ch() in string.digits:
-                s += self.adv()
-            return Token("number", s)
-        elif self.ch(2) in ["<=", ">=", "==", "!=", "+=", "-=", "*=", "/=", "++", "--"]:
-            return Token(self.adv(2))
-        elif self.ch() in "[]{}(),;=<>*/+-^|&~%:.#":
-            return Token(self.adv())
-        elif self.ch() == "\n":
-            self.adv()
-            self.line += 1
-            self.chn = self.ptr
-            while self.ch() in " \t" and self.ptr < len(self.src):
-                self.adv()
-            return self.next()
-        elif self.ch() in " \t":
-            while self.ch() in " \t":
-                self.adv()
-            return self.next()
-        else:
-            raise ValueError("Unexpected character '%s'" % self.ch())
+        ret = self.tokens[self.index]
+        # Once we're at EOF, we stay there
+        if self.index < len(self.tokens) - 1:
+            self.index += 1
+        return ret
 
     def throw(self, explanation: str) -> NoReturn:
         raise ParseError(explanation, self.line, self.chi)
 
     def get_state(self) -> TokerState:
-        return TokerState((self.ptr, self.line, self.chn))
+        return TokerState(self.index)
 
     def set_state(self, state: TokerState) -> None:
-        self.ptr, self.line, self.chn = state
+        self.index = state
 
     def peek(self, num: int=1) -> Token:
-        state = self.get_state()
-        ret = None
-        for i in range(num):
-            ret = self.next()
-        self.set_state(state)
-        if ret is None:
-            self.throw("Unexpected EOF")
-        assert ret is not None
-        return ret
+        return self.tokens[min(self.index + num - 1, len(self.tokens) - 1)]
 
     def peek_until(self, result_types: List[str], inbetween_types: List[str]) -> Token:
-        state = self.get_state()
-        ret = None
-        while True:
-            ret = self.next()
+        for ret in self.tokens[self.index:]:
             if ret.of(*result_types):
-                break
+                return ret
             if not ret.of(*inbetween_types):
                 self.throw("Unexpected token %s, expected any of %s" % (ret, ", ".join(inbetween_types)))
-        self.set_state(state)
-        if ret is None:
-            raise ValueError("Unreachable")
-        return ret
+        raise ValueError("Unreachable")
 
     def isn(self, type: str, data: str=None, num: int=1) -> bool:
         peek = self.peek(num)
@@ -176,6 +164,9 @@ class Toker:
 last_parser: "Optional[Parser]" = None
 
 class Node:
+    # There are a lot of these, so they don't get an instance dictionary, and
+    # xattrs is only allocated for the few nodes that use it
+    __slots__ = ("type", "data", "line", "children", "_xattrs")
     def __init__(self, typ: Union[str, Token], *children: "Node", data: str=None) -> None:
         if last_parser is not None:
             self.line = last_parser.toker.line
@@ -196,7 +187,13 @@ class Node:
         else:
             raise ValueError("Unexpected type %s of typ (expected str or Token)" % type(typ))
         self.children = list(children)
-        self.xattrs: Dict[Any, Any] = dict()
+        self._xattrs: Optional[Dict[Any, Any]] = None
+
+    @property
+    def xattrs(self) -> Dict[Any, Any]:
+        if self._xattrs is None:
+            self._xattrs = dict()
+        return self._xattrs
 
     @property
     def data_strict(self) -> str:
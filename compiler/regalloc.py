@@ -0,0 +1,95 @@
+# Linear-scan register allocation.
+#
+# MethodEmitter allocates a fresh register for every local and temporary, so
+# the register file of a method grows with its length. This maps those
+# registers onto as few registers as possible by reusing a register once the
+# value in it is dead. Registers are only ever shared between values of the
+# same type, since the interpreter relies on register types (for casts,
+# instanceof, array allocation and garbage collection).
+import flow
+import emitter
+import opcodes as opcodes_module
+from typing import List, Dict
+
+class LiveInterval:
+    def __init__(self, register: "emitter.RegisterHandle", start: int, end: int) -> None:
+        self.register = register
+        # Both ends are inclusive
+        self.start = start
+        self.end = end
+
+    def __repr__(self) -> str:
+        return "LiveInterval(register=%r, start=%s, end=%s)" % (self.register, self.start, self.end)
+
+def compute_intervals(liveness: flow.Liveness) -> Dict[int, LiveInterval]:
+    # A register occupies an instruction if it's defined there, or live going
+    # in or out of it. Two registers whose intervals don't overlap are never
+    # both occupying the same instruction, so they can share.
+    intervals: Dict[int, LiveInterval] = dict()
+    for i in range(len(liveness.flow.opcodes)):
+        occupied = liveness.live_in[i] | liveness.live_out[i] | liveness.defs[i]
+        bit = 0
+        while occupied != 0:
+            if occupied & 1 == 1:
+                register = liveness.registers[bit]
+                if id(register) in intervals:
+                    intervals[id(register)].end = i
+                else:
+                    intervals[id(register)] = LiveInterval(register, i, i)
+            occupied >>= 1
+            bit += 1
+    return intervals
+
+def allocate_registers(opcodes: List[opcodes_module.OpcodeInstance], scope: "emitter.Scopes", nargs: int) -> None:
+    # This renumbers the RegisterHandles in place, and replaces scope.registers
+    # with one handle per register that's actually used.
+    liveness = flow.Liveness(flow.MethodFlow(opcodes))
+    intervals = compute_intervals(liveness)
+
+    # The calling convention puts arguments in the first registers, so those
+    # are fixed, and arguments are live from the start of the method.
+    arguments = scope.registers[:nargs]
+    allocated: "List[emitter.RegisterHandle]" = []
+    assignments: Dict[int, int] = dict()
+    active: List[LiveInterval] = []
+    free: Dict[str, List[int]] = dict()
+    for argument in arguments:
+        interval = intervals.get(id(argument), LiveInterval(argument, 0, 0))
+        interval.start = 0
+        assignments[id(argument)] = len(allocated)
+        allocated.append(emitter.RegisterHandle(len(allocated), argument.type))
+        active.append(interval)
+
+    for interval in sorted(intervals.values(), key=lambda interval: interval.start):
+        if id(interval.register) in assignments:
+            continue
+        still_active = []
+        for other in active:
+            if other.end < interval.start:
+                free.setdefault(allocated[assignments[id(other.register)]].type.bytecode_name, []).append(assignments[id(other.register)])
+            else:
+                still_active.append(other)
+        active = still_active
+
+        candidates = free.get(interval.register.type.bytecode_name, [])
+        if len(candidates) > 0:
+            assignments[id(interval.register)] = candidates.pop()
+        else:
+            assignments[id(interval.register)] = len(allocated)
+            allocated.append(emitter.RegisterHandle(len(allocated), interval.register.type))
+        active.append(interval)
+
+    for opcode in opcodes:
+        for param, param_type in zip(opcode.params, opcode.opcode.params):
+            if param_type != "register":
+                continue
+            assert isinstance(param, emitter.RegisterHandle)
+            if id(param) not in assignments:
+                raise ValueError("Register isn't read or written by its opcode. This is a compiler bug.")
+    for interval in intervals.values():
+        interval.register.id = assignments[id(interval.register)]
+    for argument in arguments:
+        argument.id = assignments[id(argument)]
+
+    scope.registers = allocated
+    scope.register_ids = len(allocated)
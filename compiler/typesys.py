@@ -4,12 +4,17 @@ import util
 import parser
 import emitter
 import enum
-from typing import Optional, List, Dict, cast
+from typing import Any, Optional, List, Dict, Tuple, cast
 
 class TypingError(Exception):
     def __init__(self, node: parser.Node, error: str) -> None:
         Exception.__init__(self, "Near line %s: %s" % (node.line, error))
 
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # Unpickling would otherwise call __init__ with just the message, and
+        # these are pickled to get them out of a --jobs worker
+        return (Exception.__new__, (TypingError,) + self.args)
+
 class AbstractType:
     def __init__(self, name: str) -> None:
         self.name = name
@@ -405,16 +410,46 @@ class TypeSystem:
         self.int_type = IntType()
         self.bool_type = BoolType()
         self.void_type = VoidType()
-        self.types = [self.int_type, self.bool_type, self.void_type]
-        self.array_types: List[ArrayType] = []
+        self.types: List[AbstractType] = []
+        # These index self.types. types_by_name maps each name to the first
+        # type with that name (a raw class comes before its specializations,
+        # which share its name), and type_positions gives the position of
+        # each type in self.types, since the first type to resolve wins.
+        self.types_by_name: Dict[str, AbstractType] = dict()
+        self.type_positions: Dict[AbstractType, int] = dict()
+        self.array_types: Dict[AbstractType, ArrayType] = dict()
+        self.clazz_types_by_signature: "Dict[emitter.ClazzSignature, ClazzType]" = dict()
         self.clazz_signatures: "List[emitter.ClazzSignature]" = []
+        for typ in [self.int_type, self.bool_type, self.void_type]:
+            self.add_type(typ)
+
+    def add_type(self, typ: AbstractType) -> None:
+        self.type_positions[typ] = len(self.types)
+        self.types.append(typ)
+        if typ.name not in self.types_by_name:
+            self.types_by_name[typ.name] = typ
+
+    def types_named(self, name: str) -> List[AbstractType]:
+        # These are the types name could refer to, in the order they were added
+        ret = [self.types_by_name[path + name] for path in self.program.search_paths if path + name in self.types_by_name]
+        ret.sort(key=lambda typ: self.type_positions[typ])
+        return ret
+
+    def get_type_by_name_optional(self, name: str) -> Optional[AbstractType]:
+        candidates = self.types_named(name)
+        return candidates[0] if len(candidates) > 0 else None
 
     def resolve(self, node: parser.Node, generic_type_context: Optional[GenericTypeContext], fail_silent: bool = False, allow_raw: bool = False) -> Optional[AbstractType]:
-        for typ in self.types:
-            if typ.resolves(node, self.program):
-                if not allow_raw and isinstance(typ, ClazzType) and typ.signature.is_raw_type:
-                    node.compile_error("Cannot use raw types directly")
-                return typ
+        # Only names (and generic classes with type arguments that are just
+        # their type parameters) can resolve to an existing type, and only to
+        # one with that name
+        name_node = node[0] if node.i("<>") else node
+        if name_node.i("ident") or name_node.i("."):
+            for typ in self.types_named(util.nonnull(util.get_flattened(name_node))):
+                if typ.resolves(node, self.program):
+                    if not allow_raw and isinstance(typ, ClazzType) and typ.signature.is_raw_type:
+                        node.compile_error("Cannot use raw types directly")
+                    return typ
         if node.i("["):
             element_type = self.resolve(node[0], generic_type_context, fail_silent=fail_silent)
             if element_type is None:
@@ -452,11 +487,11 @@ class TypeSystem:
 
     def accept_interface(self, interface: "emitter.Interface") -> InterfaceType:
         typ = InterfaceType(interface)
-        self.types.append(typ)
+        self.add_type(typ)
         return typ
 
     def get_interface_type_by_name(self, name: str) -> Optional[InterfaceType]:
-        typ = self.resolve(parser.parse_type(name), None, fail_silent=True)
+        typ = self.get_type_by_name_optional(name)
         if typ is None:
             return typ
         if not isinstance(typ, InterfaceType):
@@ -464,7 +499,7 @@ class TypeSystem:
         return typ
 
     def get_clazz_type_by_name(self, name: str) -> Optional[ClazzType]:
-        typ = self.resolve(parser.parse_type(name), None, fail_silent=True, allow_raw=True)
+        typ = self.get_type_by_name_optional(name)
         if typ is None:
             return typ
         if not isinstance(typ, ClazzType):
@@ -498,13 +533,12 @@ class TypeSystem:
 
     def accept_class_signature(self, signature: "emitter.ClazzSignature") -> None:
         self.clazz_signatures.append(signature)
-        self.types.append(ClazzType(signature, self))
+        typ = ClazzType(signature, self)
+        self.add_type(typ)
+        self.clazz_types_by_signature[signature] = typ
 
     def get_clazz_type_by_signature_optional(self, signature: "emitter.ClazzSignature") -> Optional[ClazzType]:
-        for type in self.types:
-            if isinstance(type, ClazzType) and type.signature == signature:
-                return type
-        return None
+        return self.clazz_types_by_signature.get(signature)
 
     def get_clazz_type_by_signature(self, signature: "emitter.ClazzSignature") -> ClazzType:
         ret = self.get_clazz_type_by_signature_optional(signature)
@@ -513,12 +547,11 @@ class TypeSystem:
         return ret
 
     def get_array_type(self, parent_type: AbstractType) -> ArrayType:
-        for typ in self.array_types:
-            if typ.parent_type == parent_type:
-                return typ
+        if parent_type in self.array_types:
+            return self.array_types[parent_type]
         typ = ArrayType(parent_type)
-        self.types.append(typ)
-        self.array_types.append(typ)
+        self.add_type(typ)
+        self.array_types[parent_type] = typ
         return typ
 
     def resolve_to_signature(self, node: parser.Node, scope: "emitter.Scopes", generic_type_context: Optional[GenericTypeContext]) -> "emitter.MethodSignature":
@@ -541,6 +574,17 @@ class TypeSystem:
             return None # type: ignore
 
     def decide_type(self, expr: parser.Node, scope: "emitter.Scopes", generic_type_context: Optional[GenericTypeContext], suppress_coercing_void_warning: bool = False) -> AbstractType:
+        # Deciding the type of an expression decides the type of every
+        # subexpression, and the emitter then asks again for each of them, so
+        # the result is cached on the node for as long as the scope is the same
+        cached = expr.xattrs.get("decided_type")
+        if cached is not None and cached[0] == scope.generation and cached[1] is generic_type_context and cached[2] == suppress_coercing_void_warning:
+            return cached[3]
+        ret = self.decide_type_uncached(expr, scope, generic_type_context, suppress_coercing_void_warning)
+        expr.xattrs["decided_type"] = (scope.generation, generic_type_context, suppress_coercing_void_warning, ret)
+        return ret
+
+    def decide_type_uncached(self, expr: parser.Node, scope: "emitter.Scopes", generic_type_context: Optional[GenericTypeContext], suppress_coercing_void_warning: bool) -> AbstractType:
         if expr.i("as"):
             return self.resolve_strict(expr[1], generic_type_context)
         elif expr.i("instanceof"):
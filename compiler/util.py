@@ -2,11 +2,11 @@ from typing import Optional, TypeVar, Dict
 import parser
 
 def get_flattened(nod: parser.Node) -> Optional[str]:
-    if "flattened" in nod.xattrs:
-        return nod.xattrs["flattened"]
     if nod.i("ident"):
         return nod.data
     elif nod.i("."):
+        if "flattened" in nod.xattrs:
+            return nod.xattrs["flattened"]
         flattened_left = get_flattened(nod[0])
         flattened_right = get_flattened(nod[1])
         if flattened_left is None or flattened_right is None:
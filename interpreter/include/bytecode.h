@@ -5,5 +5,6 @@
 #define BYTECODE_H
 
 struct it_PROGRAM* bc_parse_from_files(int fpc, FILE* fp[], struct it_OPTIONS* options);
+void bc_set_opcode_type(struct it_OPCODE* opcode, uint8_t type);
 
 #endif /* BYTECODE_H */
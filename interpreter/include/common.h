@@ -8,15 +8,42 @@
 #define DEBUG 0
 #define ASSERTIONS 0
 
+// Threaded dispatch uses the GCC labels-as-values extension, so it's only
+// available under GCC-compatible compilers. Build with -DTHREADED_DISPATCH=0
+// to fall back to the plain `switch` dispatch.
+#ifndef THREADED_DISPATCH
+#ifdef __GNUC__
+#define THREADED_DISPATCH 1
+#else
+#define THREADED_DISPATCH 0
+#endif
+#endif
+
+// Poisoning freed objects helps catch use-after-free bugs in the garbage
+// collector, but it touches every byte of everything that's freed. Build with
+// -DGC_POISON=1 to enable it outside of debug builds.
+#ifndef GC_POISON
+#define GC_POISON DEBUG
+#endif
+
 void fatal(char* description);
 void fatal_with_errcode(char* description, int errcode);
 void assert(bool b);
 
+enum fr_BUFFER_OWNERSHIP {
+    // The buffer was read into memory allocated with malloc
+    fr_BUFFER_ALLOCATED,
+    // The buffer is a read-only mapping of the file
+    fr_BUFFER_MAPPED,
+    // The buffer belongs to someone else and outlives the reader
+    fr_BUFFER_BORROWED
+};
 struct fr_STATE {
     FILE* fp;
     char* buffer;
     size_t bufflen;
     int index;
+    enum fr_BUFFER_OWNERSHIP ownership;
 };
 struct fr_STATE* fr_new(FILE* fp);
 struct fr_STATE* fr_new_from_buffer(int bufflen, char* buffer);
@@ -25,6 +52,7 @@ void fr_advance(struct fr_STATE* state, int qty);
 bool fr_iseof(struct fr_STATE* state);
 char fr_getchar(struct fr_STATE* state);
 void fr_rewind(struct fr_STATE* state);
+void fr_seek(struct fr_STATE* state, int index);
 uint8_t fr_getuint8(struct fr_STATE* state);
 int8_t fr_getint8(struct fr_STATE* state);
 uint16_t fr_getuint16(struct fr_STATE* state);
@@ -37,4 +65,8 @@ char* fr_getstr(struct fr_STATE* state);
 
 void* mm_malloc(size_t size);
 
+// FNV-1a, which is what the interpreter's hash tables use
+uint32_t fnv1a_hash(void* data, size_t size);
+uint32_t fnv1a_hash_string(char* str);
+
 #endif /* COMMON_H */
@@ -1,6 +1,7 @@
 #include <stdint.h>
 #include <stddef.h>
 #include <stdbool.h>
+#include <stdio.h>
 
 #ifndef INTERPRETER_H
 #define INTERPRETER_H
@@ -17,6 +18,7 @@ struct ts_GENERIC_TYPE_CONTEXT* ts_create_generic_type_context(uint32_t num_argu
 struct ts_TYPE* ts_allocate_type_parameter(char* name, struct ts_GENERIC_TYPE_CONTEXT* context, struct ts_TYPE* extends, int implementsc, struct ts_TYPE** implements);
 void ts_walk_and_reify_methods(struct it_PROGRAM* program);
 void ts_reify_generic_references(struct it_METHOD* method);
+struct it_METHOD* ts_get_unreified_method_from_reification(struct it_METHOD* reification);
 bool ts_class_is_specialization(struct ts_TYPE* type);
 bool ts_class_is_generic(struct ts_TYPE* type);
 bool ts_clazz_is_raw(struct ts_TYPE* type);
@@ -34,27 +36,93 @@ struct sv_STATIC_VAR* sv_get_var_by_name(struct it_PROGRAM* program, char* name)
 bool sv_has_var(struct it_PROGRAM* program, char* name);
 uint32_t sv_get_static_var_index_by_name(struct it_PROGRAM* program, char* name);
 
+char* sy_intern(char* str);
+bool sy_scope_is_current(void* scope, uint32_t size);
+void sy_begin_scope(void* scope, uint32_t size);
+void sy_define(void* scope, char* name, uint32_t index);
+int sy_lookup(void* scope, char* name);
+
 struct it_OPTIONS {
     bool print_return_value;
     bool gc_verbose;
     bool no_gc;
+    bool print_instruction_count;
+    bool no_fusion;
+    // This is in milliseconds. If it's zero, major collections stop the
+    // world; otherwise, they mark incrementally, in slices of about this long.
+    double gc_pause_target;
+    // This is NULL unless --profile was passed, in which case the profile is
+    // written to this followed by .txt and .folded
+    char* profile_output;
+    // This is like profile_output, but for --sample-profile
+    char* sample_profile_output;
 };
 
 void it_run(struct it_PROGRAM* prog, struct it_OPTIONS* options);
 void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options);
 void it_replace_methods(struct it_PROGRAM* prog);
+void* it_get_opcode_handler(uint8_t type);
+
+void pf_begin(struct it_PROGRAM* program, char* output_prefix, int max_depth);
+void pf_record_opcode(struct it_STACKFRAME* frame, struct it_OPCODE* opcode);
+void pf_print_method_name(FILE* fp, struct it_METHOD* method);
+
+extern struct it_STACKFRAME* volatile it_current_frame;
+void sp_begin(struct it_PROGRAM* program, char* output_prefix);
 
 void cl_arrange_method_tables(struct it_PROGRAM* program);
 int cl_get_field_index(struct ts_TYPE* clazz, char* name);
 int cl_get_method_index_optional(struct it_METHOD_TABLE* method_table, char* name);
 int cl_get_method_index(struct it_METHOD_TABLE* clazz, char* name);
+struct it_METHOD_TABLE* cl_find_interface_implementation(struct it_METHOD_TABLE* method_table, uint32_t interface_id);
 struct ts_TYPE* cl_get_or_create_interface(char* name, struct it_PROGRAM* program);
 bool cl_class_implements_interface(struct ts_TYPE* clazz, struct ts_TYPE* interface);
 struct ts_TYPE* cl_specialize_class(struct ts_TYPE* class, struct ts_TYPE_ARGUMENTS* type_arguments);
 void cl_update_class_specializations(struct it_PROGRAM* program);
 
 struct gc_OBJECT_REGISTRY* gc_register_object(union itval object, size_t allocation_size, enum ts_CATEGORY category);
+union itval gc_allocate_old(size_t allocation_size, enum ts_CATEGORY category);
+union itval gc_allocate(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options, size_t allocation_size, enum ts_CATEGORY category);
+size_t gc_array_allocation_size(uint64_t length);
+size_t gc_clazz_allocation_size(struct ts_TYPE* clazz);
+void gc_remember_object(struct gc_OBJECT_REGISTRY* entry);
+void gc_remember_static_var(struct it_PROGRAM* program, uint32_t index);
+void gc_collect_minor(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options);
 void gc_collect(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options);
-bool gc_needs_collection;
+void gc_mark(union itval reference, enum ts_CATEGORY category);
+extern bool gc_needs_collection;
+extern bool gc_marking;
+extern char* gc_nursery_start;
+extern char* gc_nursery_end;
+#define GC_IS_YOUNG(ptr) ((char*) (ptr) >= gc_nursery_start && (char*) (ptr) < gc_nursery_end)
+// This must be called whenever a value is stored into an object, and
+// GC_STATIC_VAR_WRITE_BARRIER whenever one is stored into a static variable.
+// They serve two purposes:
+//  - Minor collections need to find old objects pointing into the nursery
+//    without scanning the whole heap. For this, the value's type doesn't
+//    matter: an integer that happens to look like a young pointer just
+//    causes a redundant scan.
+//  - While a major collection is marking incrementally, a reference stored
+//    into an object that has already been scanned would otherwise be missed,
+//    so the stored value is marked (a Dijkstra-style insertion barrier).
+//    Young values don't need this, since they can't be freed by a major
+//    collection.
+#define GC_WRITE_BARRIER(container_data, value, category) \
+    do { \
+        if(GC_IS_YOUNG((value).array_data) && !GC_IS_YOUNG(container_data)) { \
+            gc_remember_object((container_data)->gc_registry_entry); \
+        } else if(gc_marking) { \
+            gc_mark((value), (category)); \
+        } \
+    } while(0)
+// Static variables are never young, so a young value is always remembered
+#define GC_STATIC_VAR_WRITE_BARRIER(program, index, value) \
+    do { \
+        if(GC_IS_YOUNG((value).array_data)) { \
+            gc_remember_static_var((program), (index)); \
+        } else if(gc_marking) { \
+            gc_mark((value), (program)->static_vars[(index)].type->category); \
+        } \
+    } while(0)
 
 #endif /* INTERPRETER_H */
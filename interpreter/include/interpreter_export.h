@@ -102,6 +102,9 @@ struct gc_OBJECT_REGISTRY {
     union itval object;
     enum ts_CATEGORY category;
     uint32_t visited;
+    // This is true iff the object is in the remembered set, meaning that it
+    // might point into the nursery. See gc_remember_object(..).
+    bool remembered;
 };
 
 struct it_ARRAY_DATA {
@@ -140,12 +143,14 @@ struct it_CLAZZ_DATA {
 struct it_OPCODE {
     uint8_t type;
     uint32_t linenum;
+    // This is the address of the opcode's handler in it_execute(..), and is
+    // only used under THREADED_DISPATCH. See it_get_opcode_handler(..).
+    void* handler;
     union it_OPCODE_DATA data;
 };
 struct it_STACKFRAME {
     union itval* registers;
     int registerc;
-    int registers_allocated;
     uint32_t returnreg;
     struct it_OPCODE* iptr;
     struct it_METHOD* method;
@@ -183,6 +188,9 @@ struct sv_STATIC_VAR {
     struct ts_TYPE* type;
     char* name;
     union itval value;
+    // This is true iff the variable is in the garbage collector's list of
+    // static variables that might point into the nursery.
+    bool remembered;
 };
 struct it_PROGRAM {
     // This is the number of methods
@@ -52,6 +52,39 @@ struct ts_TYPE;
 #define OPCODE_CLASSCALLSPECIAL 0x25
 #define OPCODE_INTERFACECALL 0x26
 
+// These are superinstructions, which never appear in bytecode files. They're
+// created by bc_fuse_superinstructions(..) at load time by rewriting the first
+// opcode of a common sequence, leaving the rest of the sequence untouched (so
+// jumps into the middle of a sequence still work).
+// LOAD+<comparison>+JF, where the LOAD is the second operand of the comparison
+#define OPCODE_EQUALSI_JF 0x80
+#define OPCODE_LTI_JF 0x81
+#define OPCODE_LTEQI_JF 0x82
+#define OPCODE_GTI_JF 0x83
+#define OPCODE_GTEQI_JF 0x84
+// <comparison>+JF
+#define OPCODE_EQUALS_JF 0x85
+#define OPCODE_LT_JF 0x86
+#define OPCODE_LTEQ_JF 0x87
+#define OPCODE_GT_JF 0x88
+#define OPCODE_GTEQ_JF 0x89
+// LOAD+ADD, where the LOAD is either operand of the ADD
+#define OPCODE_ADDI 0x8a
+// A run of consecutive PARAMs
+#define OPCODE_PARAMBLOCK 0x8b
+
+// These are specialised calls, which also never appear in bytecode files.
+// CALL and CLASSCALLSPECIAL reify the callee's generic references the first
+// time they're executed, and then rewrite themselves into one of these, which
+// have the same layout but skip the checks that can't fail anymore. See the
+// CALL handler in it_execute(..).
+// A CALL to a method that isn't replaced
+#define OPCODE_CALL_DIRECT 0x8c
+// A CALL to a method with a replacement_ptr
+#define OPCODE_CALL_REPLACED 0x8d
+// A CLASSCALLSPECIAL to a method that isn't replaced
+#define OPCODE_CLASSCALLSPECIAL_DIRECT 0x8e
+
 struct it_OPCODE_DATA_LOAD {
     uint32_t target;
     uint64_t data;
@@ -208,11 +241,42 @@ struct it_OPCODE_DATA_CLASSCALLSPECIAL {
     uint32_t destination_register;
     uint32_t callee_register;
 };
+// This is the number of receiver classes an INTERFACECALL remembers
+#define INTERFACECALL_CACHE_SIZE 4
+struct it_INTERFACECALL_CACHE {
+    uint32_t size;
+    // The implementation of the interface in receiver_tables[i] is
+    // implementation_tables[i]
+    struct it_METHOD_TABLE* receiver_tables[INTERFACECALL_CACHE_SIZE];
+    struct it_METHOD_TABLE* implementation_tables[INTERFACECALL_CACHE_SIZE];
+};
 struct it_OPCODE_DATA_INTERFACECALL {
     uint32_t method_index;
     uint32_t interface_id;
     uint32_t callee_register;
     uint32_t destination_register;
+    // This is allocated separately so as not to make every opcode bigger
+    struct it_INTERFACECALL_CACHE* cache;
+};
+struct it_OPCODE_DATA_CMPJF {
+    uint32_t source1;
+    uint32_t source2;
+    uint32_t predicate;
+    uint32_t target;
+    // This is only used by the LOAD variants, where source2 is the LOAD target
+    uint64_t immediate;
+};
+struct it_OPCODE_DATA_ADDI {
+    uint32_t source;
+    uint32_t immediate_register;
+    uint32_t target;
+    uint64_t immediate;
+};
+struct it_OPCODE_DATA_PARAMBLOCK {
+    uint32_t source;
+    uint8_t target;
+    // This includes the first PARAM, so it's always at least 2
+    uint32_t count;
 };
 
 union it_OPCODE_DATA {
@@ -252,6 +316,9 @@ union it_OPCODE_DATA {
     struct it_OPCODE_DATA_OR or;
     struct it_OPCODE_DATA_INVERT invert;
     struct it_OPCODE_DATA_MOV mov;
+    struct it_OPCODE_DATA_CMPJF cmpjf;
+    struct it_OPCODE_DATA_ADDI addi;
+    struct it_OPCODE_DATA_PARAMBLOCK paramblock;
 };
 
 #endif /* OPCODES_H */
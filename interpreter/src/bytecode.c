@@ -233,6 +233,7 @@ void bc_parse_opcode(struct fr_STATE* state, struct it_PROGRAM* program, struct
         free(methodname);
     } else if(opcode_num == OPCODE_INTERFACECALL) {
         struct it_OPCODE_DATA_INTERFACECALL* data = &opcode->data.interfacecall;
+        data->cache = mm_malloc(sizeof(struct it_INTERFACECALL_CACHE));
         data->callee_register = fr_getuint32(state);
         char* method_name = fr_getstr(state);
         struct ts_TYPE* interface = method->register_types[data->callee_register];
@@ -261,13 +262,36 @@ void bc_parse_opcode(struct fr_STATE* state, struct it_PROGRAM* program, struct
         fatal("Unrecognized opcode");
     }
 }
+struct bc_SEGMENT_INDEX {
+    // These are the offsets of every segment of one type, in the order they
+    // appear in the file, just past the byte giving the segment type
+    uint32_t* offsets;
+    uint32_t offsetc;
+    uint32_t offsets_size;
+};
 struct bc_PRESCAN_RESULTS {
     int num_methods;
     uint32_t entrypoint_id;
     int num_clazzes;
     int num_static_variables;
     int num_interfaces;
+    // This is the most opcodes in any one method, filled in by bc_scan_methods
+    uint32_t max_opcodec;
+    // This is indexed by segment type, so that each of the later passes only
+    // visits the segments it's interested in
+    struct bc_SEGMENT_INDEX segments[SEGMENT_TYPE_INTERFACE + 1];
 };
+void bc_index_segment(struct bc_PRESCAN_RESULTS* results, uint8_t segment_type, uint32_t offset) {
+    struct bc_SEGMENT_INDEX* index = &results->segments[segment_type];
+    if(index->offsetc == index->offsets_size) {
+        index->offsets_size = index->offsets_size == 0 ? 16 : index->offsets_size * 2;
+        index->offsets = realloc(index->offsets, sizeof(uint32_t) * index->offsets_size);
+        if(index->offsets == NULL) {
+            fatal("Memory allocation failed");
+        }
+    }
+    index->offsets[index->offsetc++] = offset;
+}
 struct bc_PRESCAN_RESULTS* bc_prescan(struct fr_STATE* state) {
     #if DEBUG
     printf("Entering bc_prescan\n");
@@ -284,6 +308,9 @@ struct bc_PRESCAN_RESULTS* bc_prescan(struct fr_STATE* state) {
 
     while(!fr_iseof(state)) {
         uint8_t segment_type = fr_getuint8(state);
+        if(segment_type <= SEGMENT_TYPE_INTERFACE) {
+            bc_index_segment(results, segment_type, state->index);
+        }
         if(segment_type == SEGMENT_TYPE_METHOD) {
             // Length + header + body
             // header = ID + nargs + len(segment.signature.name) + segment.signature.name
@@ -324,8 +351,10 @@ union itval bc_create_staticvar_value(struct it_PROGRAM* program, struct fr_STAT
         return ret;
     } else if(type->category == ts_CATEGORY_ARRAY) {
         uint64_t length = fr_getuint64(state);
-        size_t allocation_size = sizeof(struct it_ARRAY_DATA) + (length == 0 ? 0 : (length - 1) * sizeof(union itval));
-        struct it_ARRAY_DATA* array_data = mm_malloc(allocation_size);
+        // Static variable initializers are usually long-lived, so there's no
+        // point in starting them off in the nursery
+        union itval ret = gc_allocate_old(gc_array_allocation_size(length), ts_CATEGORY_ARRAY);
+        struct it_ARRAY_DATA* array_data = ret.array_data;
         #if CATEGORY_GUARDS
         array_data->category = ts_CATEGORY_ARRAY;
         #endif
@@ -334,9 +363,6 @@ union itval bc_create_staticvar_value(struct it_PROGRAM* program, struct fr_STAT
         for(uint64_t i = 0; i < length; i++) {
             array_data->elements[i] = bc_create_staticvar_value(program, state, type->data.array.parent_type);
         }
-        union itval ret;
-        ret.array_data = array_data;
-        ret.array_data->gc_registry_entry = gc_register_object(ret, allocation_size, ts_CATEGORY_ARRAY);
         return ret;
     } else if(type->category == ts_CATEGORY_CLAZZ) {
         union itval ret;
@@ -350,34 +376,20 @@ union itval bc_create_staticvar_value(struct it_PROGRAM* program, struct fr_STAT
     ret.number = 0;
     return ret; // Unreachable
 }
-void bc_scan_static_vars(struct it_PROGRAM* program, struct fr_STATE* state) {
-    while(!fr_iseof(state)) {
-        uint8_t segment_type = fr_getuint8(state);
-        if(segment_type == SEGMENT_TYPE_METHOD) {
-            uint32_t length = fr_getuint32(state);
-            fr_advance(state, (int) length);
-        } else if(segment_type == SEGMENT_TYPE_METADATA) {
-            free(fr_getstr(state));
-            free(fr_getstr(state));
-        } else if(segment_type == SEGMENT_TYPE_CLASS) {
-            uint32_t length = fr_getuint32(state);
-            fr_advance(state, (int) length);
-        } else if(segment_type == SEGMENT_TYPE_STATIC_VARIABLES) {
-            fr_getuint32(state); // Length
-            uint32_t num_static_vars = fr_getuint32(state);
-            for(int i = 0; i < num_static_vars; i++) {
-                char* name = fr_getstr(state);
-                char* typename = fr_getstr(state);
-                struct ts_TYPE* type = ts_get_type(typename, NULL);
-                union itval value = bc_create_staticvar_value(program, state, type);
-                sv_add_static_var(program, type, strdup(name), value);
-                free(name);
-                free(typename);
-            }
-        } else if(segment_type == SEGMENT_TYPE_INTERFACE) {
-            free(fr_getstr(state));
-        } else {
-            fatal("Unrecognized segment type");
+void bc_scan_static_vars(struct it_PROGRAM* program, struct bc_PRESCAN_RESULTS* prescan, struct fr_STATE* state) {
+    struct bc_SEGMENT_INDEX* static_variables = &prescan->segments[SEGMENT_TYPE_STATIC_VARIABLES];
+    for(uint32_t segment = 0; segment < static_variables->offsetc; segment++) {
+        fr_seek(state, static_variables->offsets[segment]);
+        fr_getuint32(state); // Length
+        uint32_t num_static_vars = fr_getuint32(state);
+        for(int i = 0; i < num_static_vars; i++) {
+            char* name = fr_getstr(state);
+            char* typename = fr_getstr(state);
+            struct ts_TYPE* type = ts_get_type(typename, NULL);
+            union itval value = bc_create_staticvar_value(program, state, type);
+            sv_add_static_var(program, type, strdup(name), value);
+            free(name);
+            free(typename);
         }
     }
 }
@@ -385,16 +397,19 @@ uint32_t bc_assign_method_id(struct it_PROGRAM* program) {
     return program->method_id++;
 }
 void bc_prescan_destroy(struct bc_PRESCAN_RESULTS* prescan) {
+    for(int i = 0; i <= SEGMENT_TYPE_INTERFACE; i++) {
+        free(prescan->segments[i].offsets);
+    }
     free(prescan);
 }
 uint32_t bc_resolve_global_method(struct it_PROGRAM* program, char* name) {
-    for(int i = 0; i < program->methodc; i++) {
-        if(program->methods[i].containing_clazz == NULL && strcmp(name, program->methods[i].name) == 0) {
-            #if DEBUG
-            printf("Resolved %s to %d\n", name, program->methods[i].id);
-            #endif
-            return program->methods[i].id;
-        }
+    // bc_scan_methods defines every method that isn't in a class
+    int index = sy_lookup(&program->methods, name);
+    if(index >= 0) {
+        #if DEBUG
+        printf("Resolved %s to %d\n", name, program->methods[index].id);
+        #endif
+        return program->methods[index].id;
     }
     #if DEBUG
     printf("Name: %s\n", name);
@@ -467,6 +482,11 @@ void bc_parse_method(struct fr_STATE* state, struct it_OPCODE* opcode_buff, stru
     for(int i = 0; i < opcodec; i++) {
         opcode_buff[i].linenum = fr_getuint32(state);
     }
+    #if THREADED_DISPATCH
+    for(int i = 0; i < opcodec; i++) {
+        opcode_buff[i].handler = it_get_opcode_handler(opcode_buff[i].type);
+    }
+    #endif
 
     result->registerc = registerc;
     result->nargs = nargs;
@@ -490,260 +510,315 @@ void bc_parse_method(struct fr_STATE* state, struct it_OPCODE* opcode_buff, stru
     printf("Done parsing method\n");
     #endif
 }
-void bc_scan_types_zerothpass(struct it_PROGRAM* program, struct bc_PRESCAN_RESULTS* prescan, struct fr_STATE* state) {
-    while(!fr_iseof(state)) {
-        uint8_t segment_type = fr_getuint8(state);
-        if(segment_type == SEGMENT_TYPE_METHOD) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_STATIC_VARIABLES) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_METADATA) {
-            free(fr_getstr(state));
-            free(fr_getstr(state));
-        } else if(segment_type == SEGMENT_TYPE_CLASS) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_INTERFACE) {
-            char* name = fr_getstr(state);
-            cl_get_or_create_interface(name, program);
-            free(name);
+uint8_t bc_get_compare_and_jump_opcode(uint8_t compare_type, bool immediate) {
+    switch(compare_type) {
+    case OPCODE_EQUALS:
+        return immediate ? OPCODE_EQUALSI_JF : OPCODE_EQUALS_JF;
+    case OPCODE_LT:
+        return immediate ? OPCODE_LTI_JF : OPCODE_LT_JF;
+    case OPCODE_LTEQ:
+        return immediate ? OPCODE_LTEQI_JF : OPCODE_LTEQ_JF;
+    case OPCODE_GT:
+        return immediate ? OPCODE_GTI_JF : OPCODE_GT_JF;
+    case OPCODE_GTEQ:
+        return immediate ? OPCODE_GTEQI_JF : OPCODE_GTEQ_JF;
+    default:
+        return 0;
+    }
+}
+void bc_set_opcode_type(struct it_OPCODE* opcode, uint8_t type) {
+    opcode->type = type;
+    #if THREADED_DISPATCH
+    opcode->handler = it_get_opcode_handler(type);
+    #endif
+}
+void bc_fuse_superinstructions(struct it_METHOD* method) {
+    // All the comparison opcodes have the same layout, so we use `lt` for all of them.
+    // Note that we never rewrite anything but the first opcode of a sequence,
+    // and that sequences never overlap.
+    struct it_OPCODE* opcodes = method->opcodes;
+    int i = 0;
+    while(i < method->opcodec) {
+        struct it_OPCODE* opcode = &opcodes[i];
+        int remaining = method->opcodec - i;
+        if(opcode->type == OPCODE_LOAD
+                && remaining >= 3
+                && bc_get_compare_and_jump_opcode(opcode[1].type, true) != 0
+                && opcode[2].type == OPCODE_JF
+                && opcode[1].data.lt.source2 == opcode->data.load.target
+                && opcode[2].data.jf.predicate == opcode[1].data.lt.target) {
+            struct it_OPCODE_DATA_CMPJF data;
+            data.source1 = opcode[1].data.lt.source1;
+            data.source2 = opcode->data.load.target;
+            data.predicate = opcode[1].data.lt.target;
+            data.target = opcode[2].data.jf.target;
+            data.immediate = opcode->data.load.data;
+            opcode->data.cmpjf = data;
+            bc_set_opcode_type(opcode, bc_get_compare_and_jump_opcode(opcode[1].type, true));
+            i += 3;
+        } else if(bc_get_compare_and_jump_opcode(opcode->type, false) != 0
+                && remaining >= 2
+                && opcode[1].type == OPCODE_JF
+                && opcode[1].data.jf.predicate == opcode->data.lt.target) {
+            struct it_OPCODE_DATA_CMPJF data;
+            data.source1 = opcode->data.lt.source1;
+            data.source2 = opcode->data.lt.source2;
+            data.predicate = opcode->data.lt.target;
+            data.target = opcode[1].data.jf.target;
+            data.immediate = 0;
+            opcode->data.cmpjf = data;
+            bc_set_opcode_type(opcode, bc_get_compare_and_jump_opcode(opcode->type, false));
+            i += 2;
+        } else if(opcode->type == OPCODE_LOAD
+                && remaining >= 2
+                && opcode[1].type == OPCODE_ADD
+                && (opcode[1].data.add.source1 == opcode->data.load.target
+                    || opcode[1].data.add.source2 == opcode->data.load.target)) {
+            struct it_OPCODE_DATA_ADDI data;
+            // Addition is commutative, so it doesn't matter which operand the LOAD was
+            if(opcode[1].data.add.source1 == opcode->data.load.target) {
+                data.source = opcode[1].data.add.source2;
+            } else {
+                data.source = opcode[1].data.add.source1;
+            }
+            data.immediate_register = opcode->data.load.target;
+            data.target = opcode[1].data.add.target;
+            data.immediate = opcode->data.load.data;
+            opcode->data.addi = data;
+            bc_set_opcode_type(opcode, OPCODE_ADDI);
+            i += 2;
+        } else if(opcode->type == OPCODE_PARAM
+                && remaining >= 2
+                && opcode[1].type == OPCODE_PARAM) {
+            struct it_OPCODE_DATA_PARAMBLOCK data;
+            data.source = opcode->data.param.source;
+            data.target = opcode->data.param.target;
+            data.count = 1;
+            while(data.count < remaining && opcode[data.count].type == OPCODE_PARAM) {
+                data.count++;
+            }
+            opcode->data.paramblock = data;
+            bc_set_opcode_type(opcode, OPCODE_PARAMBLOCK);
+            i += data.count;
         } else {
-            fatal("Unrecognized segment type");
+            i++;
         }
     }
 }
+void bc_scan_types_zerothpass(struct it_PROGRAM* program, struct bc_PRESCAN_RESULTS* prescan, struct fr_STATE* state) {
+    struct bc_SEGMENT_INDEX* interfaces = &prescan->segments[SEGMENT_TYPE_INTERFACE];
+    for(uint32_t segment = 0; segment < interfaces->offsetc; segment++) {
+        fr_seek(state, interfaces->offsets[segment]);
+        char* name = fr_getstr(state);
+        cl_get_or_create_interface(name, program);
+        free(name);
+    }
+}
 void bc_scan_types_firstpass(struct it_PROGRAM* program, struct bc_PRESCAN_RESULTS* prescan, struct fr_STATE* state) {
-    while(!fr_iseof(state)) {
-        uint8_t segment_type = fr_getuint8(state);
-        if(segment_type == SEGMENT_TYPE_METHOD) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_STATIC_VARIABLES) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_METADATA) {
+    struct bc_SEGMENT_INDEX* clazzes = &prescan->segments[SEGMENT_TYPE_CLASS];
+    for(uint32_t segment = 0; segment < clazzes->offsetc; segment++) {
+        fr_seek(state, clazzes->offsets[segment]);
+        struct ts_TYPE* clazz = mm_malloc(sizeof(struct ts_TYPE));
+        fr_getuint32(state); // length
+        char* clazzname = fr_getstr(state);
+        char* parentname = fr_getstr(state);
+        uint32_t num_interfaces = fr_getuint32(state);
+        for(uint32_t i = 0; i < num_interfaces; i++) {
             free(fr_getstr(state));
-            free(fr_getstr(state));
-        } else if(segment_type == SEGMENT_TYPE_CLASS) {
-            struct ts_TYPE* clazz = mm_malloc(sizeof(struct ts_TYPE));
-            fr_getuint32(state); // length
-            char* clazzname = fr_getstr(state);
-            char* parentname = fr_getstr(state);
-            uint32_t num_interfaces = fr_getuint32(state);
-            for(uint32_t i = 0; i < num_interfaces; i++) {
-                free(fr_getstr(state));
-            }
-            uint32_t num_type_arguments = fr_getuint32(state);
-            struct ts_GENERIC_TYPE_CONTEXT* type_parameters = ts_create_generic_type_context(num_type_arguments, NULL);
-            for(uint32_t i = 0; i < num_type_arguments; i++) {
-                char* type_parameter_name = fr_getstr(state);
-                char* extends_name = fr_getstr(state);
-                // Our generic type context isn't fully initialized yet, so don't pass
-                // it as an argument here.
-                struct ts_TYPE* extends = strlen(extends_name) > 0 ? ts_get_type(extends_name, NULL) : NULL;
-                free(extends_name);
-                int implementsc = fr_getuint32(state);
-                struct ts_TYPE* implements[implementsc];
-                for(int j = 0; j < implementsc; j++) {
-                    char* implements_name = fr_getstr(state);
-                    implements[j] = ts_get_type(implements_name, NULL);
-                    free(implements_name);
-                }
-                // Passing in a stack-allocated array since ts_init_type_parameter(...) just memcpy's it.
-                type_parameters->arguments[i] = ts_allocate_type_parameter(type_parameter_name, type_parameters, extends, implementsc, (struct ts_TYPE**) &implements);
-            }
-            clazz->data.clazz.type_parameters = type_parameters;
-            #if DEBUG
-            printf("Prescanning class '%s'\n", clazzname);
-            #endif
-            uint32_t numfields = fr_getuint32(state);
-            for(uint32_t i = 0; i < numfields; i++) {
-                free(fr_getstr(state));
-                free(fr_getstr(state));
-            }
-            clazz->data.clazz.specialized_from = clazz;
-            clazz->data.clazz.type_arguments = NULL;
-            clazz->data.clazz.specializations = NULL;
-            clazz->data.clazz.specializations_size = 0;
-            clazz->data.clazz.specializationsc = 0;
-            clazz->category = ts_CATEGORY_CLAZZ;
-            clazz->id = ts_allocate_type_id();
-            clazz->name = strdup(clazzname);
-            clazz->heirarchy_len = 1;
-            clazz->heirarchy = mm_malloc(sizeof(struct ts_TYPE*) * 1);
-            clazz->heirarchy[0] = clazz;
-            clazz->data.clazz.nfields = -1;
-            clazz->data.clazz.fields = NULL;
-            clazz->data.clazz.implemented_interfaces = mm_malloc(sizeof(struct ts_TYPE*) * num_interfaces);
-            clazz->data.clazz.implemented_interfacesc = num_interfaces;
-            // Check for duplicate class names
-            for(int i = 0; i < program->clazz_index; i++) {
-                if(strcmp(program->clazzes[i]->name, clazz->name) == 0) {
-                    printf("Duplicate class name: '%s'\n", clazz->name);
-                    fatal("Duplicate class name");
-                }
+        }
+        uint32_t num_type_arguments = fr_getuint32(state);
+        struct ts_GENERIC_TYPE_CONTEXT* type_parameters = ts_create_generic_type_context(num_type_arguments, NULL);
+        for(uint32_t i = 0; i < num_type_arguments; i++) {
+            char* type_parameter_name = fr_getstr(state);
+            char* extends_name = fr_getstr(state);
+            // Our generic type context isn't fully initialized yet, so don't pass
+            // it as an argument here.
+            struct ts_TYPE* extends = strlen(extends_name) > 0 ? ts_get_type(extends_name, NULL) : NULL;
+            free(extends_name);
+            int implementsc = fr_getuint32(state);
+            struct ts_TYPE* implements[implementsc];
+            for(int j = 0; j < implementsc; j++) {
+                char* implements_name = fr_getstr(state);
+                implements[j] = ts_get_type(implements_name, NULL);
+                free(implements_name);
             }
-            ts_register_type(clazz, strdup(clazzname));
-            program->clazzes[program->clazz_index++] = clazz;
-            free(clazzname);
-            free(parentname);
-        } else if(segment_type == SEGMENT_TYPE_INTERFACE) {
+            // Passing in a stack-allocated array since ts_init_type_parameter(...) just memcpy's it.
+            type_parameters->arguments[i] = ts_allocate_type_parameter(type_parameter_name, type_parameters, extends, implementsc, (struct ts_TYPE**) &implements);
+        }
+        clazz->data.clazz.type_parameters = type_parameters;
+        #if DEBUG
+        printf("Prescanning class '%s'\n", clazzname);
+        #endif
+        uint32_t numfields = fr_getuint32(state);
+        for(uint32_t i = 0; i < numfields; i++) {
+            free(fr_getstr(state));
             free(fr_getstr(state));
-        } else {
-            fatal("Unrecognized segment type");
         }
+        clazz->data.clazz.specialized_from = clazz;
+        clazz->data.clazz.type_arguments = NULL;
+        clazz->data.clazz.specializations = NULL;
+        clazz->data.clazz.specializations_size = 0;
+        clazz->data.clazz.specializationsc = 0;
+        clazz->category = ts_CATEGORY_CLAZZ;
+        clazz->id = ts_allocate_type_id();
+        clazz->name = strdup(clazzname);
+        clazz->heirarchy_len = 1;
+        clazz->heirarchy = mm_malloc(sizeof(struct ts_TYPE*) * 1);
+        clazz->heirarchy[0] = clazz;
+        clazz->data.clazz.nfields = -1;
+        clazz->data.clazz.fields = NULL;
+        clazz->data.clazz.implemented_interfaces = mm_malloc(sizeof(struct ts_TYPE*) * num_interfaces);
+        clazz->data.clazz.implemented_interfacesc = num_interfaces;
+        // Check for duplicate class names
+        for(int i = 0; i < program->clazz_index; i++) {
+            if(strcmp(program->clazzes[i]->name, clazz->name) == 0) {
+                printf("Duplicate class name: '%s'\n", clazz->name);
+                fatal("Duplicate class name");
+            }
+        }
+        ts_register_type(clazz, strdup(clazzname));
+        program->clazzes[program->clazz_index++] = clazz;
+        free(clazzname);
+        free(parentname);
     }
 }
 void bc_scan_types_secondpass(struct it_PROGRAM* program, struct bc_PRESCAN_RESULTS* prescan, struct fr_STATE* state) {
-    while(!fr_iseof(state)) {
-        uint8_t segment_type = fr_getuint8(state);
-        if(segment_type == SEGMENT_TYPE_METHOD) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_STATIC_VARIABLES) {
-            fr_advance(state, fr_getuint32(state));
-        } else if(segment_type == SEGMENT_TYPE_METADATA) {
-            free(fr_getstr(state));
-            free(fr_getstr(state));
-        } else if(segment_type == SEGMENT_TYPE_CLASS) {
-            fr_getuint32(state);
-            char* clazzname = fr_getstr(state);
-            char* supertype_name = fr_getstr(state);
-            struct ts_TYPE* clazz = ts_get_type(clazzname, NULL);
-            if(clazz->category != ts_CATEGORY_CLAZZ) {
-                fatal("Tried to extend something that isn't a class");
-            }
-            uint32_t num_interfaces = fr_getuint32(state);
-            char* interface_names[num_interfaces];
-            for(uint32_t i = 0; i < num_interfaces; i++) {
-                char* name = fr_getstr(state);
-                interface_names[i] = name;
-            }
+    struct bc_SEGMENT_INDEX* clazzes = &prescan->segments[SEGMENT_TYPE_CLASS];
+    for(uint32_t segment = 0; segment < clazzes->offsetc; segment++) {
+        fr_seek(state, clazzes->offsets[segment]);
+        fr_getuint32(state);
+        char* clazzname = fr_getstr(state);
+        char* supertype_name = fr_getstr(state);
+        struct ts_TYPE* clazz = ts_get_type(clazzname, NULL);
+        if(clazz->category != ts_CATEGORY_CLAZZ) {
+            fatal("Tried to extend something that isn't a class");
+        }
+        uint32_t num_interfaces = fr_getuint32(state);
+        char* interface_names[num_interfaces];
+        for(uint32_t i = 0; i < num_interfaces; i++) {
+            char* name = fr_getstr(state);
+            interface_names[i] = name;
+        }
 
-            uint32_t num_type_arguments = fr_getuint32(state);
-            for(uint32_t i = 0; i < num_type_arguments; i++) {
-                free(fr_getstr(state)); // name
-                free(fr_getstr(state)); // extends
-                uint32_t num_implemented_interfaces = fr_getuint32(state);
-                for(uint32_t i = 0; i < num_implemented_interfaces; i++) {
-                    free(fr_getstr(state)); // interface name
-                }
+        uint32_t num_type_arguments = fr_getuint32(state);
+        for(uint32_t i = 0; i < num_type_arguments; i++) {
+            free(fr_getstr(state)); // name
+            free(fr_getstr(state)); // extends
+            uint32_t num_implemented_interfaces = fr_getuint32(state);
+            for(uint32_t i = 0; i < num_implemented_interfaces; i++) {
+                free(fr_getstr(state)); // interface name
             }
+        }
 
-            if(strlen(supertype_name) > 0) {
-                clazz->data.clazz.immediate_supertype = ts_get_type(supertype_name, clazz->data.clazz.type_parameters);
-                if(clazz->data.clazz.immediate_supertype == NULL) {
-                    fatal("Couldn't find superclass");
-                }
-                if(clazz->data.clazz.immediate_supertype->category != ts_CATEGORY_CLAZZ) {
-                    fatal("Tried to extend something that isn't a class");
-                }
-            } else {
-                clazz->data.clazz.immediate_supertype = NULL;
+        if(strlen(supertype_name) > 0) {
+            clazz->data.clazz.immediate_supertype = ts_get_type(supertype_name, clazz->data.clazz.type_parameters);
+            if(clazz->data.clazz.immediate_supertype == NULL) {
+                fatal("Couldn't find superclass");
             }
-            for(uint32_t i = 0; i < num_interfaces; i++) {
-                char* name = interface_names[i];
-                struct ts_TYPE* interface = cl_get_or_create_interface(name, program);
-                clazz->data.clazz.implemented_interfaces[i] = interface;
-                free(name);
-            }
-
-            uint32_t numfields = fr_getuint32(state);
-            clazz->data.clazz.nfields = numfields;
-            clazz->data.clazz.fields = mm_malloc(sizeof(struct ts_CLAZZ_FIELD) * numfields);
-            for(uint32_t i = 0; i < numfields; i++) {
-                clazz->data.clazz.fields[i].name = fr_getstr(state);
-                clazz->data.clazz.fields[i].type = ts_get_type(fr_getstr(state), clazz->data.clazz.type_parameters);
+            if(clazz->data.clazz.immediate_supertype->category != ts_CATEGORY_CLAZZ) {
+                fatal("Tried to extend something that isn't a class");
             }
-            #if DEBUG
-            printf("Scanning class '%s'\n", clazzname);
-            #endif
-            free(supertype_name);
-            free(clazzname);
-        } else if(segment_type == SEGMENT_TYPE_INTERFACE) {
-            free(fr_getstr(state));
         } else {
-            fatal("Unrecognized segment type");
+            clazz->data.clazz.immediate_supertype = NULL;
         }
+        for(uint32_t i = 0; i < num_interfaces; i++) {
+            char* name = interface_names[i];
+            struct ts_TYPE* interface = cl_get_or_create_interface(name, program);
+            clazz->data.clazz.implemented_interfaces[i] = interface;
+            free(name);
+        }
+
+        uint32_t numfields = fr_getuint32(state);
+        clazz->data.clazz.nfields = numfields;
+        clazz->data.clazz.fields = mm_malloc(sizeof(struct ts_CLAZZ_FIELD) * numfields);
+        for(uint32_t i = 0; i < numfields; i++) {
+            clazz->data.clazz.fields[i].name = fr_getstr(state);
+            clazz->data.clazz.fields[i].type = ts_get_type(fr_getstr(state), clazz->data.clazz.type_parameters);
+        }
+        #if DEBUG
+        printf("Scanning class '%s'\n", clazzname);
+        #endif
+        free(supertype_name);
+        free(clazzname);
     }
 }
-void bc_scan_methods(struct it_PROGRAM* program, struct fr_STATE* state, int offset) {
+void bc_scan_methods(struct it_PROGRAM* program, struct bc_PRESCAN_RESULTS* prescan, struct fr_STATE* state, int offset) {
     // state->methodc and state->methods are already initialized
     #if DEBUG
     printf("Entering bc_scan_methods()\n");
     #endif
     int methodindex = offset;
-    while(!fr_iseof(state)) {
-        uint8_t segment_type = fr_getuint8(state);
-        if(segment_type == SEGMENT_TYPE_METHOD) {
-            #if DEBUG
-            printf("Method\n");
-            #endif
-            uint32_t length = fr_getuint32(state);
-            uint32_t end_index = state->index + length;
-            struct it_METHOD* method = &program->methods[methodindex++];
-            method->registerc = fr_getuint32(state); // num_registers
-            method->id = bc_assign_method_id(program); // id
-            method->nargs = fr_getuint32(state); // nargs
-            fr_getuint32(state); // opcodec
-            method->typereferencec = fr_getuint32(state);
-            method->name = fr_getstr(state); // name
-            char* containing_clazz_name = fr_getstr(state);
-            method->containing_clazz = NULL;
-            method->containing_interface = NULL;
-            method->typereferences = NULL;
-            method->reificationsc = 0;
-            method->reifications = NULL;
-            method->reifications_size = 0;
-            method->has_had_references_reified = false;
-            method->typeargs = NULL;
-            method->reified_from = method;
-            method->opcodes = NULL;
-            method->type_parameters = NULL;
-            if(strlen(containing_clazz_name) > 0) {
-                struct ts_TYPE* containing_type = ts_get_type(containing_clazz_name, NULL);
-                if(containing_type->category == ts_CATEGORY_CLAZZ) {
-                    method->containing_clazz = containing_type;
-                } else if(containing_type->category == ts_CATEGORY_INTERFACE) {
-                    method->containing_interface = containing_type;
-                } else {
-                    fatal("Method is contained in a type that isn't a class or an interface");
-                }
-            }
-            free(containing_clazz_name);
-            // Make sure there are no duplicate method names
-            for(int i = 0; i < methodindex - 1; i++) {
-                if(strcmp(method->name, program->methods[i].name) == 0 && method->containing_clazz == program->methods[i].containing_clazz) {
-                    printf("Duplicate method name and containing class: '%s'", method->name);
-                    if(method->containing_clazz != NULL) {
-                        printf(" from class '%s'\n", method->containing_clazz->name);
-                    } else {
-                        printf(" with no containing class\n");
-                    }
-                    fatal("Duplicate method name");
-                }
+    struct bc_SEGMENT_INDEX* methods = &prescan->segments[SEGMENT_TYPE_METHOD];
+    for(uint32_t segment = 0; segment < methods->offsetc; segment++) {
+        fr_seek(state, methods->offsets[segment]);
+        #if DEBUG
+        printf("Method\n");
+        #endif
+        fr_getuint32(state); // length
+        struct it_METHOD* method = &program->methods[methodindex++];
+        method->registerc = fr_getuint32(state); // num_registers
+        method->id = bc_assign_method_id(program); // id
+        method->nargs = fr_getuint32(state); // nargs
+        uint32_t opcodec = fr_getuint32(state);
+        if(opcodec > prescan->max_opcodec) {
+            prescan->max_opcodec = opcodec;
+        }
+        method->typereferencec = fr_getuint32(state);
+        method->name = fr_getstr(state); // name
+        char* containing_clazz_name = fr_getstr(state);
+        method->containing_clazz = NULL;
+        method->containing_interface = NULL;
+        method->typereferences = NULL;
+        method->reificationsc = 0;
+        method->reifications = NULL;
+        method->reifications_size = 0;
+        method->has_had_references_reified = false;
+        method->typeargs = NULL;
+        method->reified_from = method;
+        method->opcodes = NULL;
+        method->type_parameters = NULL;
+        if(strlen(containing_clazz_name) > 0) {
+            struct ts_TYPE* containing_type = ts_get_type(containing_clazz_name, NULL);
+            if(containing_type->category == ts_CATEGORY_CLAZZ) {
+                method->containing_clazz = containing_type;
+            } else if(containing_type->category == ts_CATEGORY_INTERFACE) {
+                method->containing_interface = containing_type;
+            } else {
+                fatal("Method is contained in a type that isn't a class or an interface");
             }
-            #if DEBUG
-            printf("Method name is %s\n", method->name);
-            #endif
-            fr_advance(state, end_index - state->index);
-        } else if(segment_type == SEGMENT_TYPE_METADATA) {
-            #if DEBUG
-            printf("Metadata\n");
-            #endif
-            char* name = fr_getstr(state);
-            // A zero-length entrypoint name means no entrypoint
-            if(strlen(name) > 0) {
-                program->entrypoint = bc_resolve_global_method(program, name);
+        }
+        free(containing_clazz_name);
+        // Make sure there are no duplicate method names. Methods that
+        // aren't in a class are defined in the program's symbol table,
+        // and those that are in the class's (which is only used here).
+        void* scope = method->containing_clazz == NULL ? (void*) &program->methods : (void*) &method->containing_clazz->data.clazz.method_table;
+        if(sy_lookup(scope, method->name) >= 0) {
+            printf("Duplicate method name and containing class: '%s'", method->name);
+            if(method->containing_clazz != NULL) {
+                printf(" from class '%s'\n", method->containing_clazz->name);
+            } else {
+                printf(" with no containing class\n");
             }
-            free(fr_getstr(state));
-        } else if(segment_type == SEGMENT_TYPE_STATIC_VARIABLES) {
-            uint32_t length = fr_getuint32(state);
-            fr_advance(state, (int) length);
-        } else if(segment_type == SEGMENT_TYPE_CLASS) {
-            uint32_t length = fr_getuint32(state);
-            fr_advance(state, (int) length);
-        } else if(segment_type == SEGMENT_TYPE_INTERFACE) {
-            free(fr_getstr(state));
-        } else {
-            fatal("Unrecognized segment type");
+            fatal("Duplicate method name");
         }
+        sy_define(scope, method->name, methodindex - 1);
+        #if DEBUG
+        printf("Method name is %s\n", method->name);
+        #endif
+    }
+    // The entrypoint can only be resolved once its method has been scanned
+    struct bc_SEGMENT_INDEX* metadata = &prescan->segments[SEGMENT_TYPE_METADATA];
+    for(uint32_t segment = 0; segment < metadata->offsetc; segment++) {
+        fr_seek(state, metadata->offsets[segment]);
+        #if DEBUG
+        printf("Metadata\n");
+        #endif
+        char* name = fr_getstr(state);
+        // A zero-length entrypoint name means no entrypoint
+        if(strlen(name) > 0) {
+            program->entrypoint = bc_resolve_global_method(program, name);
+        }
+        free(fr_getstr(state));
     }
     #if DEBUG
     printf("Exiting bc_scan_methods()\n");
@@ -771,10 +846,10 @@ struct it_PROGRAM* bc_parse_from_files(int fpc, FILE* fp[], struct it_OPTIONS* o
     result->interface_index = 0;
     result->clazzesc = 0;
     for(int i = 0; i < num_files; i++) {
+        // This is the only pass that reads every segment; it records where
+        // each of them starts so the passes after it can go straight to the
+        // segments they need
         prescan[i] = bc_prescan(state[i]);
-        fr_rewind(state[i]);
-        // Ignore the magic number
-        fr_getuint32(state[i]);
         result->methodc += prescan[i]->num_methods;
         result->static_varsc += prescan[i]->num_static_variables;
         result->interfacesc += prescan[i]->num_interfaces;
@@ -786,21 +861,12 @@ struct it_PROGRAM* bc_parse_from_files(int fpc, FILE* fp[], struct it_OPTIONS* o
     result->clazzes = mm_malloc(sizeof(struct ts_TYPE*) * result->clazzesc);
     for(int i = 0; i < num_files; i++) {
         bc_scan_types_zerothpass(result, prescan[i], state[i]);
-        fr_rewind(state[i]);
-        // Ignore the magic number
-        fr_getuint32(state[i]);
     }
     for(int i = 0; i < num_files; i++) {
         bc_scan_types_firstpass(result, prescan[i], state[i]);
-        fr_rewind(state[i]);
-        // Ignore the magic number
-        fr_getuint32(state[i]);
     }
     for(int i = 0; i < num_files; i++) {
         bc_scan_types_secondpass(result, prescan[i], state[i]);
-        fr_rewind(state[i]);
-        // Ignore the magic number
-        fr_getuint32(state[i]);
     }
     // Trust me, this is correct, though why that is isn't obvious.
     for(int i = 0; i < result->interfacesc; i++) {
@@ -812,17 +878,11 @@ struct it_PROGRAM* bc_parse_from_files(int fpc, FILE* fp[], struct it_OPTIONS* o
     printf("Again, %d methods\n", result->methodc);
     #endif
     for(int i = 0, method_index = 0; i < num_files; i++) {
-        bc_scan_methods(result, state[i], method_index);
+        bc_scan_methods(result, prescan[i], state[i], method_index);
         method_index += prescan[i]->num_methods;
-        fr_rewind(state[i]);
-        // Ignore the magic number
-        fr_getuint32(state[i]);
     }
     for(int i = 0; i < num_files; i++) {
-        bc_scan_static_vars(result, state[i]);
-        fr_rewind(state[i]);
-        // Ignore the magic number
-        fr_getuint32(state[i]);
+        bc_scan_static_vars(result, prescan[i], state[i]);
     }
     cl_arrange_method_tables(result);
 
@@ -830,33 +890,24 @@ struct it_PROGRAM* bc_parse_from_files(int fpc, FILE* fp[], struct it_OPTIONS* o
         fatal("No entrypoint found");
     }
 
-    // Reset the index into the input bytecode to the beginning of the segments
     int method_index = 0;
-    int largest_bufflen = 0;
+    uint32_t max_opcodec = 1;
     for(int i = 0; i < num_files; i++) {
-        if(state[i]->bufflen > largest_bufflen) {
-            largest_bufflen = state[i]->bufflen;
+        if(prescan[i]->max_opcodec > max_opcodec) {
+            max_opcodec = prescan[i]->max_opcodec;
         }
     }
-    struct it_OPCODE* opcodes = mm_malloc(sizeof(struct it_OPCODE) * largest_bufflen);
+    // This is big enough for any method, and bc_parse_method copies the
+    // opcodes out of it
+    struct it_OPCODE* opcodes = mm_malloc(sizeof(struct it_OPCODE) * max_opcodec);
     for(int i = 0; i < num_files; i++) {
-        while(!fr_iseof(state[i])) {
-            uint8_t segment_type = fr_getuint8(state[i]);
-            if(segment_type == SEGMENT_TYPE_METHOD) {
-                bc_parse_method(state[i], opcodes, result, &result->methods[method_index++]);
-            } else if(segment_type == SEGMENT_TYPE_METADATA) {
-                // Metadata segment
-                free(fr_getstr(state[i]));
-                free(fr_getstr(state[i]));
-            } else if(segment_type == SEGMENT_TYPE_CLASS) {
-                uint32_t length = fr_getuint32(state[i]);
-                fr_advance(state[i], (int) length);
-            } else if(segment_type == SEGMENT_TYPE_STATIC_VARIABLES) {
-                fr_advance(state[i], fr_getuint32(state[i]));
-            } else if(segment_type == SEGMENT_TYPE_INTERFACE) {
-                free(fr_getstr(state[i]));
-            } else {
-                fatal("Unrecognized segment type");
+        struct bc_SEGMENT_INDEX* methods = &prescan[i]->segments[SEGMENT_TYPE_METHOD];
+        for(uint32_t segment = 0; segment < methods->offsetc; segment++) {
+            fr_seek(state[i], methods->offsets[segment]);
+            struct it_METHOD* method = &result->methods[method_index++];
+            bc_parse_method(state[i], opcodes, result, method);
+            if(!options->no_fusion) {
+                bc_fuse_superinstructions(method);
             }
         }
     }
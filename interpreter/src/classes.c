@@ -163,6 +163,24 @@ void cl_arrange_interface_implementations(struct it_PROGRAM* program) {
         }
     }
 }
+struct it_METHOD_TABLE* cl_find_interface_implementation(struct it_METHOD_TABLE* method_table, uint32_t interface_id) {
+    // cl_arrange_interface_implementations sorts the implementations by
+    // interface id, so this is a binary search
+    struct it_INTERFACE_IMPLEMENTATION* implementations = method_table->interface_implementations;
+    int low = 0;
+    int high = (int) method_table->ninterface_implementations - 1;
+    while(low <= high) {
+        int middle = low + (high - low) / 2;
+        if(implementations[middle].interface_id == interface_id) {
+            return implementations[middle].method_table;
+        } else if(implementations[middle].interface_id < interface_id) {
+            low = middle + 1;
+        } else {
+            high = middle - 1;
+        }
+    }
+    return NULL;
+}
 void cl_arrange_method_tables(struct it_PROGRAM* program) {
     #if DEBUG
     printf("Entering cl_arrange_method_tables\n");
@@ -186,25 +204,65 @@ void cl_arrange_method_tables(struct it_PROGRAM* program) {
     printf("Ending cl_arrange_method_tables\n");
     #endif
 }
+// Fields and methods are found by name with the symbol table. Their symbols
+// are defined lazily, since classes inherit fields and methods from their
+// superclasses after they're loaded, and defined again whenever the number of
+// fields or methods has changed. They're defined from the back so that, as
+// with a linear search, the first field or method with a given name wins.
+void cl_define_field_symbols(struct ts_TYPE* clazz) {
+    void* scope = &clazz->data.clazz.fields;
+    sy_begin_scope(scope, clazz->data.clazz.nfields);
+    for(int i = clazz->data.clazz.nfields - 1; i >= 0; i--) {
+        sy_define(scope, clazz->data.clazz.fields[i].name, i);
+    }
+}
+bool cl_field_symbol_is_stale(struct ts_TYPE* clazz, int index, char* name) {
+    return index >= clazz->data.clazz.nfields || strcmp(clazz->data.clazz.fields[index].name, name) != 0;
+}
 int cl_get_field_index(struct ts_TYPE* clazz, char* name) {
-    for(int i = 0; i < clazz->data.clazz.nfields; i++) {
-        if(strcmp(clazz->data.clazz.fields[i].name, name) == 0) {
-            return i;
+    void* scope = &clazz->data.clazz.fields;
+    if(!sy_scope_is_current(scope, clazz->data.clazz.nfields)) {
+        cl_define_field_symbols(clazz);
+    }
+    int index = sy_lookup(scope, name);
+    if(index >= 0 && cl_field_symbol_is_stale(clazz, index, name)) {
+        cl_define_field_symbols(clazz);
+        index = sy_lookup(scope, name);
+        if(index >= 0 && cl_field_symbol_is_stale(clazz, index, name)) {
+            index = -1;
         }
     }
+    if(index >= 0) {
+        return index;
+    }
     #if DEBUG
     printf("Field name: '%s'\n", name);
     #endif
     fatal("Unable to find field");
     return -1; // Unreachable
 }
+void cl_define_method_symbols(struct it_METHOD_TABLE* method_table) {
+    sy_begin_scope(method_table, method_table->nmethods);
+    for(int i = method_table->nmethods - 1; i >= 0; i--) {
+        sy_define(method_table, method_table->methods[i]->name, i);
+    }
+}
+bool cl_method_symbol_is_stale(struct it_METHOD_TABLE* method_table, int index, char* name) {
+    return index >= method_table->nmethods || strcmp(method_table->methods[index]->name, name) != 0;
+}
 int cl_get_method_index_optional(struct it_METHOD_TABLE* method_table, char* name) {
-    for(int i = 0; i < method_table->nmethods; i++) {
-        if(strcmp(method_table->methods[i]->name, name) == 0) {
-            return i;
+    if(!sy_scope_is_current(method_table, method_table->nmethods)) {
+        cl_define_method_symbols(method_table);
+    }
+    int index = sy_lookup(method_table, name);
+    if(index >= 0 && cl_method_symbol_is_stale(method_table, index, name)) {
+        cl_define_method_symbols(method_table);
+        index = sy_lookup(method_table, name);
+        if(index >= 0 && cl_method_symbol_is_stale(method_table, index, name)) {
+            index = -1;
         }
     }
-    return -1;
+    return index;
 }
 int cl_get_method_index(struct it_METHOD_TABLE* method_table, char* name) {
     int index = cl_get_method_index_optional(method_table, name);
@@ -3,6 +3,8 @@
 #include <stdbool.h>
 #include <stdint.h>
 #include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include "common.h"
 
 void fatal_with_errcode(char* description, int errcode) {
@@ -24,25 +26,46 @@ struct fr_STATE* fr_new(FILE* fp) {
     struct fr_STATE* state = malloc(sizeof(struct fr_STATE));
     state->index = 0;
     state->fp = fp;
+    struct stat file_stat;
+    if(fstat(fileno(fp), &file_stat) == 0 && S_ISREG(file_stat.st_mode) && file_stat.st_size > 0) {
+        // Map the file rather than reading it, so that only the pages that
+        // are actually parsed need to be read, and nothing is copied
+        void* mapping = mmap(NULL, file_stat.st_size, PROT_READ, MAP_PRIVATE, fileno(fp), 0);
+        if(mapping != MAP_FAILED) {
+            madvise(mapping, file_stat.st_size, MADV_WILLNEED);
+            state->buffer = mapping;
+            state->bufflen = file_stat.st_size;
+            state->ownership = fr_BUFFER_MAPPED;
+            fclose(fp);
+            return state;
+        }
+    }
+    // Fall back to reading the whole file, for instance if it's a pipe
     fseek(fp, 0, SEEK_END);
     state->bufflen = ftell(fp);
     rewind(fp);
     state->buffer = malloc(state->bufflen);
     fread(state->buffer, 1, state->bufflen, fp);
+    state->ownership = fr_BUFFER_ALLOCATED;
     fclose(fp);
     return state;
 }
 struct fr_STATE* fr_new_from_buffer(int bufflen, char* buffer) {
+    // CONTRACT: buffer must not change or be freed while the reader exists
     struct fr_STATE* state = malloc(sizeof(struct fr_STATE));
     state->index = 0;
     state->fp = NULL;
     state->bufflen = bufflen;
-    state->buffer = malloc(bufflen * sizeof(char));
-    memcpy(state->buffer, buffer, bufflen);
+    state->buffer = buffer;
+    state->ownership = fr_BUFFER_BORROWED;
     return state;
 }
 void fr_destroy(struct fr_STATE* state) {
-    free(state->buffer);
+    if(state->ownership == fr_BUFFER_MAPPED) {
+        munmap(state->buffer, state->bufflen);
+    } else if(state->ownership == fr_BUFFER_ALLOCATED) {
+        free(state->buffer);
+    }
     free(state);
 }
 void fr_advance(struct fr_STATE* state, int qty) {
@@ -51,6 +74,9 @@ void fr_advance(struct fr_STATE* state, int qty) {
 void fr_rewind(struct fr_STATE* state) {
     state->index = 0;
 }
+void fr_seek(struct fr_STATE* state, int index) {
+    state->index = index;
+}
 bool fr_iseof(struct fr_STATE* state) {
     return state->index >= state->bufflen;
 }
@@ -67,22 +93,25 @@ uint8_t fr_getuint8(struct fr_STATE* state) {
 int8_t fr_getint8(struct fr_STATE* state) {
     return fr_getchar(state) & 0xff;
 }
+void fr_ensure_remaining(struct fr_STATE* state, size_t qty) {
+    if(state->index + qty > state->bufflen) {
+        fatal("Read past end of struct fr_STATE->buffer");
+    }
+}
 uint16_t fr_getuint16(struct fr_STATE* state) {
-    uint16_t top = fr_getchar(state);
-    uint16_t bottom = fr_getchar(state);
-    bottom &= 0xff;
-    top &= 0xff;
-    top <<= 8;
-    return bottom + top;
+    fr_ensure_remaining(state, 2);
+    uint8_t* bytes = (uint8_t*) state->buffer + state->index;
+    state->index += 2;
+    return ((uint16_t) bytes[0] << 8) | bytes[1];
 }
 int16_t fr_getint16(struct fr_STATE* state) {
     return (int16_t) fr_getuint16(state);
 }
 uint32_t fr_getuint32(struct fr_STATE* state) {
-    uint32_t top = fr_getuint16(state);
-    uint32_t bottom = fr_getuint16(state);
-    top <<= 16;
-    return bottom + top;
+    fr_ensure_remaining(state, 4);
+    uint8_t* bytes = (uint8_t*) state->buffer + state->index;
+    state->index += 4;
+    return ((uint32_t) bytes[0] << 24) | ((uint32_t) bytes[1] << 16) | ((uint32_t) bytes[2] << 8) | bytes[3];
 }
 int32_t fr_getint32(struct fr_STATE* state) {
     return (int32_t) fr_getuint32(state);
@@ -98,10 +127,10 @@ int64_t fr_getint64(struct fr_STATE* state) {
 }
 char* fr_getstr(struct fr_STATE* state) {
     uint32_t length = fr_getuint32(state);
+    fr_ensure_remaining(state, length);
     char* buff = malloc(length + 1);
-    for(uint32_t i = 0; i < length; i++) {
-        buff[i] = fr_getchar(state);
-    }
+    memcpy(buff, state->buffer + state->index, length);
+    state->index += length;
     // Null-terminate the string
     buff[length] = '\0';
     return buff;
@@ -116,3 +145,14 @@ void* mm_malloc(size_t size) {
     memset(buff, 0, size);
     return buff;
 }
+uint32_t fnv1a_hash(void* data, size_t size) {
+    uint32_t hash = 2166136261u;
+    for(size_t i = 0; i < size; i++) {
+        hash ^= ((uint8_t*) data)[i];
+        hash *= 16777619u;
+    }
+    return hash;
+}
+uint32_t fnv1a_hash_string(char* str) {
+    return fnv1a_hash(str, strlen(str));
+}
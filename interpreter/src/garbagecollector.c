@@ -52,7 +52,13 @@ void gc_find_new_empty() {
 }
 static size_t gc_heap_size = 0;
 static size_t gc_next_collection_size = (1 << 24);
-extern bool gc_needs_collection;
+bool gc_needs_collection = false;
+// A major collection first marks, between gc_start_marking(..) and
+// gc_finish_marking(..), and then sweeps, until gc_sweep(..) reaches the end
+// of the registry. Either phase can be done incrementally.
+bool gc_marking = false;
+static bool gc_sweeping = false;
+static int gc_current_pass = 0;
 struct gc_OBJECT_REGISTRY* gc_register_object(union itval object, size_t allocation_size, enum ts_CATEGORY category) {
     if(gc_current_empty == NULL) {
         gc_grow_registry();
@@ -63,7 +69,12 @@ struct gc_OBJECT_REGISTRY* gc_register_object(union itval object, size_t allocat
     ret->is_present = true;
     ret->allocation_size = allocation_size;
     ret->category = category;
-    ret->visited = 0;
+    // Objects are allocated black: they're never freed by the collection
+    // that's in progress, if any. That's safe because marking starts with an
+    // empty nursery, so every reference that objects allocated or promoted
+    // while marking hold was stored through the write barrier.
+    ret->visited = gc_current_pass;
+    ret->remembered = false;
     gc_find_new_empty();
     gc_heap_size += allocation_size;
     if(gc_heap_size > gc_next_collection_size) {
@@ -71,166 +82,534 @@ struct gc_OBJECT_REGISTRY* gc_register_object(union itval object, size_t allocat
     }
     return ret;
 }
+
+// Old-space objects of up to GC_SLAB_MAX_SIZE bytes are carved out of large
+// slabs, with one free list per size class. Sweeping pushes freed objects
+// back onto their free list, so a steady-state program mostly recycles
+// objects rather than going through malloc. Slabs are never returned to the
+// system. Bigger objects are just malloc'd.
+#define GC_SIZE_CLASS_GRANULARITY 16
+#define GC_SLAB_MAX_SIZE 512
+#define GC_SIZE_CLASSES (GC_SLAB_MAX_SIZE / GC_SIZE_CLASS_GRANULARITY)
+#define GC_SLAB_SIZE (1 << 16)
+struct gc_FREE_OBJECT {
+    struct gc_FREE_OBJECT* next;
+};
+struct gc_SIZE_CLASS {
+    struct gc_FREE_OBJECT* free_list;
+    // This is the unused part of the most recently allocated slab
+    char* slab_top;
+    char* slab_end;
+};
+static struct gc_SIZE_CLASS gc_size_classes[GC_SIZE_CLASSES];
+void* gc_slab_allocate(size_t size) {
+    if(size > GC_SLAB_MAX_SIZE) {
+        void* ret = malloc(size);
+        if(ret == NULL) {
+            printf("Allocation size: %ld\n", size);
+            fatal("Memory allocation failed");
+        }
+        return ret;
+    }
+    int size_class_index = (size - 1) / GC_SIZE_CLASS_GRANULARITY;
+    struct gc_SIZE_CLASS* size_class = &gc_size_classes[size_class_index];
+    if(size_class->free_list != NULL) {
+        struct gc_FREE_OBJECT* ret = size_class->free_list;
+        size_class->free_list = ret->next;
+        return ret;
+    }
+    size_t object_size = (size_class_index + 1) * GC_SIZE_CLASS_GRANULARITY;
+    if(size_class->slab_top == NULL || size_class->slab_top + object_size > size_class->slab_end) {
+        size_class->slab_top = malloc(GC_SLAB_SIZE);
+        if(size_class->slab_top == NULL) {
+            fatal("Memory allocation failed");
+        }
+        size_class->slab_end = size_class->slab_top + GC_SLAB_SIZE;
+    }
+    void* ret = size_class->slab_top;
+    size_class->slab_top += object_size;
+    return ret;
+}
+void gc_slab_free(void* object, size_t size) {
+    if(size > GC_SLAB_MAX_SIZE) {
+        free(object);
+        return;
+    }
+    struct gc_SIZE_CLASS* size_class = &gc_size_classes[(size - 1) / GC_SIZE_CLASS_GRANULARITY];
+    struct gc_FREE_OBJECT* free_object = object;
+    free_object->next = size_class->free_list;
+    size_class->free_list = free_object;
+}
 void gc_free_internal(struct gc_OBJECT_REGISTRY* registry_entry) {
     gc_heap_size -= registry_entry->allocation_size;
     // We're saying `.array_data` here, because the type information is lost in
     // the implicit conversion to void* anyway.
+    #if GC_POISON
     // Memset to notice use-after-free
     memset(registry_entry->object.array_data, 0x3e, registry_entry->allocation_size);
-    free(registry_entry->object.array_data);
+    #endif
+    gc_slab_free(registry_entry->object.array_data, registry_entry->allocation_size);
     registry_entry->is_present = false;
 }
 void gc_free(struct gc_OBJECT_REGISTRY* registry_entry) {
     gc_free_internal(registry_entry);
 }
-struct gc_QUEUE_ENTRY {
-    struct gc_OBJECT_REGISTRY* entry;
-    struct gc_QUEUE_ENTRY* next;
-};
-struct gc_QUEUE_ENTRY_PROPERTIES {
-    struct gc_QUEUE_ENTRY* start;
-    struct gc_QUEUE_ENTRY* end;
+double gc_elapsed_ms(struct timeval* start) {
+    struct timeval end;
+    gettimeofday(&end, NULL);
+    return (double) (end.tv_sec - start->tv_sec) * 1000.0 + (double) (end.tv_usec - start->tv_usec) / 1000.0;
+}
+bool gc_is_reference_category(enum ts_CATEGORY category) {
+    // Interface-typed values are just class instances as far as the garbage
+    // collector is concerned.
+    return category == ts_CATEGORY_ARRAY || category == ts_CATEGORY_CLAZZ || category == ts_CATEGORY_INTERFACE;
+}
+size_t gc_array_allocation_size(uint64_t length) {
+    return sizeof(struct it_ARRAY_DATA) + sizeof(union itval) * (length <= 0 ? 1 : length - 1);
+}
+size_t gc_clazz_allocation_size(struct ts_TYPE* clazz) {
+    return sizeof(struct it_CLAZZ_DATA) + sizeof(union itval) * clazz->data.clazz.nfields;
+}
+struct gc_OBJECT_REGISTRY** gc_get_registry_entry_ptr(union itval object, enum ts_CATEGORY category) {
+    if(category == ts_CATEGORY_ARRAY) {
+        return &object.array_data->gc_registry_entry;
+    } else {
+        return &object.clazz_data->gc_registry_entry;
+    }
+}
+
+// The nursery is a single bump-allocated region that holds every object
+// that has survived no collections. Young objects have no registry entry;
+// a minor collection copies the reachable ones into malloc'd old space and
+// registers them there, after which the whole nursery is reused.
+// Objects are promoted after surviving a single minor collection, so old
+// objects never need to be copied again.
+#define GC_NURSERY_SIZE (1 << 22)
+// Anything larger than this goes straight into old space, since copying it
+// out of the nursery would cost more than it saves.
+#define GC_LARGE_OBJECT_SIZE (GC_NURSERY_SIZE / 8)
+char* gc_nursery_start = NULL;
+char* gc_nursery_end = NULL;
+static char* gc_nursery_top = NULL;
+
+// This holds the old objects that might point into the nursery. Write
+// barriers add to it (see gc_remember_object(..)), and it's emptied by every
+// minor collection.
+struct gc_ENTRY_STACK {
+    struct gc_OBJECT_REGISTRY** entries;
+    size_t size;
+    size_t capacity;
 };
-void gc_add_to_queue(struct gc_OBJECT_REGISTRY* registry, struct gc_QUEUE_ENTRY_PROPERTIES* properties) {
-    struct gc_QUEUE_ENTRY* entry = mm_malloc(sizeof(struct gc_QUEUE_ENTRY));
-    entry->entry = registry;
-    entry->next = NULL;
-    if(properties->start == NULL) {
-        properties->start = entry;
-        properties->end = entry;
+static struct gc_ENTRY_STACK gc_remembered_set = {NULL, 0, 0};
+// This holds objects that have been promoted by the current minor collection
+// but whose fields and elements haven't been scanned yet.
+static struct gc_ENTRY_STACK gc_promoted_stack = {NULL, 0, 0};
+// Static variables are barriered separately, since they live outside of the
+// heap. This is a list of indices into program->static_vars.
+static uint32_t* gc_remembered_static_vars = NULL;
+static size_t gc_remembered_static_varsc = 0;
+static size_t gc_remembered_static_vars_capacity = 0;
+
+void gc_push_entry(struct gc_ENTRY_STACK* stack, struct gc_OBJECT_REGISTRY* entry) {
+    if(stack->size >= stack->capacity) {
+        stack->capacity = stack->capacity == 0 ? 64 : stack->capacity * 2;
+        stack->entries = realloc(stack->entries, sizeof(struct gc_OBJECT_REGISTRY*) * stack->capacity);
+        if(stack->entries == NULL) {
+            fatal("Memory allocation failed");
+        }
+    }
+    stack->entries[stack->size++] = entry;
+}
+void gc_remember_object(struct gc_OBJECT_REGISTRY* entry) {
+    if(entry->remembered) {
+        return;
+    }
+    entry->remembered = true;
+    gc_push_entry(&gc_remembered_set, entry);
+}
+void gc_remember_static_var(struct it_PROGRAM* program, uint32_t index) {
+    if(program->static_vars[index].remembered) {
+        return;
+    }
+    program->static_vars[index].remembered = true;
+    if(gc_remembered_static_varsc >= gc_remembered_static_vars_capacity) {
+        gc_remembered_static_vars_capacity = gc_remembered_static_vars_capacity == 0 ? 16 : gc_remembered_static_vars_capacity * 2;
+        gc_remembered_static_vars = realloc(gc_remembered_static_vars, sizeof(uint32_t) * gc_remembered_static_vars_capacity);
+        if(gc_remembered_static_vars == NULL) {
+            fatal("Memory allocation failed");
+        }
+    }
+    gc_remembered_static_vars[gc_remembered_static_varsc++] = index;
+}
+
+static size_t gc_promoted_bytes = 0;
+static size_t gc_promoted_objects = 0;
+// Given a reference of the given static category, make sure that it doesn't
+// point into the nursery, promoting its target if need be.
+void gc_evacuate(union itval* reference, enum ts_CATEGORY category) {
+    if(!GC_IS_YOUNG(reference->array_data)) {
+        return;
+    }
+    enum ts_CATEGORY object_category = category == ts_CATEGORY_ARRAY ? ts_CATEGORY_ARRAY : ts_CATEGORY_CLAZZ;
+    struct gc_OBJECT_REGISTRY** registry_entry_ptr = gc_get_registry_entry_ptr(*reference, object_category);
+    if(*registry_entry_ptr != NULL) {
+        // Already promoted, so the registry entry serves as a forwarding
+        // pointer.
+        *reference = (*registry_entry_ptr)->object;
+        return;
+    }
+    size_t allocation_size;
+    if(object_category == ts_CATEGORY_ARRAY) {
+        allocation_size = gc_array_allocation_size(reference->array_data->length);
     } else {
-        properties->end->next = entry;
-        properties->end = entry;
+        allocation_size = gc_clazz_allocation_size(reference->clazz_data->method_table->type);
     }
+    union itval promoted;
+    promoted.array_data = gc_slab_allocate(allocation_size);
+    memcpy(promoted.array_data, reference->array_data, allocation_size);
+    struct gc_OBJECT_REGISTRY* entry = gc_register_object(promoted, allocation_size, object_category);
+    *gc_get_registry_entry_ptr(promoted, object_category) = entry;
+    *registry_entry_ptr = entry;
+    *reference = promoted;
+    gc_promoted_bytes += allocation_size;
+    gc_promoted_objects++;
+    gc_push_entry(&gc_promoted_stack, entry);
 }
-struct gc_OBJECT_REGISTRY* gc_pop_from_queue(struct gc_QUEUE_ENTRY_PROPERTIES* properties) {
-    struct gc_QUEUE_ENTRY* queue_entry = properties->start;
-    struct gc_OBJECT_REGISTRY* ret = properties->start->entry;
-    properties->start = queue_entry->next;
-    free(queue_entry);
-    return ret;
+void gc_evacuate_children(struct gc_OBJECT_REGISTRY* entry) {
+    if(entry->category == ts_CATEGORY_ARRAY) {
+        struct it_ARRAY_DATA* arr_data = entry->object.array_data;
+        enum ts_CATEGORY element_category = arr_data->type->data.array.parent_type->category;
+        if(!gc_is_reference_category(element_category)) {
+            return;
+        }
+        for(uint64_t i = 0; i < arr_data->length; i++) {
+            gc_evacuate(&arr_data->elements[i], element_category);
+        }
+    } else {
+        struct it_CLAZZ_DATA* clazz_data = entry->object.clazz_data;
+        struct ts_TYPE* clazz_properties = clazz_data->method_table->type;
+        for(int i = 0; i < clazz_properties->data.clazz.nfields; i++) {
+            struct ts_TYPE* field_type = clazz_properties->data.clazz.fields[i].type;
+            if(field_type == NULL || !gc_is_reference_category(field_type->category)) {
+                continue;
+            }
+            gc_evacuate(&clazz_data->itval[i], field_type->category);
+        }
+    }
 }
-static int gc_current_pass = 0;
-void gc_collect(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options) {
-    size_t starting_heap_size = gc_heap_size;
-    if(options->gc_verbose) {
-        printf("Garbage collecting, starting heap size is %ld\n", gc_heap_size);
+void gc_collect_minor(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options) {
+    if(gc_nursery_start == NULL) {
+        return;
     }
-    gc_current_pass++;
-    struct gc_QUEUE_ENTRY_PROPERTIES properties;
-    properties.start = NULL;
-    properties.end = NULL;
-    // This exists to catch bugs. It was initially debugging code but
-    // it's cheap enough to leave in just in case.
-    int add_parity = 0;
+    struct timeval start;
+    gettimeofday(&start, NULL);
+    size_t nursery_used = gc_nursery_top - gc_nursery_start;
+    gc_promoted_bytes = 0;
+    gc_promoted_objects = 0;
     for(struct it_STACKFRAME* currentptr = stack; currentptr <= current_frame; currentptr++) {
         struct it_METHOD* method = currentptr->method;
         for(int i = 0; i < method->registerc; i++) {
-            if(currentptr->registers[i].array_data == NULL) {
-                continue;
-            }
             enum ts_CATEGORY category = method->register_types[i]->category;
-            if(category == ts_CATEGORY_ARRAY) {
-                add_parity++;
-                struct it_ARRAY_DATA* array_data = currentptr->registers[i].array_data;
-                gc_add_to_queue(array_data->gc_registry_entry, &properties);
-            } else if(category == ts_CATEGORY_CLAZZ) {
-                add_parity++;
-                gc_add_to_queue(currentptr->registers[i].clazz_data->gc_registry_entry, &properties);
+            if(gc_is_reference_category(category)) {
+                gc_evacuate(&currentptr->registers[i], category);
             }
         }
     }
-    for(int i = 0; i < program->static_varsc; i++) {
-        enum ts_CATEGORY category = program->static_vars[i].type->category;
-        // Note that itval.array_data == NULL iff itval.clazz_data == NULL
-        if(program->static_vars[i].value.array_data == NULL) {
-            continue;
-        }
-        if(category == ts_CATEGORY_ARRAY) {
-            add_parity++;
-            struct it_ARRAY_DATA* array_data = program->static_vars[i].value.array_data;
-            gc_add_to_queue(array_data->gc_registry_entry, &properties);
-        } else if(category == ts_CATEGORY_CLAZZ) {
-            add_parity++;
-            struct it_CLAZZ_DATA* clazz_data = program->static_vars[i].value.clazz_data;
-            gc_add_to_queue(clazz_data->gc_registry_entry, &properties);
-        } else {
-            // Do nothing
+    for(size_t i = 0; i < gc_remembered_static_varsc; i++) {
+        struct sv_STATIC_VAR* static_var = &program->static_vars[gc_remembered_static_vars[i]];
+        static_var->remembered = false;
+        if(gc_is_reference_category(static_var->type->category)) {
+            gc_evacuate(&static_var->value, static_var->type->category);
         }
     }
-    while(properties.start != NULL) {
-        struct gc_OBJECT_REGISTRY* entry = gc_pop_from_queue(&properties);
-        add_parity--;
-        if(entry->visited >= gc_current_pass) {
-            continue;
+    gc_remembered_static_varsc = 0;
+    for(size_t i = 0; i < gc_remembered_set.size; i++) {
+        gc_remembered_set.entries[i]->remembered = false;
+        gc_evacuate_children(gc_remembered_set.entries[i]);
+    }
+    gc_remembered_set.size = 0;
+    while(gc_promoted_stack.size > 0) {
+        gc_evacuate_children(gc_promoted_stack.entries[--gc_promoted_stack.size]);
+    }
+    gc_nursery_top = gc_nursery_start;
+    #if GC_POISON
+    // Poison the nursery to notice references that weren't updated
+    memset(gc_nursery_start, 0x3e, GC_NURSERY_SIZE);
+    #endif
+    if(options->gc_verbose) {
+        printf("Garbage collecting (minor), promoted %ld of %ld bytes (%ld objects), pause %.3fms\n",
+                gc_promoted_bytes,
+                nursery_used,
+                gc_promoted_objects,
+                gc_elapsed_ms(&start));
+    }
+}
+union itval gc_allocate_old(size_t allocation_size, enum ts_CATEGORY category) {
+    union itval ret;
+    ret.array_data = gc_slab_allocate(allocation_size);
+    memset(ret.array_data, 0, allocation_size);
+    *gc_get_registry_entry_ptr(ret, category) = gc_register_object(ret, allocation_size, category);
+    return ret;
+}
+
+// This holds grey objects: ones that have been marked but whose fields and
+// elements haven't been scanned yet. It's kept between collections, so
+// marking doesn't allocate unless the heap has grown since the last one.
+static struct gc_ENTRY_STACK gc_mark_stack = {NULL, 0, 0};
+// This exists to catch bugs. It was initially debugging code but
+// it's cheap enough to leave in just in case.
+static int gc_mark_parity = 0;
+static size_t gc_objects_marked = 0;
+static double gc_mark_ms = 0;
+static size_t gc_starting_heap_size = 0;
+static size_t gc_bytes_since_slice = 0;
+// While collecting incrementally, a slice of marking or sweeping runs after
+// every GC_MARK_SLICE_BYTES bytes of allocation.
+#define GC_MARK_SLICE_BYTES (1 << 18)
+// If the heap grows this many times past the collection threshold before
+// incremental marking finishes, the rest of the collection is done at once.
+#define GC_MAX_HEAP_GROWTH_WHILE_MARKING 2
+void gc_mark(union itval reference, enum ts_CATEGORY category) {
+    // Note that itval.array_data == NULL iff itval.clazz_data == NULL
+    // Young objects don't take part in major collections; the nursery is
+    // always empty when marking starts.
+    if(reference.array_data == NULL || !gc_is_reference_category(category) || GC_IS_YOUNG(reference.array_data)) {
+        return;
+    }
+    struct gc_OBJECT_REGISTRY* entry = *gc_get_registry_entry_ptr(reference, category == ts_CATEGORY_ARRAY ? ts_CATEGORY_ARRAY : ts_CATEGORY_CLAZZ);
+    // Objects are marked as they're pushed rather than as they're popped, so
+    // each one is pushed at most once and the stack never outgrows the heap.
+    if(entry->visited >= gc_current_pass) {
+        return;
+    }
+    entry->visited = gc_current_pass;
+    gc_mark_parity++;
+    gc_push_entry(&gc_mark_stack, entry);
+}
+void gc_mark_roots(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame) {
+    for(struct it_STACKFRAME* currentptr = stack; currentptr <= current_frame; currentptr++) {
+        struct it_METHOD* method = currentptr->method;
+        for(int i = 0; i < method->registerc; i++) {
+            gc_mark(currentptr->registers[i], method->register_types[i]->category);
+        }
+    }
+    for(int i = 0; i < program->static_varsc; i++) {
+        gc_mark(program->static_vars[i].value, program->static_vars[i].type->category);
+    }
+}
+void gc_scan(struct gc_OBJECT_REGISTRY* entry) {
+    if(entry->category == ts_CATEGORY_ARRAY) {
+        struct it_ARRAY_DATA* arr_data = entry->object.array_data;
+        enum ts_CATEGORY element_category = arr_data->type->data.array.parent_type->category;
+        if(!gc_is_reference_category(element_category)) {
+            return;
         }
-        entry->visited = gc_current_pass;
-        if(entry->category == ts_CATEGORY_ARRAY) {
-            struct it_ARRAY_DATA* arr_data = entry->object.array_data;
-            if(arr_data->type->data.array.parent_type->category == ts_CATEGORY_PRIMITIVE) {
+        for(uint64_t i = 0; i < arr_data->length; i++) {
+            gc_mark(arr_data->elements[i], element_category);
+        }
+    } else if(entry->category == ts_CATEGORY_CLAZZ) {
+        #if ASSERTIONS
+        if(ts_clazz_is_raw(entry->object.clazz_data->method_table->type)) {
+            fatal("Garbage collector got a raw type");
+        }
+        #endif
+        struct ts_TYPE* clazz_properties = entry->object.clazz_data->method_table->type;
+        for(int i = 0; i < clazz_properties->data.clazz.nfields; i++) {
+            struct ts_TYPE* field_type = clazz_properties->data.clazz.fields[i].type;
+            if(field_type == NULL) {
                 continue;
-            } else if(arr_data->type->data.array.parent_type->category == ts_CATEGORY_ARRAY) {
-                for(int i = 0; i < arr_data->length; i++) {
-                    if(arr_data->elements[i].array_data == NULL) {
-                        continue;
-                    }
-                    add_parity++;
-                    gc_add_to_queue(arr_data->elements[i].array_data->gc_registry_entry, &properties);
-                }
-            } else if(arr_data->type->data.array.parent_type->category == ts_CATEGORY_CLAZZ) {
-                for(int i = 0; i < arr_data->length; i++) {
-                    if(arr_data->elements[i].clazz_data == NULL) {
-                        continue;
-                    }
-                    add_parity++;
-                    gc_add_to_queue(arr_data->elements[i].clazz_data->gc_registry_entry, &properties);
-                }
-            }
-        } else if(entry->category == ts_CATEGORY_CLAZZ) {
-            #if ASSERTIONS
-            if(ts_clazz_is_raw(entry->object.clazz_data->method_table->type)) {
-                fatal("Garbage collector got a raw type");
             }
-            #endif
-            struct ts_TYPE* clazz_properties = entry->object.clazz_data->method_table->type;
-            for(int i = 0; i < clazz_properties->data.clazz.nfields; i++) {
-                if(entry->object.clazz_data->itval[i].array_data == NULL) {
-                    continue;
-                } else if(clazz_properties->data.clazz.fields[i].type->category == ts_CATEGORY_PRIMITIVE) {
-                    continue;
-                } else if(clazz_properties->data.clazz.fields[i].type->category == ts_CATEGORY_ARRAY) {
-                    add_parity++;
-                    gc_add_to_queue(entry->object.clazz_data->itval[i].array_data->gc_registry_entry, &properties);
-                } else if(clazz_properties->data.clazz.fields[i].type->category == ts_CATEGORY_CLAZZ) {
-                    add_parity++;
-                    gc_add_to_queue(entry->object.clazz_data->itval[i].clazz_data->gc_registry_entry, &properties);
-                }
+            gc_mark(entry->object.clazz_data->itval[i], field_type->category);
+        }
+    } else {
+        fatal("Somehow got an entry that isn't a class or array");
+    }
+}
+// Scan grey objects until there are none left, or until the deadline has
+// passed. A null deadline means there's no time limit. Returns whether all
+// grey objects were scanned.
+bool gc_drain_mark_stack(struct timeval* deadline) {
+    struct timeval start;
+    gettimeofday(&start, NULL);
+    size_t objects_marked = 0;
+    bool finished = true;
+    while(gc_mark_stack.size > 0) {
+        // Checking the time is comparatively expensive, so only do it every
+        // so often
+        if(deadline != NULL && objects_marked % 256 == 255) {
+            struct timeval now;
+            gettimeofday(&now, NULL);
+            if(timercmp(&now, deadline, >)) {
+                finished = false;
+                break;
             }
-        } else {
-            fatal("Somehow got an entry that isn't a class or array");
         }
+        gc_scan(gc_mark_stack.entries[--gc_mark_stack.size]);
+        gc_mark_parity--;
+        objects_marked++;
     }
-    if(add_parity != 0) {
-        printf("Add parity failed: %d\n", add_parity);
+    gc_objects_marked += objects_marked;
+    gc_mark_ms += gc_elapsed_ms(&start);
+    return finished;
+}
+static struct timeval gc_pause_start;
+void gc_start_marking(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options) {
+    // Evacuating the nursery first means that every reachable object has a
+    // registry entry, so the mark phase doesn't need to know about young
+    // objects at all.
+    gc_collect_minor(program, stack, current_frame, options);
+    gc_starting_heap_size = gc_heap_size;
+    if(options->gc_verbose) {
+        printf("Garbage collecting, starting heap size is %ld\n", gc_heap_size);
+    }
+    gc_current_pass++;
+    gc_mark_parity = 0;
+    gc_objects_marked = 0;
+    gc_mark_ms = 0;
+    gc_bytes_since_slice = 0;
+    gc_marking = true;
+    struct timeval start;
+    gettimeofday(&start, NULL);
+    gc_mark_roots(program, stack, current_frame);
+    gc_mark_ms += gc_elapsed_ms(&start);
+}
+static struct gc_OBJECT_REGISTRY* gc_sweep_cursor = NULL;
+void gc_finish_marking(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options) {
+    // Registers aren't covered by the write barrier, so they have to be
+    // scanned again. Emptying the nursery also empties the remembered set,
+    // which mustn't hold on to anything that's about to be freed.
+    gc_collect_minor(program, stack, current_frame, options);
+    struct timeval start;
+    gettimeofday(&start, NULL);
+    gc_mark_roots(program, stack, current_frame);
+    gc_mark_ms += gc_elapsed_ms(&start);
+    gc_drain_mark_stack(NULL);
+    if(gc_mark_parity != 0) {
+        printf("Add parity failed: %d\n", gc_mark_parity);
         fatal("Add parity failed");
     }
-    for(struct gc_OBJECT_REGISTRY* registry = gc_first_registry; registry != NULL; registry = registry->next) {
-        if(!registry->is_present) {
-            continue;
+    gc_marking = false;
+    gc_sweeping = true;
+    gc_sweep_cursor = gc_first_registry;
+}
+// Free unmarked objects until the end of the registry, or until the deadline
+// has passed. A null deadline means there's no time limit. Returns whether
+// the sweep is finished.
+bool gc_sweep(struct timeval* deadline, struct it_OPTIONS* options) {
+    size_t entries_swept = 0;
+    while(gc_sweep_cursor != NULL) {
+        if(deadline != NULL && entries_swept % 1024 == 1023) {
+            struct timeval now;
+            gettimeofday(&now, NULL);
+            if(timercmp(&now, deadline, >)) {
+                return false;
+            }
         }
-        if(registry->visited < gc_current_pass) {
-            gc_free(registry);
+        if(gc_sweep_cursor->is_present && gc_sweep_cursor->visited < gc_current_pass) {
+            gc_free(gc_sweep_cursor);
         }
+        gc_sweep_cursor = gc_sweep_cursor->next;
+        entries_swept++;
     }
+    gc_sweeping = false;
     gc_needs_collection = false;
     gc_next_collection_size = gc_heap_size * 2;
     if(gc_next_collection_size < (1 << 24)) {
         gc_next_collection_size = 1 << 24;
     }
     if(options->gc_verbose) {
-        printf("Finished collection, heap size is %ld (freed %ld bytes or %4f%%)\n",
+        printf("Marked %ld objects in %.3fms\n", gc_objects_marked, gc_mark_ms);
+        printf("Finished collection, heap size is %ld (freed %ld bytes or %4f%%), pause %.3fms\n",
                 gc_heap_size,
-                starting_heap_size - gc_heap_size,
-                (double) 100 * ((double) 1 - (double) gc_heap_size / (double) starting_heap_size));
+                gc_starting_heap_size - gc_heap_size,
+                (double) 100 * ((double) 1 - (double) gc_heap_size / (double) gc_starting_heap_size),
+                gc_elapsed_ms(&gc_pause_start));
+    }
+    return true;
+}
+// Do about options->gc_pause_target milliseconds of work on the collection
+// that's in progress.
+void gc_collection_slice(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options) {
+    gettimeofday(&gc_pause_start, NULL);
+    struct timeval budget;
+    budget.tv_sec = (time_t) (options->gc_pause_target / 1000);
+    budget.tv_usec = (suseconds_t) ((options->gc_pause_target - budget.tv_sec * 1000) * 1000);
+    struct timeval deadline;
+    timeradd(&gc_pause_start, &budget, &deadline);
+    if(gc_marking) {
+        size_t objects_marked_before = gc_objects_marked;
+        if(gc_heap_size > gc_next_collection_size * GC_MAX_HEAP_GROWTH_WHILE_MARKING) {
+            // The program is allocating faster than we're marking
+            gc_finish_marking(program, stack, current_frame, options);
+        } else if(gc_drain_mark_stack(&deadline)) {
+            gc_finish_marking(program, stack, current_frame, options);
+        }
+        if(options->gc_verbose) {
+            printf("Incremental mark slice, marked %ld objects, pause %.3fms\n", gc_objects_marked - objects_marked_before, gc_elapsed_ms(&gc_pause_start));
+        }
+    } else if(gc_sweeping) {
+        size_t heap_size_before = gc_heap_size;
+        gc_sweep(&deadline, options);
+        if(options->gc_verbose) {
+            printf("Incremental sweep slice, freed %ld bytes, pause %.3fms\n", heap_size_before - gc_heap_size, gc_elapsed_ms(&gc_pause_start));
+        }
+    }
+}
+// This does a whole major collection at once, or finishes the one that's in
+// progress.
+void gc_collect(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options) {
+    gettimeofday(&gc_pause_start, NULL);
+    if(!gc_marking && !gc_sweeping) {
+        gc_start_marking(program, stack, current_frame, options);
     }
+    if(gc_marking) {
+        gc_finish_marking(program, stack, current_frame, options);
+    }
+    gc_sweep(NULL, options);
+}
+// This is called on every allocation, and decides whether to start, continue,
+// or finish a major collection.
+void gc_maybe_collect(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options, size_t allocation_size) {
+    if(gc_marking || gc_sweeping) {
+        gc_bytes_since_slice += allocation_size;
+        if(gc_bytes_since_slice >= GC_MARK_SLICE_BYTES) {
+            gc_bytes_since_slice = 0;
+            gc_collection_slice(program, stack, current_frame, options);
+        }
+    } else if(gc_needs_collection) {
+        if(options->gc_pause_target > 0) {
+            gettimeofday(&gc_pause_start, NULL);
+            gc_start_marking(program, stack, current_frame, options);
+        } else {
+            gc_collect(program, stack, current_frame, options);
+        }
+    }
+}
+union itval gc_allocate(struct it_PROGRAM* program, struct it_STACKFRAME* stack, struct it_STACKFRAME* current_frame, struct it_OPTIONS* options, size_t allocation_size, enum ts_CATEGORY category) {
+    union itval ret;
+    if(options->no_gc || allocation_size > GC_LARGE_OBJECT_SIZE) {
+        if(!options->no_gc && (gc_marking || gc_sweeping || gc_needs_collection)) {
+            gc_maybe_collect(program, stack, current_frame, options, allocation_size);
+        }
+        return gc_allocate_old(allocation_size, category);
+    }
+    if(gc_nursery_start == NULL) {
+        gc_nursery_start = mm_malloc(GC_NURSERY_SIZE);
+        gc_nursery_end = gc_nursery_start + GC_NURSERY_SIZE;
+        gc_nursery_top = gc_nursery_start;
+    }
+    // Keep every object 8-byte aligned
+    allocation_size = (allocation_size + 7) & ~((size_t) 7);
+    if(gc_nursery_top + allocation_size > gc_nursery_end) {
+        gc_collect_minor(program, stack, current_frame, options);
+    }
+    if(gc_marking || gc_sweeping || gc_needs_collection) {
+        gc_maybe_collect(program, stack, current_frame, options, allocation_size);
+    }
+    ret.array_data = (struct it_ARRAY_DATA*) gc_nursery_top;
+    gc_nursery_top += allocation_size;
+    // The nursery is reused without being cleared, and young objects are
+    // recognized by their lack of a registry entry.
+    memset(ret.array_data, 0, allocation_size);
+    return ret;
 }
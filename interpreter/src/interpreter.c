@@ -3,14 +3,134 @@
 #include <stdio.h>
 #include <unistd.h>
 #include <string.h>
+#include <stdatomic.h>
 #include "common.h"
 #include "interpreter.h"
 #include "opcodes.h"
 #include "nativelibs.h"
+#include "bytecode.h"
 
 #define STACKSIZE 1024
 
-extern bool gc_needs_collection;
+#if THREADED_DISPATCH
+// Each handler in it_execute(..) is labelled TARGET_<opcode>, so that the
+// address of the handler can be stored directly in the opcode at load time,
+// and dispatch is a single indirect jump from the end of the previous handler.
+#define TARGET(opcode) case opcode: TARGET_##opcode:
+// Per-iteration debugging output lives at the top of the dispatch loop, so
+// fall back to the loop when we need it.
+#if DEBUG || CATEGORY_GUARDS_EVERY_ITERATION
+#define DISPATCH() continue
+#define REDISPATCH() goto REDISPATCH_LOOP
+#else
+#define DISPATCH() goto *iptr->handler
+#define REDISPATCH() goto *dispatch_table[iptr->type]
+#endif
+#else
+#define TARGET(opcode) case opcode:
+#define DISPATCH() continue
+#define REDISPATCH() goto REDISPATCH_LOOP
+#endif
+// REDISPATCH() runs iptr's handler again after the handler has rewritten it,
+// without counting it as another instruction (or profiling it again).
+
+// Under --print-instruction-count and --profile, every opcode has to be
+// counted or seen by the profiler before it's executed. When dispatch goes
+// back through the top of the loop anyway, that's where it's done; otherwise,
+// every opcode's handler is replaced with COUNT_OPCODE or PROFILE_OPCODE in
+// it_execute(..), which does it and then jumps to the real handler. Either
+// way, there's no cost when neither option is passed.
+#if THREADED_DISPATCH && !(DEBUG || CATEGORY_GUARDS_EVERY_ITERATION)
+#define INSTRUMENT_THROUGH_HANDLERS 1
+#else
+#define INSTRUMENT_THROUGH_HANDLERS 0
+#endif
+
+// These implement the compare-and-jump superinstructions. See
+// bc_fuse_superinstructions(..) for the sequences they replace.
+#define COMPARE_AND_JUMP(name, operator) \
+    TARGET(OPCODE_##name) { \
+        struct it_OPCODE_DATA_CMPJF* data = &iptr->data.cmpjf; \
+        registers[data->predicate].number = registers[data->source1].number operator registers[data->source2].number; \
+        if(registers[data->predicate].number == 0) { \
+            iptr = instruction_start + data->target; \
+        } else { \
+            iptr += 2; \
+        } \
+        DISPATCH(); \
+    }
+#define COMPARE_IMMEDIATE_AND_JUMP(name, operator) \
+    TARGET(OPCODE_##name) { \
+        struct it_OPCODE_DATA_CMPJF* data = &iptr->data.cmpjf; \
+        registers[data->source2].number = data->immediate; \
+        registers[data->predicate].number = registers[data->source1].number operator registers[data->source2].number; \
+        if(registers[data->predicate].number == 0) { \
+            iptr = instruction_start + data->target; \
+        } else { \
+            iptr += 3; \
+        } \
+        DISPATCH(); \
+    }
+
+// This implements the specialised non-replaced calls, which only differ in
+// whether they pass `this`. Both layouts start with the callee and the
+// return register.
+#define CALL_DIRECT(name, has_this) \
+    TARGET(OPCODE_##name) { \
+        struct it_METHOD* callee = iptr->data.call.callee; \
+        if(has_this && registers[iptr->data.classcallspecial.callee_register].clazz_data == NULL) { \
+            it_traceback(stackptr); \
+            fatal("Attempt to do a non-virtual class call on null"); \
+        } \
+        struct it_STACKFRAME* oldstack = stackptr; \
+        stackptr++; \
+        if(stackptr >= stackend) { \
+            stackptr--; \
+            it_traceback(stackptr); \
+            fatal("Stack overflow"); \
+        } \
+        CALL_DEBUG_OUTPUT(callee, oldstack); \
+        oldstack->returnreg = iptr->data.call.returnval; \
+        calls_executed++; \
+        load_method(stackptr, callee, has_this); \
+        registers = stackptr->registers; \
+        if(has_this) { \
+            registers[0] = oldstack->registers[iptr->data.classcallspecial.callee_register]; \
+        } \
+        oldstack->iptr = iptr; \
+        instruction_start = stackptr->iptr; \
+        iptr = instruction_start; \
+        CALL_CATEGORY_GUARDS(); \
+        DISPATCH(); \
+    }
+#if DEBUG
+#define CALL_DEBUG_OUTPUT(callee, oldstack) \
+    if(callee->containing_clazz != NULL) { \
+        printf("Calling %s from %s\n", callee->name, callee->containing_clazz->name); \
+    } else { \
+        printf("Calling %s\n", callee->name); \
+    } \
+    printf("Need %d args.\n", callee->nargs); \
+    for(uint32_t i = 0; i < callee->nargs; i++) { \
+        printf("Argument: %02x\n", it_get_params(oldstack)[i]); \
+    }
+#else
+#define CALL_DEBUG_OUTPUT(callee, oldstack)
+#endif
+#if CATEGORY_GUARDS
+#define CALL_CATEGORY_GUARDS() \
+    for(int i = 0; i < stackptr->method->registerc; i++) { \
+        if(registers[i].number == 0) { \
+            continue; \
+        } \
+        enum ts_CATEGORY stated_category = stackptr->method->register_types[i]->category; \
+        if(stated_category == ts_CATEGORY_TYPE_PARAMETER) { \
+            fatal("Register of category type parameter"); \
+        } \
+    }
+#else
+#define CALL_CATEGORY_GUARDS()
+#endif
 
 void it_traceback(struct it_STACKFRAME* stackptr) {
     printf("Traceback (most recent call first):\n");
@@ -27,35 +147,180 @@ void it_traceback(struct it_STACKFRAME* stackptr) {
         stackptr--;
     }
 }
-void load_method(struct it_STACKFRAME* stackptr, struct it_METHOD* method) {
-    stackptr->method = method;
-    stackptr->iptr = stackptr->method->opcodes;
-    stackptr->registerc = stackptr->method->registerc;
-    if(stackptr->registers_allocated < stackptr->registerc) {
+// Every frame's registers are a window into one contiguous register stack.
+// The PARAMs in a frame write straight into the registers of the frame it's
+// about to call, which start just past its own (see it_get_params(..)), so
+// arguments are never copied; class calls put `this` in the register just
+// before the parameters.
+static union itval* it_register_stack = NULL;
+static size_t it_register_stack_size = 0;
+// PARAM targets are a uint8_t
+#define PARAM_AREA_SIZE 256
+
+// This is the innermost frame that is executing, for the sampling profiler.
+// It's NULL when nothing is executing.
+struct it_STACKFRAME* volatile it_current_frame = NULL;
+void it_set_current_frame(struct it_STACKFRAME* frame) {
+    // The profiler's signal handler could run at any point, so make sure
+    // frame has been filled in before it can be seen
+    atomic_signal_fence(memory_order_release);
+    it_current_frame = frame;
+}
+
+union itval* it_get_params(struct it_STACKFRAME* frame) {
+    // This is where the PARAMs executed in frame put their arguments
+    return frame->registers + frame->registerc + 1;
+}
+void load_method(struct it_STACKFRAME* stackptr, struct it_METHOD* method, bool has_this) {
+    union itval* registers;
+    if(stackptr->index == 0) {
+        registers = it_register_stack;
+    } else {
+        registers = it_get_params(stackptr - 1) - (has_this ? 1 : 0);
+    }
+    // Leave room for the frame's registers, and for any PARAMs it executes
+    size_t needed = (registers - it_register_stack) + method->registerc + 1 + PARAM_AREA_SIZE;
+    if(needed > it_register_stack_size) {
+        size_t new_size = it_register_stack_size == 0 ? 4096 : it_register_stack_size * 2;
+        while(new_size < needed) {
+            new_size *= 2;
+        }
         #if DEBUG
-        printf("Allocating more register space: %d < %d\n", stackptr->registers_allocated, stackptr->registerc);
+        printf("Growing the register stack to %lu registers\n", new_size);
         #endif
-        free(stackptr->registers);
-        stackptr->registers = mm_malloc(sizeof(union itval) * stackptr->registerc);
+        size_t registers_offset = registers - it_register_stack;
+        union itval* new_register_stack = realloc(it_register_stack, sizeof(union itval) * new_size);
+        if(new_register_stack == NULL) {
+            fatal("Memory allocation failed");
+        }
+        // Every frame's registers have moved along with the register stack
+        for(struct it_STACKFRAME* frame = stackptr - stackptr->index; frame < stackptr; frame++) {
+            frame->registers = new_register_stack + (frame->registers - it_register_stack);
+        }
+        it_register_stack = new_register_stack;
+        it_register_stack_size = new_size;
+        registers = it_register_stack + registers_offset;
+    }
+    stackptr->method = method;
+    stackptr->iptr = method->opcodes;
+    stackptr->registerc = method->registerc;
+    stackptr->registers = registers;
+    // The arguments (including `this`) are already in place, but the rest of
+    // the registers have to start off zeroed, not least for the sake of the
+    // garbage collector.
+    if(method->registerc > method->nargs) {
+        memset(registers + method->nargs, 0x00, (method->registerc - method->nargs) * sizeof(union itval));
+    }
+    it_set_current_frame(stackptr);
+}
+#if THREADED_DISPATCH
+// This points to the dispatch table in it_execute(..), and is set by calling
+// it_execute(..) with a null program.
+static void** it_dispatch_table = NULL;
+// This is non-NULL iff every opcode should be dispatched to COUNT_OPCODE or
+// PROFILE_OPCODE
+static void* it_instrument_handler = NULL;
+#endif
+void* it_get_opcode_handler(uint8_t type) {
+    #if THREADED_DISPATCH
+    if(it_instrument_handler != NULL) {
+        return it_instrument_handler;
+    }
+    if(it_dispatch_table == NULL) {
+        it_execute(NULL, NULL);
+    }
+    return it_dispatch_table[type];
+    #else
+    return NULL;
+    #endif
+}
+void it_reset_opcode_handlers(struct it_PROGRAM* prog) {
+    // This asks it_get_opcode_handler(..) again for the handler of every
+    // opcode that has been loaded
+    for(int i = 0; i < prog->methodc; i++) {
+        struct it_METHOD* method = &prog->methods[i];
+        for(int j = 0; j <= method->reificationsc; j++) {
+            struct it_METHOD* reification = j == 0 ? method : method->reifications[j - 1];
+            for(int k = 0; k < reification->opcodec; k++) {
+                bc_set_opcode_type(&reification->opcodes[k], reification->opcodes[k].type);
+            }
+        }
     }
-    // Technically, we've already zeroed out the memory (in mm_malloc(...)).
-    // But that's mostly to ease debugging, I don't want to rely on it.
-    memset(stackptr->registers, 0x00, stackptr->registerc * sizeof(union itval));
 }
 void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
+    #if THREADED_DISPATCH
+    static void* dispatch_table[256] = {
+        [0 ... 255] = &&TARGET_UNKNOWN,
+        [OPCODE_PARAM] = &&TARGET_OPCODE_PARAM,
+        [OPCODE_CALL] = &&TARGET_OPCODE_CALL,
+        [OPCODE_CLASSCALLSPECIAL] = &&TARGET_OPCODE_CLASSCALLSPECIAL,
+        [OPCODE_CLASSCALL] = &&TARGET_OPCODE_CLASSCALL,
+        [OPCODE_INTERFACECALL] = &&TARGET_OPCODE_INTERFACECALL,
+        [OPCODE_RETURN] = &&TARGET_OPCODE_RETURN,
+        [OPCODE_ZERO] = &&TARGET_OPCODE_ZERO,
+        [OPCODE_ADD] = &&TARGET_OPCODE_ADD,
+        [OPCODE_TWOCOMP] = &&TARGET_OPCODE_TWOCOMP,
+        [OPCODE_MULT] = &&TARGET_OPCODE_MULT,
+        [OPCODE_MODULO] = &&TARGET_OPCODE_MODULO,
+        [OPCODE_DIV] = &&TARGET_OPCODE_DIV,
+        [OPCODE_EQUALS] = &&TARGET_OPCODE_EQUALS,
+        [OPCODE_INVERT] = &&TARGET_OPCODE_INVERT,
+        [OPCODE_LTEQ] = &&TARGET_OPCODE_LTEQ,
+        [OPCODE_GT] = &&TARGET_OPCODE_GT,
+        [OPCODE_GOTO] = &&TARGET_OPCODE_GOTO,
+        [OPCODE_JF] = &&TARGET_OPCODE_JF,
+        [OPCODE_GTEQ] = &&TARGET_OPCODE_GTEQ,
+        [OPCODE_XOR] = &&TARGET_OPCODE_XOR,
+        [OPCODE_AND] = &&TARGET_OPCODE_AND,
+        [OPCODE_OR] = &&TARGET_OPCODE_OR,
+        [OPCODE_MOV] = &&TARGET_OPCODE_MOV,
+        [OPCODE_NOP] = &&TARGET_OPCODE_NOP,
+        [OPCODE_LOAD] = &&TARGET_OPCODE_LOAD,
+        [OPCODE_LT] = &&TARGET_OPCODE_LT,
+        [OPCODE_NEW] = &&TARGET_OPCODE_NEW,
+        [OPCODE_ACCESS] = &&TARGET_OPCODE_ACCESS,
+        [OPCODE_ASSIGN] = &&TARGET_OPCODE_ASSIGN,
+        [OPCODE_ARRALLOC] = &&TARGET_OPCODE_ARRALLOC,
+        [OPCODE_ARRACCESS] = &&TARGET_OPCODE_ARRACCESS,
+        [OPCODE_ARRASSIGN] = &&TARGET_OPCODE_ARRASSIGN,
+        [OPCODE_ARRLEN] = &&TARGET_OPCODE_ARRLEN,
+        [OPCODE_CAST] = &&TARGET_OPCODE_CAST,
+        [OPCODE_INSTANCEOF] = &&TARGET_OPCODE_INSTANCEOF,
+        [OPCODE_STATICVARGET] = &&TARGET_OPCODE_STATICVARGET,
+        [OPCODE_STATICVARSET] = &&TARGET_OPCODE_STATICVARSET,
+        [OPCODE_EQUALSI_JF] = &&TARGET_OPCODE_EQUALSI_JF,
+        [OPCODE_LTI_JF] = &&TARGET_OPCODE_LTI_JF,
+        [OPCODE_LTEQI_JF] = &&TARGET_OPCODE_LTEQI_JF,
+        [OPCODE_GTI_JF] = &&TARGET_OPCODE_GTI_JF,
+        [OPCODE_GTEQI_JF] = &&TARGET_OPCODE_GTEQI_JF,
+        [OPCODE_EQUALS_JF] = &&TARGET_OPCODE_EQUALS_JF,
+        [OPCODE_LT_JF] = &&TARGET_OPCODE_LT_JF,
+        [OPCODE_LTEQ_JF] = &&TARGET_OPCODE_LTEQ_JF,
+        [OPCODE_GT_JF] = &&TARGET_OPCODE_GT_JF,
+        [OPCODE_GTEQ_JF] = &&TARGET_OPCODE_GTEQ_JF,
+        [OPCODE_ADDI] = &&TARGET_OPCODE_ADDI,
+        [OPCODE_PARAMBLOCK] = &&TARGET_OPCODE_PARAMBLOCK,
+        [OPCODE_CALL_DIRECT] = &&TARGET_OPCODE_CALL_DIRECT,
+        [OPCODE_CALL_REPLACED] = &&TARGET_OPCODE_CALL_REPLACED,
+        [OPCODE_CLASSCALLSPECIAL_DIRECT] = &&TARGET_OPCODE_CLASSCALLSPECIAL_DIRECT,
+    };
+    if(prog == NULL) {
+        // We're only being asked for the dispatch table, see it_get_opcode_handler(..)
+        it_dispatch_table = dispatch_table;
+        return;
+    }
+    #endif
     it_replace_methods(prog);
     // Setup interpreter state
     struct it_STACKFRAME* stack = mm_malloc(sizeof(struct it_STACKFRAME) * STACKSIZE);
     struct it_STACKFRAME* stackptr = stack;
     struct it_STACKFRAME* stackend = stack + STACKSIZE;
     for(int i = 0; i < STACKSIZE; i++) {
-        stack[i].registers_allocated = 0;
-        // Set the register file pointer to the null pointer so we can free() it.
-        stack[i].registers = 0;
+        stack[i].registers = NULL;
         stack[i].index = i;
     }
     ts_reify_generic_references(&prog->methods[prog->entrypoint]);
-    load_method(stackptr, &prog->methods[prog->entrypoint]);
+    load_method(stackptr, &prog->methods[prog->entrypoint], false);
     union itval* registers = stackptr->registers;
     #if DEBUG
     printf("About to execute method %d\n", stackptr->method->id);
@@ -64,10 +329,23 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
     struct it_OPCODE* instruction_start = stackptr->iptr;
     // This is the current index into the instruction tape
     struct it_OPCODE* iptr = instruction_start;
-    // See the documentation for PARAM and CALL for details.
-    // Note that this is preserved globally across method calls.
-    union itval params[256];
-    memset(params, 0, sizeof(union itval) * 256);
+    // These are only used for --print-instruction-count.
+    uint64_t instructions_executed = 0;
+    uint64_t calls_executed = 0;
+    if(options->sample_profile_output != NULL) {
+        sp_begin(prog, options->sample_profile_output);
+    }
+    bool counting = options->print_instruction_count;
+    bool profiling = options->profile_output != NULL;
+    if(profiling) {
+        pf_begin(prog, options->profile_output, STACKSIZE);
+    }
+    #if INSTRUMENT_THROUGH_HANDLERS
+    if(counting || profiling) {
+        it_instrument_handler = counting ? &&COUNT_OPCODE : &&PROFILE_OPCODE;
+        it_reset_opcode_handlers(prog);
+    }
+    #endif
 
     #if CATEGORY_GUARDS
     for(int i = 0; i < stackptr->method->registerc; i++) {
@@ -81,8 +359,16 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
     }
     #endif
 
-    // TODO: Do something smarter for dispatch here
     while(1) {
+        if(counting) {
+            instructions_executed++;
+        }
+        if(profiling) {
+            pf_record_opcode(stackptr, iptr);
+        }
+        #if !INSTRUMENT_THROUGH_HANDLERS
+        REDISPATCH_LOOP:
+        #endif
         #if DEBUG
         for(int i = 0; i < stackptr->registerc; i++) {
             printf("%02x ", registers[i]);
@@ -107,95 +393,56 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
         }
         #endif
         switch(iptr->type) {
-        case OPCODE_PARAM:
-            params[iptr->data.param.target] = registers[iptr->data.param.source];
+        TARGET(OPCODE_PARAM)
+            registers[stackptr->registerc + 1 + iptr->data.param.target] = registers[iptr->data.param.source];
             iptr++;
-            continue;
-        case OPCODE_CALL:
-        case OPCODE_CLASSCALLSPECIAL: {
-            // TODO: Especially after the introduction of CLASSCALLSPECIAL,
-            // this desperately needs optimization.
-            struct it_METHOD* callee;
-            if(iptr->type == OPCODE_CALL) {
-                callee = iptr->data.call.callee;
-            } else {
-                callee = iptr->data.classcallspecial.method;
-            }
+            DISPATCH();
+        TARGET(OPCODE_CALL)
+        TARGET(OPCODE_CLASSCALLSPECIAL) {
+            // This is only reached the first time a call is executed (or the
+            // first time after its callee is reified or replaced). It does
+            // the checks that can't change again, and rewrites the opcode
+            // into one of the specialised calls, which does the actual call.
+            struct it_METHOD* callee = iptr->data.call.callee;
             if(!callee->has_had_references_reified) {
                 ts_reify_generic_references(callee);
             }
             if(iptr->type == OPCODE_CLASSCALLSPECIAL) {
-                if(registers[iptr->data.classcallspecial.callee_register].clazz_data == NULL) {
-                    it_traceback(stackptr);
-                    fatal("Attempt to do a non-virtual class call on null");
+                if(callee->replacement_ptr != NULL) {
+                    // Class methods are never replaced in practice, so
+                    // there's no specialised opcode for this
+                    if(registers[iptr->data.classcallspecial.callee_register].clazz_data == NULL) {
+                        it_traceback(stackptr);
+                        fatal("Attempt to do a non-virtual class call on null");
+                    }
+                    stackptr->iptr = iptr;
+                    uint32_t returnreg = iptr->data.classcallspecial.destination_register;
+                    registers[returnreg] = callee->replacement_ptr(prog, stackptr, it_get_params(stackptr));
+                    iptr++;
+                    DISPATCH();
                 }
-            }
-            if(callee->replacement_ptr != NULL) {
-                #if DEBUG
-                printf("Calling replaced method %s\n", callee->name);
-                #endif
-                stackptr->iptr = iptr;
-                uint32_t returnreg = iptr->data.call.returnval;
-                registers[returnreg] = callee->replacement_ptr(prog, stackptr, params);
-                iptr++;
-                continue;
-            }
-            struct it_STACKFRAME* oldstack = stackptr;
-            stackptr++;
-            if(stackptr >= stackend) {
-                stackptr--;
-                it_traceback(stackptr);
-                fatal("Stack overflow");
-            }
-
-            #if DEBUG
-            if(callee->containing_clazz != NULL) {
-                printf("Calling %s from %s\n", callee->name, callee->containing_clazz->name);
+                bc_set_opcode_type(iptr, OPCODE_CLASSCALLSPECIAL_DIRECT);
+            } else if(callee->replacement_ptr != NULL) {
+                bc_set_opcode_type(iptr, OPCODE_CALL_REPLACED);
             } else {
-                printf("Calling %s\n", callee->name);
+                bc_set_opcode_type(iptr, OPCODE_CALL_DIRECT);
             }
-            #endif
-
-            if(iptr->type == OPCODE_CLASSCALLSPECIAL) {
-                oldstack->returnreg = iptr->data.classcallspecial.destination_register;
-            } else {
-                oldstack->returnreg = iptr->data.call.returnval;
-            }
-
+            REDISPATCH();
+        }
+        TARGET(OPCODE_CALL_REPLACED) {
+            struct it_METHOD* callee = iptr->data.call.callee;
             #if DEBUG
-            printf("Need %d args.\n", callee->nargs);
-            for(uint32_t i = 0; i < callee->nargs; i++) {
-                printf("Argument: %02x\n", params[i]);
-            }
-            #endif
-
-            load_method(stackptr, callee);
-            registers = stackptr->registers;
-            instruction_start = stackptr->iptr;
-            oldstack->iptr = iptr;
-            iptr = instruction_start;
-            if(oldstack->iptr->type == OPCODE_CLASSCALLSPECIAL) {
-                uint32_t reg = iptr->data.classcallspecial.callee_register;
-                registers[0] = oldstack->registers[reg];
-            }
-            for(uint32_t i = 0; i < callee->nargs - (oldstack->iptr->type == OPCODE_CLASSCALLSPECIAL ? 1 : 0); i++) {
-                registers[i + (oldstack->iptr->type == OPCODE_CALL ? 0 : 1)] = params[i];
-            }
-
-            #if CATEGORY_GUARDS
-            for(int i = 0; i < stackptr->method->registerc; i++) {
-                if(registers[i].number == 0) {
-                    continue;
-                }
-                enum ts_CATEGORY stated_category = stackptr->method->register_types[i]->category;
-                if(stated_category == ts_CATEGORY_TYPE_PARAMETER) {
-                    fatal("Register of category type parameter");
-                }
-            }
+            printf("Calling replaced method %s\n", callee->name);
             #endif
-            continue;
+            stackptr->iptr = iptr;
+            uint32_t returnreg = iptr->data.call.returnval;
+            registers[returnreg] = callee->replacement_ptr(prog, stackptr, it_get_params(stackptr));
+            iptr++;
+            DISPATCH();
         }
-        case OPCODE_CLASSCALL: {
+        CALL_DIRECT(CALL_DIRECT, false)
+        CALL_DIRECT(CLASSCALLSPECIAL_DIRECT, true)
+        TARGET(OPCODE_CLASSCALL) {
             struct it_STACKFRAME* classcall_oldstack = stackptr;
             stackptr++;
             if(stackptr >= stackend) {
@@ -225,19 +472,17 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             printf("Need %d args, incl this.\n", classcall_callee->nargs);
             printf("This: %02x\n", thiz);
             for(uint8_t i = 0; i < classcall_callee->nargs - 1; i++) {
-                printf("Argument: %02x\n", params[i + 1]);
+                printf("Argument: %02x\n", it_get_params(classcall_oldstack)[i]);
             }
             #endif
 
-            load_method(stackptr, classcall_callee);
+            calls_executed++;
+            load_method(stackptr, classcall_callee, true);
             registers = stackptr->registers;
             instruction_start = stackptr->iptr;
             classcall_oldstack->iptr = iptr;
             iptr = instruction_start;
             registers[0] = thiz;
-            for(uint32_t i = 0; i < classcall_callee->nargs - 1; i++) {
-                registers[i + 1] = params[i];
-            }
             #if CATEGORY_GUARDS
             for(int i = 0; i < stackptr->method->registerc; i++) {
                 if(registers[i].number == 0) {
@@ -249,9 +494,9 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
                 }
             }
             #endif
-            continue;
+            DISPATCH();
         }
-        case OPCODE_INTERFACECALL: {
+        TARGET(OPCODE_INTERFACECALL) {
             struct it_STACKFRAME* oldstack = stackptr;
             stackptr++;
             if(stackptr >= stackend) {
@@ -267,41 +512,57 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
                 it_traceback(stackptr);
                 fatal("Attempt to call method of null interface reference");
             }
-            struct it_INTERFACE_IMPLEMENTATION* implementations = thiz.clazz_data->method_table->interface_implementations;
-            struct it_INTERFACE_IMPLEMENTATION* implementation = NULL;
-            for(int i = 0; i < thiz.clazz_data->method_table->ninterface_implementations; i++) {
-                if(implementations[i].interface_id == data->interface_id) {
-                    implementation = &implementations[i];
+            // Most call sites only ever see a class or two, so look in the
+            // call site's cache before searching the receiver's interfaces
+            struct it_METHOD_TABLE* receiver_table = thiz.clazz_data->method_table;
+            struct it_INTERFACECALL_CACHE* cache = data->cache;
+            struct it_METHOD_TABLE* implementation_table = NULL;
+            for(uint32_t i = 0; i < cache->size; i++) {
+                if(cache->receiver_tables[i] == receiver_table) {
+                    implementation_table = cache->implementation_tables[i];
                     break;
                 }
             }
-            if(implementation == NULL) {
-                fatal("Could not find interface implementation in interfacecall.");
+            if(implementation_table == NULL) {
+                implementation_table = cl_find_interface_implementation(receiver_table, data->interface_id);
+                if(implementation_table == NULL) {
+                    fatal("Could not find interface implementation in interfacecall.");
+                }
+                // Once the cache is full, the call site is megamorphic, and
+                // every other class is just searched for
+                if(cache->size < INTERFACECALL_CACHE_SIZE) {
+                    cache->receiver_tables[cache->size] = receiver_table;
+                    cache->implementation_tables[cache->size] = implementation_table;
+                    cache->size++;
+                }
             }
-            struct it_METHOD* callee = implementation->method_table->methods[data->method_index];
-            load_method(stackptr, callee);
+            struct it_METHOD* callee = implementation_table->methods[data->method_index];
+            calls_executed++;
+            load_method(stackptr, callee, true);
             registers = stackptr->registers;
             instruction_start = stackptr->iptr;
             oldstack->iptr = iptr;
             iptr = instruction_start;
             registers[0] = thiz;
-            for(uint32_t i = 0; i < callee->nargs - 1; i++) {
-                registers[i + 1] = params[i];
-            }
-            continue;
+            DISPATCH();
         }
-        case OPCODE_RETURN: {
+        TARGET(OPCODE_RETURN) {
             union itval result = registers[iptr->data.return_.target];
             if(stackptr <= stack) {
                 if(options->print_return_value) {
                     printf("Returned 0x%08lx\n", result.number);
                 }
+                if(counting) {
+                    printf("Executed %lu instructions\n", instructions_executed);
+                    printf("Executed %lu calls\n", calls_executed);
+                }
                 goto CLEANUP;
             }
             #if DEBUG
             printf("Returning\n");
             #endif
             stackptr--;
+            it_set_current_frame(stackptr);
             registers = stackptr->registers;
             instruction_start = stackptr->method->opcodes;
             iptr = stackptr->iptr;
@@ -310,82 +571,82 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             #if DEBUG
             printf("Returned to %s\n", stackptr->method->name);
             #endif
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ZERO: {
+        TARGET(OPCODE_ZERO) {
             registers[iptr->data.zero.target].number = 0;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ADD: {
+        TARGET(OPCODE_ADD) {
             registers[iptr->data.add.target].number = registers[iptr->data.add.source1].number + registers[iptr->data.add.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_TWOCOMP: {
+        TARGET(OPCODE_TWOCOMP) {
             registers[iptr->data.twocomp.target].number = -registers[iptr->data.twocomp.target].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_MULT: {
+        TARGET(OPCODE_MULT) {
             registers[iptr->data.mult.target].number = registers[iptr->data.mult.source1].number * registers[iptr->data.mult.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_MODULO: {
+        TARGET(OPCODE_MODULO) {
             registers[iptr->data.modulo.target].number = registers[iptr->data.modulo.source1].number % registers[iptr->data.modulo.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_DIV: {
+        TARGET(OPCODE_DIV) {
             registers[iptr->data.div.target].number = registers[iptr->data.div.source1].number / registers[iptr->data.div.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_EQUALS: {
+        TARGET(OPCODE_EQUALS) {
             if(registers[iptr->data.equals.source1].number == registers[iptr->data.equals.source2].number) {
                 registers[iptr->data.equals.target].number = 1;
             } else {
                 registers[iptr->data.equals.target].number = 0;
             }
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_INVERT: {
+        TARGET(OPCODE_INVERT) {
             if(registers[iptr->data.invert.target].number == 0) {
                 registers[iptr->data.invert.target].number = 1;
             } else {
                 registers[iptr->data.invert.target].number = 0;
             }
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_LTEQ: {
+        TARGET(OPCODE_LTEQ) {
             if(registers[iptr->data.lteq.source1].number <= registers[iptr->data.lteq.source2].number) {
                 registers[iptr->data.lteq.target].number = 1;
             } else {
                 registers[iptr->data.lteq.target].number = 0;
             }
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_GT: {
+        TARGET(OPCODE_GT) {
             if(registers[iptr->data.gt.source1].number > registers[iptr->data.gt.source2].number) {
                 registers[iptr->data.gt.target].number = 1;
             } else {
                 registers[iptr->data.gt.target].number = 0;
             }
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_GOTO: {
+        TARGET(OPCODE_GOTO) {
             #if DEBUG
             printf("Jumping to %d\n", iptr->data.goto_.target);
             #endif
             iptr = instruction_start + iptr->data.goto_.target;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_JF: {
+        TARGET(OPCODE_JF) {
             // JF stands for Jump if False.
             if(registers[iptr->data.jf.predicate].number == 0) {
                 #if DEBUG
@@ -395,33 +656,33 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             } else {
                 iptr++;
             }
-            continue;
+            DISPATCH();
         }
-        case OPCODE_GTEQ: {
+        TARGET(OPCODE_GTEQ) {
             if(registers[iptr->data.gteq.source1].number >= registers[iptr->data.gteq.source2].number) {
                 registers[iptr->data.gteq.target].number = 1;
             } else {
                 registers[iptr->data.gteq.target].number = 0;
             }
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_XOR: {
+        TARGET(OPCODE_XOR) {
             registers[iptr->data.xor.target].number = registers[iptr->data.xor.source1].number ^ registers[iptr->data.xor.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_AND: {
+        TARGET(OPCODE_AND) {
             registers[iptr->data.and.target].number = registers[iptr->data.and.source1].number & registers[iptr->data.and.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_OR: {
+        TARGET(OPCODE_OR) {
             registers[iptr->data.or.target].number = registers[iptr->data.or.source1].number | registers[iptr->data.or.source2].number;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_MOV: {
+        TARGET(OPCODE_MOV) {
             registers[iptr->data.mov.target] = registers[iptr->data.mov.source];
             #if CATEGORY_GUARDS
             enum ts_CATEGORY category = stackptr->method->register_types[iptr->data.mov.target]->category;
@@ -435,45 +696,40 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             }
             #endif
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_NOP: {
+        TARGET(OPCODE_NOP) {
             // Do nothing
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_LOAD: {
+        TARGET(OPCODE_LOAD) {
             registers[iptr->data.load.target].number = iptr->data.load.data;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_LT: {
+        TARGET(OPCODE_LT) {
             if(registers[iptr->data.lt.source1].number < registers[iptr->data.lt.source2].number) {
                 registers[iptr->data.lt.target].number = 0x1;
             } else {
                 registers[iptr->data.lt.target].number = 0x0;
             }
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_NEW: {
-            if(gc_needs_collection && !options->no_gc) {
-                gc_collect(prog, stack, stackptr, options);
-            }
+        TARGET(OPCODE_NEW) {
             struct it_OPCODE_DATA_NEW* opcode_new_data = &iptr->data.new;
-            size_t new_allocation_size = sizeof(struct it_CLAZZ_DATA) + sizeof(union itval) * opcode_new_data->clazz->data.clazz.nfields;
-            registers[opcode_new_data->dest].clazz_data = mm_malloc(new_allocation_size);
+            size_t new_allocation_size = gc_clazz_allocation_size(opcode_new_data->clazz);
+            // gc_allocate(..) zeroes the fields and sets up the registry entry
+            registers[opcode_new_data->dest] = gc_allocate(prog, stack, stackptr, options, new_allocation_size, ts_CATEGORY_CLAZZ);
             #if CATEGORY_GUARDS
             registers[opcode_new_data->dest].clazz_data->category = ts_CATEGORY_CLAZZ;
             #endif
-            struct gc_OBJECT_REGISTRY* new_register = gc_register_object(registers[opcode_new_data->dest], new_allocation_size, ts_CATEGORY_CLAZZ);
-            registers[opcode_new_data->dest].clazz_data->gc_registry_entry = new_register;
-            memset(registers[opcode_new_data->dest].clazz_data->itval, 0, sizeof(union itval) * opcode_new_data->clazz->data.clazz.nfields);
             registers[opcode_new_data->dest].clazz_data->method_table = opcode_new_data->clazz->data.clazz.method_table;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ACCESS: {
+        TARGET(OPCODE_ACCESS) {
             struct it_OPCODE_DATA_ACCESS* data = &iptr->data.access;
             if(registers[data->clazzreg].clazz_data == NULL) {
                 it_traceback(stackptr);
@@ -482,39 +738,35 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             struct it_CLAZZ_DATA* clazz_data = registers[data->clazzreg].clazz_data;
             registers[data->destination] = clazz_data->itval[data->property_index];
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ASSIGN: {
+        TARGET(OPCODE_ASSIGN) {
             struct it_OPCODE_DATA_ASSIGN* data = &iptr->data.assign;
             if(registers[data->clazzreg].clazz_data == NULL) {
                 it_traceback(stackptr);
                 fatal("Null pointer on access");
             }
+            GC_WRITE_BARRIER(registers[data->clazzreg].clazz_data, registers[data->source], stackptr->method->register_types[data->source]->category);
             registers[data->clazzreg].clazz_data->itval[data->property_index] = registers[data->source];
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ARRALLOC: {
-            if(gc_needs_collection && !options->no_gc) {
-                gc_collect(prog, stack, stackptr, options);
-            }
+        TARGET(OPCODE_ARRALLOC) {
             struct it_OPCODE_DATA_ARRALLOC* data = &iptr->data.arralloc;
             uint64_t length = registers[data->lengthreg].number;
-            size_t arralloc_allocation_size = sizeof(struct it_ARRAY_DATA) + sizeof(union itval) * (length <= 0 ? 1 : length - 1);
-            struct it_ARRAY_DATA* array_data = mm_malloc(arralloc_allocation_size);
+            size_t arralloc_allocation_size = gc_array_allocation_size(length);
+            // gc_allocate(..) zeroes the elements and sets up the registry entry
+            struct it_ARRAY_DATA* array_data = gc_allocate(prog, stack, stackptr, options, arralloc_allocation_size, ts_CATEGORY_ARRAY).array_data;
             #if CATEGORY_GUARDS
             array_data->category = ts_CATEGORY_ARRAY;
             #endif
+            array_data->length = length;
+            array_data->type = stackptr->method->register_types[data->arrreg];
             registers[data->arrreg].array_data = array_data;
-            registers[data->arrreg].array_data->length = length;
-            memset(&registers[data->arrreg].array_data->elements, 0, length * sizeof(union itval));
-            registers[data->arrreg].array_data->type = stackptr->method->register_types[data->arrreg];
-            struct gc_OBJECT_REGISTRY* arralloc_registry = gc_register_object(registers[data->arrreg], arralloc_allocation_size, ts_CATEGORY_ARRAY);
-            registers[data->arrreg].array_data->gc_registry_entry = arralloc_registry;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ARRACCESS: {
+        TARGET(OPCODE_ARRACCESS) {
             struct it_OPCODE_DATA_ARRACCESS* data = &iptr->data.arraccess;
             if(registers[data->arrreg].array_data == NULL) {
                 it_traceback(stackptr);
@@ -526,9 +778,9 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             }
             registers[data->elementreg] = registers[data->arrreg].array_data->elements[registers[data->indexreg].number];
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ARRASSIGN: {
+        TARGET(OPCODE_ARRASSIGN) {
             struct it_OPCODE_DATA_ARRASSIGN* opcode_arrassign_data = &iptr->data.arrassign;
             if(registers[opcode_arrassign_data->arrreg].array_data == NULL) {
                 it_traceback(stackptr);
@@ -538,11 +790,12 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
                 it_traceback(stackptr);
                 fatal("Array index out of bounds");
             }
+            GC_WRITE_BARRIER(registers[opcode_arrassign_data->arrreg].array_data, registers[opcode_arrassign_data->elementreg], stackptr->method->register_types[opcode_arrassign_data->elementreg]->category);
             registers[opcode_arrassign_data->arrreg].array_data->elements[registers[opcode_arrassign_data->indexreg].number] = registers[opcode_arrassign_data->elementreg];
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_ARRLEN: {
+        TARGET(OPCODE_ARRLEN) {
             struct it_OPCODE_DATA_ARRLEN* opcode_arrlen_data = &iptr->data.arrlen;
             if(registers[opcode_arrlen_data->arrreg].array_data == NULL) {
                 it_traceback(stackptr);
@@ -550,9 +803,9 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             }
             registers[opcode_arrlen_data->resultreg].number = registers[opcode_arrlen_data->arrreg].array_data->length;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_CAST: {
+        TARGET(OPCODE_CAST) {
             struct it_OPCODE_DATA_CAST* data = &iptr->data.cast;
             union itval source = registers[data->source];
             struct ts_TYPE* target_type = stackptr->method->register_types[data->target];
@@ -574,9 +827,9 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             }
             registers[data->target] = source;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_INSTANCEOF: {
+        TARGET(OPCODE_INSTANCEOF) {
             struct it_OPCODE_DATA_INSTANCEOF* data = &iptr->data.instanceof;
             struct ts_TYPE* source_register_type = stackptr->method->register_types[data->source];
             struct ts_TYPE* predicate_type = stackptr->method->typereferences[data->predicate_type_index];
@@ -596,27 +849,74 @@ void it_execute(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
             }
             registers[data->destination] = (union itval) ((int64_t) result);
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_STATICVARGET: {
+        TARGET(OPCODE_STATICVARGET) {
             struct it_OPCODE_DATA_STATICVARGET* data = &iptr->data.staticvarget;
             registers[data->destination] = prog->static_vars[data->source_var].value;
             iptr++;
-            continue;
+            DISPATCH();
         }
-        case OPCODE_STATICVARSET: {
+        TARGET(OPCODE_STATICVARSET) {
             struct it_OPCODE_DATA_STATICVARSET* data = &iptr->data.staticvarset;
+            GC_STATIC_VAR_WRITE_BARRIER(prog, data->destination_var, registers[data->source]);
             prog->static_vars[data->destination_var].value = registers[data->source];
             iptr++;
-            continue;
+            DISPATCH();
+        }
+        COMPARE_IMMEDIATE_AND_JUMP(EQUALSI_JF, ==)
+        COMPARE_IMMEDIATE_AND_JUMP(LTI_JF, <)
+        COMPARE_IMMEDIATE_AND_JUMP(LTEQI_JF, <=)
+        COMPARE_IMMEDIATE_AND_JUMP(GTI_JF, >)
+        COMPARE_IMMEDIATE_AND_JUMP(GTEQI_JF, >=)
+        COMPARE_AND_JUMP(EQUALS_JF, ==)
+        COMPARE_AND_JUMP(LT_JF, <)
+        COMPARE_AND_JUMP(LTEQ_JF, <=)
+        COMPARE_AND_JUMP(GT_JF, >)
+        COMPARE_AND_JUMP(GTEQ_JF, >=)
+        TARGET(OPCODE_ADDI) {
+            struct it_OPCODE_DATA_ADDI* data = &iptr->data.addi;
+            // We still have to do the LOAD, since the register might be read later
+            registers[data->immediate_register].number = data->immediate;
+            registers[data->target].number = registers[data->source].number + data->immediate;
+            iptr += 2;
+            DISPATCH();
+        }
+        TARGET(OPCODE_PARAMBLOCK) {
+            struct it_OPCODE_DATA_PARAMBLOCK* data = &iptr->data.paramblock;
+            union itval* params = registers + stackptr->registerc + 1;
+            params[data->target] = registers[data->source];
+            for(uint32_t i = 1; i < data->count; i++) {
+                params[iptr[i].data.param.target] = registers[iptr[i].data.param.source];
+            }
+            iptr += data->count;
+            DISPATCH();
         }
+        #if INSTRUMENT_THROUGH_HANDLERS
+        COUNT_OPCODE:
+            instructions_executed++;
+            if(profiling) {
+                pf_record_opcode(stackptr, iptr);
+            }
+            goto *dispatch_table[iptr->type];
+        PROFILE_OPCODE:
+            pf_record_opcode(stackptr, iptr);
+            goto *dispatch_table[iptr->type];
+        #endif
         default:
+        #if THREADED_DISPATCH
+        TARGET_UNKNOWN:
+        #endif
             it_traceback(stackptr);
             fatal("Unexpected opcode");
         }
     }
 CLEANUP:
+    it_set_current_frame(NULL);
     free(stack);
+    free(it_register_stack);
+    it_register_stack = NULL;
+    it_register_stack_size = 0;
     // Explicitly not freeing stackptr and stackend since they're dangling pointers at this point
     return;
 }
@@ -626,11 +926,37 @@ void it_run(struct it_PROGRAM* prog, struct it_OPTIONS* options) {
     #endif
     it_execute(prog, options);
 }
+void it_unspecialise_calls_in(struct it_METHOD* method, struct it_METHOD* callee) {
+    for(int i = 0; i < method->opcodec; i++) {
+        struct it_OPCODE* opcode = &method->opcodes[i];
+        if(opcode->data.call.callee != callee) {
+            continue;
+        }
+        if(opcode->type == OPCODE_CALL_DIRECT || opcode->type == OPCODE_CALL_REPLACED) {
+            bc_set_opcode_type(opcode, OPCODE_CALL);
+        } else if(opcode->type == OPCODE_CLASSCALLSPECIAL_DIRECT) {
+            bc_set_opcode_type(opcode, OPCODE_CLASSCALLSPECIAL);
+        }
+    }
+}
+void it_unspecialise_calls(struct it_PROGRAM* program, struct it_METHOD* callee) {
+    // This turns every specialised call to callee back into a plain CALL or
+    // CLASSCALLSPECIAL, which will specialise itself again (taking any new
+    // replacement_ptr into account) the next time it's executed.
+    for(int i = 0; i < program->methodc; i++) {
+        struct it_METHOD* method = &program->methods[i];
+        it_unspecialise_calls_in(method, callee);
+        for(int j = 0; j < method->reificationsc; j++) {
+            it_unspecialise_calls_in(method->reifications[j], callee);
+        }
+    }
+}
 void it_replace_method_from_lib(struct it_PROGRAM* program, struct nl_NATIVE_LIB* lib, char* symbol_name, char* method_name) {
     it_METHOD_REPLACEMENT_PTR method = nl_get_symbol(lib, symbol_name);
     for(int i = 0; i < program->methodc; i++) {
         if(strcmp(program->methods[i].name, method_name) == 0) {
             program->methods[i].replacement_ptr = method;
+            it_unspecialise_calls(program, &program->methods[i]);
             return;
         }
     }
@@ -15,6 +15,11 @@ int main(int argc, char* argv[]) {
     options.print_return_value = false;
     options.gc_verbose = false;
     options.no_gc = false;
+    options.print_instruction_count = false;
+    options.no_fusion = false;
+    options.gc_pause_target = 0;
+    options.profile_output = NULL;
+    options.sample_profile_output = NULL;
     FILE* fp[argc - 1];
     int num_infiles = 0;
     for(int i = 1; i < argc; i++) {
@@ -25,6 +30,34 @@ int main(int argc, char* argv[]) {
                 options.gc_verbose = true;
             } else if(strcmp(argv[i], "--no-gc") == 0) {
                 options.no_gc = true;
+            } else if(strcmp(argv[i], "--print-instruction-count") == 0) {
+                options.print_instruction_count = true;
+            } else if(strcmp(argv[i], "--no-fusion") == 0) {
+                options.no_fusion = true;
+            } else if(strcmp(argv[i], "--gc-pause-target") == 0) {
+                // This takes a number of milliseconds as the next argument
+                char* end = NULL;
+                if(i + 1 < argc) {
+                    options.gc_pause_target = strtod(argv[i + 1], &end);
+                }
+                if(end == NULL || end == argv[i + 1] || *end != '\0' || options.gc_pause_target < 0) {
+                    fatal("--gc-pause-target requires a non-negative number of milliseconds");
+                }
+                i++;
+            } else if(strcmp(argv[i], "--profile") == 0) {
+                // This takes the path to write the profile to, without an extension
+                if(i + 1 >= argc) {
+                    fatal("--profile requires an output path");
+                }
+                options.profile_output = argv[i + 1];
+                i++;
+            } else if(strcmp(argv[i], "--sample-profile") == 0) {
+                // This takes the path to write the samples to, without an extension
+                if(i + 1 >= argc) {
+                    fatal("--sample-profile requires an output path");
+                }
+                options.sample_profile_output = argv[i + 1];
+                i++;
             } else {
                 printf("Argument: %s\n", argv[i]);
                 fatal("Invalid command line argument");
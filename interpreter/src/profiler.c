@@ -0,0 +1,418 @@
+#include <stdlib.h>
+#include <stdio.h>
+#include <stdint.h>
+#include <string.h>
+#include <time.h>
+#include "common.h"
+#include "interpreter.h"
+#include "opcodes.h"
+#include "typesys.h"
+
+// This is the opcode profiler used by --profile. it_execute(..) calls
+// pf_record_opcode(..) before every opcode it executes, which counts the
+// opcode by type, by method and by line, and notices calls and returns by
+// watching the depth of the stack change, so that the time between them can
+// be attributed to methods. Everything is written out when the interpreter
+// exits (however it exits), as a report and as a file of collapsed stacks
+// weighted by opcodes executed, which flamegraph.pl and similar tools accept.
+//
+// Reifications of a method are counted as the method itself.
+
+struct pf_METHOD_PROFILE {
+    struct it_METHOD* method;
+    uint64_t calls;
+    uint64_t opcodes;
+    uint64_t inclusive_ns;
+    uint64_t exclusive_ns;
+    // This is the number of frames for this method on the stack, so that
+    // recursive calls aren't counted twice in inclusive_ns
+    uint32_t active;
+    uint32_t first_line;
+    uint32_t linec;
+    // This is indexed by line number minus first_line, and is NULL until the
+    // method is first called
+    uint64_t* line_opcodes;
+};
+// This is a node of the calling context tree, which has a node for every
+// distinct stack of methods seen
+struct pf_STACK_NODE {
+    uint32_t method_index;
+    uint32_t parent;
+    uint32_t first_child;
+    uint32_t next_sibling;
+    uint64_t opcodes;
+};
+struct pf_FRAME {
+    struct pf_METHOD_PROFILE* method;
+    uint32_t node;
+    bool outermost;
+    uint64_t entered_ns;
+    uint64_t children_ns;
+};
+struct pf_PROFILE {
+    struct it_PROGRAM* program;
+    char* output_prefix;
+    uint64_t started_ns;
+    uint64_t opcode_counts[256];
+    struct pf_METHOD_PROFILE* methods;
+    struct pf_STACK_NODE* nodes;
+    uint32_t nodec;
+    uint32_t nodes_size;
+    struct pf_FRAME* frames;
+    // This is the index of the innermost frame we've seen, or -1
+    int depth;
+};
+#define PF_NO_NODE UINT32_MAX
+// This is the root of the calling context tree, which doesn't correspond to
+// a method
+#define PF_ROOT_NODE 0
+// The report only lists this many of the busiest lines
+#define PF_MAX_REPORTED_LINES 50
+
+static struct pf_PROFILE* pf_profile = NULL;
+
+uint64_t pf_now_ns() {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return ((uint64_t) now.tv_sec) * 1000000000ull + (uint64_t) now.tv_nsec;
+}
+char* pf_opcode_name(uint8_t type) {
+    switch(type) {
+    case OPCODE_LOAD: return "LOAD";
+    case OPCODE_CALL: return "CALL";
+    case OPCODE_RETURN: return "RETURN";
+    case OPCODE_PARAM: return "PARAM";
+    case OPCODE_ADD: return "ADD";
+    case OPCODE_TWOCOMP: return "TWOCOMP";
+    case OPCODE_MULT: return "MULT";
+    case OPCODE_MODULO: return "MODULO";
+    case OPCODE_EQUALS: return "EQUALS";
+    case OPCODE_INVERT: return "INVERT";
+    case OPCODE_LTEQ: return "LTEQ";
+    case OPCODE_GT: return "GT";
+    case OPCODE_GOTO: return "GOTO";
+    case OPCODE_JF: return "JF";
+    case OPCODE_GTEQ: return "GTEQ";
+    case OPCODE_XOR: return "XOR";
+    case OPCODE_AND: return "AND";
+    case OPCODE_OR: return "OR";
+    case OPCODE_MOV: return "MOV";
+    case OPCODE_NOP: return "NOP";
+    case OPCODE_LT: return "LT";
+    case OPCODE_DIV: return "DIV";
+    case OPCODE_ZERO: return "ZERO";
+    case OPCODE_NEW: return "NEW";
+    case OPCODE_ACCESS: return "ACCESS";
+    case OPCODE_ASSIGN: return "ASSIGN";
+    case OPCODE_CLASSCALL: return "CLASSCALL";
+    case OPCODE_ARRALLOC: return "ARRALLOC";
+    case OPCODE_ARRACCESS: return "ARRACCESS";
+    case OPCODE_ARRASSIGN: return "ARRASSIGN";
+    case OPCODE_ARRLEN: return "ARRLEN";
+    case OPCODE_CAST: return "CAST";
+    case OPCODE_INSTANCEOF: return "INSTANCEOF";
+    case OPCODE_STATICVARGET: return "STATICVARGET";
+    case OPCODE_STATICVARSET: return "STATICVARSET";
+    case OPCODE_CLASSCALLSPECIAL: return "CLASSCALLSPECIAL";
+    case OPCODE_INTERFACECALL: return "INTERFACECALL";
+    case OPCODE_EQUALSI_JF: return "EQUALSI_JF";
+    case OPCODE_LTI_JF: return "LTI_JF";
+    case OPCODE_LTEQI_JF: return "LTEQI_JF";
+    case OPCODE_GTI_JF: return "GTI_JF";
+    case OPCODE_GTEQI_JF: return "GTEQI_JF";
+    case OPCODE_EQUALS_JF: return "EQUALS_JF";
+    case OPCODE_LT_JF: return "LT_JF";
+    case OPCODE_LTEQ_JF: return "LTEQ_JF";
+    case OPCODE_GT_JF: return "GT_JF";
+    case OPCODE_GTEQ_JF: return "GTEQ_JF";
+    case OPCODE_ADDI: return "ADDI";
+    case OPCODE_PARAMBLOCK: return "PARAMBLOCK";
+    case OPCODE_CALL_DIRECT: return "CALL_DIRECT";
+    case OPCODE_CALL_REPLACED: return "CALL_REPLACED";
+    case OPCODE_CLASSCALLSPECIAL_DIRECT: return "CLASSCALLSPECIAL_DIRECT";
+    default: return "UNKNOWN";
+    }
+}
+void pf_print_method_name(FILE* fp, struct it_METHOD* method) {
+    if(method->containing_clazz != NULL) {
+        fprintf(fp, "%s.%s", method->containing_clazz->name, method->name);
+    } else {
+        fprintf(fp, "%s", method->name);
+    }
+}
+uint32_t pf_find_or_add_child(uint32_t parent, uint32_t method_index) {
+    struct pf_PROFILE* profile = pf_profile;
+    for(uint32_t child = profile->nodes[parent].first_child; child != PF_NO_NODE; child = profile->nodes[child].next_sibling) {
+        if(profile->nodes[child].method_index == method_index) {
+            return child;
+        }
+    }
+    if(profile->nodec == profile->nodes_size) {
+        profile->nodes_size *= 2;
+        profile->nodes = realloc(profile->nodes, sizeof(struct pf_STACK_NODE) * profile->nodes_size);
+        if(profile->nodes == NULL) {
+            fatal("Memory allocation failed");
+        }
+    }
+    uint32_t index = profile->nodec++;
+    struct pf_STACK_NODE* node = &profile->nodes[index];
+    node->method_index = method_index;
+    node->parent = parent;
+    node->first_child = PF_NO_NODE;
+    node->next_sibling = profile->nodes[parent].first_child;
+    node->opcodes = 0;
+    profile->nodes[parent].first_child = index;
+    return index;
+}
+void pf_allocate_line_counts(struct pf_METHOD_PROFILE* method_profile) {
+    struct it_METHOD* method = method_profile->method;
+    uint32_t first_line = UINT32_MAX;
+    uint32_t last_line = 0;
+    for(int i = 0; i < method->opcodec; i++) {
+        uint32_t line = method->opcodes[i].linenum;
+        first_line = line < first_line ? line : first_line;
+        last_line = line > last_line ? line : last_line;
+    }
+    if(method->opcodec == 0) {
+        first_line = last_line = 0;
+    }
+    method_profile->first_line = first_line;
+    method_profile->linec = last_line - first_line + 1;
+    method_profile->line_opcodes = mm_malloc(sizeof(uint64_t) * method_profile->linec);
+}
+void pf_enter_frame(struct it_STACKFRAME* frame, uint64_t now) {
+    struct pf_PROFILE* profile = pf_profile;
+    struct it_METHOD* method = ts_get_unreified_method_from_reification(frame->method);
+    uint32_t method_index = method - profile->program->methods;
+    struct pf_METHOD_PROFILE* method_profile = &profile->methods[method_index];
+    if(method_profile->line_opcodes == NULL) {
+        pf_allocate_line_counts(method_profile);
+    }
+    method_profile->calls++;
+    struct pf_FRAME* profile_frame = &profile->frames[frame->index];
+    profile_frame->method = method_profile;
+    profile_frame->node = pf_find_or_add_child(frame->index == 0 ? PF_ROOT_NODE : profile->frames[frame->index - 1].node, method_index);
+    profile_frame->outermost = method_profile->active++ == 0;
+    profile_frame->entered_ns = now;
+    profile_frame->children_ns = 0;
+}
+void pf_exit_frame(int index, uint64_t now) {
+    struct pf_FRAME* profile_frame = &pf_profile->frames[index];
+    uint64_t elapsed = now - profile_frame->entered_ns;
+    profile_frame->method->exclusive_ns += elapsed - profile_frame->children_ns;
+    if(profile_frame->outermost) {
+        profile_frame->method->inclusive_ns += elapsed;
+    }
+    profile_frame->method->active--;
+    if(index > 0) {
+        pf_profile->frames[index - 1].children_ns += elapsed;
+    }
+}
+void pf_record_opcode(struct it_STACKFRAME* frame, struct it_OPCODE* opcode) {
+    struct pf_PROFILE* profile = pf_profile;
+    if(frame->index != profile->depth) {
+        // Calls and returns only ever move one frame at a time, but this
+        // doesn't rely on it
+        uint64_t now = pf_now_ns();
+        while(profile->depth > frame->index) {
+            pf_exit_frame(profile->depth--, now);
+        }
+        while(profile->depth < frame->index) {
+            profile->depth++;
+            pf_enter_frame(frame - (frame->index - profile->depth), now);
+        }
+    }
+    struct pf_FRAME* profile_frame = &profile->frames[profile->depth];
+    struct pf_METHOD_PROFILE* method_profile = profile_frame->method;
+    profile->opcode_counts[opcode->type]++;
+    method_profile->opcodes++;
+    uint32_t line = opcode->linenum - method_profile->first_line;
+    if(line < method_profile->linec) {
+        method_profile->line_opcodes[line]++;
+    }
+    profile->nodes[profile_frame->node].opcodes++;
+}
+int pf_compare_methods(const void* a, const void* b) {
+    const struct pf_METHOD_PROFILE* method_a = *(struct pf_METHOD_PROFILE* const*) a;
+    const struct pf_METHOD_PROFILE* method_b = *(struct pf_METHOD_PROFILE* const*) b;
+    if(method_a->exclusive_ns != method_b->exclusive_ns) {
+        return method_a->exclusive_ns < method_b->exclusive_ns ? 1 : -1;
+    }
+    if(method_a->opcodes != method_b->opcodes) {
+        return method_a->opcodes < method_b->opcodes ? 1 : -1;
+    }
+    return 0;
+}
+struct pf_LINE {
+    struct pf_METHOD_PROFILE* method;
+    uint32_t line;
+    uint64_t opcodes;
+};
+int pf_compare_lines(const void* a, const void* b) {
+    const struct pf_LINE* line_a = a;
+    const struct pf_LINE* line_b = b;
+    if(line_a->opcodes != line_b->opcodes) {
+        return line_a->opcodes < line_b->opcodes ? 1 : -1;
+    }
+    return 0;
+}
+int pf_compare_opcode_types(const void* a, const void* b) {
+    uint64_t count_a = pf_profile->opcode_counts[*(const int*) a];
+    uint64_t count_b = pf_profile->opcode_counts[*(const int*) b];
+    if(count_a != count_b) {
+        return count_a < count_b ? 1 : -1;
+    }
+    return *(const int*) a - *(const int*) b;
+}
+FILE* pf_open_output(char* suffix) {
+    char* path = mm_malloc(strlen(pf_profile->output_prefix) + strlen(suffix) + 1);
+    strcpy(path, pf_profile->output_prefix);
+    strcat(path, suffix);
+    FILE* fp = fopen(path, "w");
+    if(fp == NULL) {
+        printf("Profile: %s\n", path);
+        fatal_with_errcode("Failed to open profile for writing", EXIT_FAILURE);
+    }
+    free(path);
+    return fp;
+}
+void pf_write_report(uint64_t elapsed_ns) {
+    struct pf_PROFILE* profile = pf_profile;
+    struct it_PROGRAM* program = profile->program;
+    FILE* fp = pf_open_output(".txt");
+
+    uint64_t total_opcodes = 0;
+    uint64_t total_calls = 0;
+    int types[256];
+    for(int i = 0; i < 256; i++) {
+        types[i] = i;
+        total_opcodes += profile->opcode_counts[i];
+    }
+    for(int i = 0; i < program->methodc; i++) {
+        total_calls += profile->methods[i].calls;
+    }
+    double percent_scale = total_opcodes == 0 ? 0 : 100.0 / total_opcodes;
+    fprintf(fp, "Executed %lu opcodes in %lu calls in %.3fms\n", total_opcodes, total_calls, elapsed_ns / 1e6);
+
+    fprintf(fp, "\nOpcodes by type\n");
+    fprintf(fp, "%14s %8s  %s\n", "opcodes", "percent", "opcode");
+    qsort(types, 256, sizeof(int), pf_compare_opcode_types);
+    for(int i = 0; i < 256 && profile->opcode_counts[types[i]] > 0; i++) {
+        uint64_t count = profile->opcode_counts[types[i]];
+        fprintf(fp, "%14lu %7.2f%%  %s\n", count, count * percent_scale, pf_opcode_name(types[i]));
+    }
+
+    fprintf(fp, "\nMethods by exclusive time\n");
+    fprintf(fp, "%12s %14s %8s %14s %14s  %s\n", "calls", "opcodes", "percent", "inclusive ms", "exclusive ms", "method");
+    struct pf_METHOD_PROFILE** methods = mm_malloc(sizeof(struct pf_METHOD_PROFILE*) * (program->methodc + 1));
+    int methodc = 0;
+    size_t linec = 0;
+    for(int i = 0; i < program->methodc; i++) {
+        if(profile->methods[i].calls > 0) {
+            methods[methodc++] = &profile->methods[i];
+            linec += profile->methods[i].linec;
+        }
+    }
+    qsort(methods, methodc, sizeof(struct pf_METHOD_PROFILE*), pf_compare_methods);
+    for(int i = 0; i < methodc; i++) {
+        struct pf_METHOD_PROFILE* method = methods[i];
+        fprintf(fp, "%12lu %14lu %7.2f%% %14.3f %14.3f  ", method->calls, method->opcodes, method->opcodes * percent_scale, method->inclusive_ns / 1e6, method->exclusive_ns / 1e6);
+        pf_print_method_name(fp, method->method);
+        fprintf(fp, "\n");
+    }
+
+    fprintf(fp, "\nLines by opcodes\n");
+    fprintf(fp, "%14s %8s  %s\n", "opcodes", "percent", "line");
+    struct pf_LINE* lines = mm_malloc(sizeof(struct pf_LINE) * (linec + 1));
+    size_t used_linec = 0;
+    for(int i = 0; i < methodc; i++) {
+        for(uint32_t j = 0; j < methods[i]->linec; j++) {
+            if(methods[i]->line_opcodes[j] == 0) {
+                continue;
+            }
+            lines[used_linec].method = methods[i];
+            lines[used_linec].line = methods[i]->first_line + j;
+            lines[used_linec].opcodes = methods[i]->line_opcodes[j];
+            used_linec++;
+        }
+    }
+    qsort(lines, used_linec, sizeof(struct pf_LINE), pf_compare_lines);
+    for(size_t i = 0; i < used_linec && i < PF_MAX_REPORTED_LINES; i++) {
+        fprintf(fp, "%14lu %7.2f%%  ", lines[i].opcodes, lines[i].opcodes * percent_scale);
+        pf_print_method_name(fp, lines[i].method->method);
+        fprintf(fp, ", line %u\n", lines[i].line);
+    }
+
+    free(lines);
+    free(methods);
+    fclose(fp);
+}
+void pf_write_collapsed_stacks() {
+    // Each line is the methods on the stack, outermost first and separated by
+    // semicolons, followed by the number of opcodes executed with exactly
+    // that stack
+    struct pf_PROFILE* profile = pf_profile;
+    FILE* fp = pf_open_output(".folded");
+    uint32_t* path = mm_malloc(sizeof(uint32_t) * (profile->nodec + 1));
+    for(uint32_t i = 0; i < profile->nodec; i++) {
+        if(profile->nodes[i].opcodes == 0) {
+            continue;
+        }
+        uint32_t pathc = 0;
+        for(uint32_t node = i; node != PF_ROOT_NODE; node = profile->nodes[node].parent) {
+            path[pathc++] = node;
+        }
+        for(uint32_t j = pathc; j > 0; j--) {
+            pf_print_method_name(fp, profile->methods[profile->nodes[path[j - 1]].method_index].method);
+            if(j > 1) {
+                fprintf(fp, ";");
+            }
+        }
+        fprintf(fp, " %lu\n", profile->nodes[i].opcodes);
+    }
+    free(path);
+    fclose(fp);
+}
+void pf_finish() {
+    if(pf_profile == NULL) {
+        return;
+    }
+    uint64_t now = pf_now_ns();
+    while(pf_profile->depth >= 0) {
+        pf_exit_frame(pf_profile->depth--, now);
+    }
+    pf_write_report(now - pf_profile->started_ns);
+    pf_write_collapsed_stacks();
+    for(int i = 0; i < pf_profile->program->methodc; i++) {
+        free(pf_profile->methods[i].line_opcodes);
+    }
+    free(pf_profile->methods);
+    free(pf_profile->nodes);
+    free(pf_profile->frames);
+    free(pf_profile);
+    pf_profile = NULL;
+}
+void pf_begin(struct it_PROGRAM* program, char* output_prefix, int max_depth) {
+    // The profile is written by an atexit(..) handler, since programs can
+    // exit from inside a native method
+    pf_profile = mm_malloc(sizeof(struct pf_PROFILE));
+    pf_profile->program = program;
+    pf_profile->output_prefix = output_prefix;
+    memset(pf_profile->opcode_counts, 0, sizeof(pf_profile->opcode_counts));
+    pf_profile->methods = mm_malloc(sizeof(struct pf_METHOD_PROFILE) * (program->methodc + 1));
+    memset(pf_profile->methods, 0, sizeof(struct pf_METHOD_PROFILE) * (program->methodc + 1));
+    for(int i = 0; i < program->methodc; i++) {
+        pf_profile->methods[i].method = &program->methods[i];
+    }
+    pf_profile->nodes_size = 64;
+    pf_profile->nodes = mm_malloc(sizeof(struct pf_STACK_NODE) * pf_profile->nodes_size);
+    pf_profile->nodes[PF_ROOT_NODE].method_index = UINT32_MAX;
+    pf_profile->nodes[PF_ROOT_NODE].parent = PF_NO_NODE;
+    pf_profile->nodes[PF_ROOT_NODE].first_child = PF_NO_NODE;
+    pf_profile->nodes[PF_ROOT_NODE].next_sibling = PF_NO_NODE;
+    pf_profile->nodec = 1;
+    pf_profile->frames = mm_malloc(sizeof(struct pf_FRAME) * max_depth);
+    pf_profile->depth = -1;
+    pf_profile->started_ns = pf_now_ns();
+    atexit(pf_finish);
+}
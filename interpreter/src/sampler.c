@@ -0,0 +1,243 @@
+#include <stdlib.h>
+#include <stdio.h>
+#include <stdint.h>
+#include <string.h>
+#include <stdatomic.h>
+#include <signal.h>
+#include <pthread.h>
+#include <time.h>
+#include <sys/time.h>
+#include "common.h"
+#include "interpreter.h"
+
+// This is the sampling profiler used by --sample-profile. Unlike --profile,
+// it doesn't look at every opcode: a SIGPROF timer interrupts the interpreter
+// every SP_INTERVAL_US microseconds of CPU time, and the signal handler
+// copies the methods on the stack (starting from it_current_frame, which the
+// interpreter updates on every call and return) into a ring buffer. A
+// background thread empties the ring buffer every so often, counting how many
+// times each distinct stack was seen, and the counts are written out as
+// collapsed stacks (like the .folded file written by --profile) when the
+// interpreter exits.
+//
+// The signal handler can't allocate or take locks, so the ring buffer is
+// a fixed size, and has a single producer (the signal handler) and a single
+// consumer (the background thread). Samples taken while it's full are
+// dropped, and counted as such.
+
+#define SP_INTERVAL_US 1000
+// Samples of deeper stacks keep the innermost SP_MAX_DEPTH frames, under a
+// [truncated] frame
+#define SP_MAX_DEPTH 64
+#define SP_RING_SIZE 1024
+#define SP_DRAIN_INTERVAL_NS 10000000
+
+struct sp_SAMPLE {
+    uint32_t depth;
+    bool truncated;
+    struct it_METHOD* methods[SP_MAX_DEPTH];
+};
+struct sp_STACK {
+    uint32_t hash;
+    uint32_t depth;
+    bool truncated;
+    // These are indices into program->methods, outermost first. This is NULL
+    // iff the entry is empty.
+    uint32_t* method_indices;
+    uint64_t count;
+};
+struct sp_SAMPLER {
+    struct it_PROGRAM* program;
+    char* output_prefix;
+    struct sp_SAMPLE ring[SP_RING_SIZE];
+    // head is only written by the signal handler, and tail only by whoever
+    // is draining the ring buffer
+    atomic_uint head;
+    atomic_uint tail;
+    atomic_ulong dropped;
+    atomic_bool stopping;
+    pthread_t drain_thread;
+    struct sp_STACK* stacks;
+    uint32_t stacks_capacity;
+    uint32_t stacks_size;
+};
+
+static struct sp_SAMPLER* sp_sampler = NULL;
+
+void sp_handle_signal(int signum) {
+    struct sp_SAMPLER* sampler = sp_sampler;
+    struct it_STACKFRAME* frame = it_current_frame;
+    if(sampler == NULL || frame == NULL) {
+        return;
+    }
+    unsigned int head = atomic_load_explicit(&sampler->head, memory_order_relaxed);
+    unsigned int tail = atomic_load_explicit(&sampler->tail, memory_order_acquire);
+    if(head - tail >= SP_RING_SIZE) {
+        atomic_fetch_add_explicit(&sampler->dropped, 1, memory_order_relaxed);
+        return;
+    }
+    struct sp_SAMPLE* sample = &sampler->ring[head % SP_RING_SIZE];
+    uint32_t depth = frame->index + 1;
+    sample->truncated = depth > SP_MAX_DEPTH;
+    sample->depth = sample->truncated ? SP_MAX_DEPTH : depth;
+    struct it_STACKFRAME* outermost = frame - (sample->depth - 1);
+    for(uint32_t i = 0; i < sample->depth; i++) {
+        sample->methods[i] = outermost[i].method;
+    }
+    atomic_store_explicit(&sampler->head, head + 1, memory_order_release);
+}
+uint32_t sp_hash_stack(uint32_t* method_indices, uint32_t depth, bool truncated) {
+    return fnv1a_hash(method_indices, sizeof(uint32_t) * depth) ^ truncated;
+}
+struct sp_STACK* sp_find_slot(uint32_t hash, uint32_t* method_indices, uint32_t depth, bool truncated) {
+    struct sp_SAMPLER* sampler = sp_sampler;
+    uint32_t mask = sampler->stacks_capacity - 1;
+    for(uint32_t slot = hash & mask; ; slot = (slot + 1) & mask) {
+        struct sp_STACK* stack = &sampler->stacks[slot];
+        if(stack->method_indices == NULL) {
+            return stack;
+        }
+        if(stack->hash == hash && stack->depth == depth && stack->truncated == truncated
+                && memcmp(stack->method_indices, method_indices, sizeof(uint32_t) * depth) == 0) {
+            return stack;
+        }
+    }
+}
+void sp_grow_stacks() {
+    struct sp_SAMPLER* sampler = sp_sampler;
+    struct sp_STACK* old_stacks = sampler->stacks;
+    uint32_t old_capacity = sampler->stacks_capacity;
+    sampler->stacks_capacity = old_capacity == 0 ? 256 : old_capacity * 2;
+    sampler->stacks = mm_malloc(sizeof(struct sp_STACK) * sampler->stacks_capacity);
+    for(uint32_t i = 0; i < old_capacity; i++) {
+        struct sp_STACK* stack = &old_stacks[i];
+        if(stack->method_indices != NULL) {
+            *sp_find_slot(stack->hash, stack->method_indices, stack->depth, stack->truncated) = *stack;
+        }
+    }
+    free(old_stacks);
+}
+void sp_count_sample(struct sp_SAMPLE* sample) {
+    struct sp_SAMPLER* sampler = sp_sampler;
+    uint32_t method_indices[SP_MAX_DEPTH];
+    for(uint32_t i = 0; i < sample->depth; i++) {
+        method_indices[i] = ts_get_unreified_method_from_reification(sample->methods[i]) - sampler->program->methods;
+    }
+    if((sampler->stacks_size + 1) * 2 > sampler->stacks_capacity) {
+        sp_grow_stacks();
+    }
+    uint32_t hash = sp_hash_stack(method_indices, sample->depth, sample->truncated);
+    struct sp_STACK* stack = sp_find_slot(hash, method_indices, sample->depth, sample->truncated);
+    if(stack->method_indices == NULL) {
+        stack->hash = hash;
+        stack->depth = sample->depth;
+        stack->truncated = sample->truncated;
+        stack->method_indices = mm_malloc(sizeof(uint32_t) * sample->depth);
+        memcpy(stack->method_indices, method_indices, sizeof(uint32_t) * sample->depth);
+        sampler->stacks_size++;
+    }
+    stack->count++;
+}
+void sp_drain() {
+    struct sp_SAMPLER* sampler = sp_sampler;
+    unsigned int head = atomic_load_explicit(&sampler->head, memory_order_acquire);
+    unsigned int tail = atomic_load_explicit(&sampler->tail, memory_order_relaxed);
+    for(; tail != head; tail++) {
+        sp_count_sample(&sampler->ring[tail % SP_RING_SIZE]);
+    }
+    atomic_store_explicit(&sampler->tail, tail, memory_order_release);
+}
+void* sp_drain_periodically(void* unused) {
+    struct timespec interval = {0, SP_DRAIN_INTERVAL_NS};
+    while(!atomic_load(&sp_sampler->stopping)) {
+        nanosleep(&interval, NULL);
+        sp_drain();
+    }
+    return NULL;
+}
+void sp_write_collapsed_stacks() {
+    struct sp_SAMPLER* sampler = sp_sampler;
+    char* path = mm_malloc(strlen(sampler->output_prefix) + strlen(".folded") + 1);
+    strcpy(path, sampler->output_prefix);
+    strcat(path, ".folded");
+    FILE* fp = fopen(path, "w");
+    if(fp == NULL) {
+        printf("Profile: %s\n", path);
+        fatal("Failed to open profile for writing");
+    }
+    free(path);
+    for(uint32_t i = 0; i < sampler->stacks_capacity; i++) {
+        struct sp_STACK* stack = &sampler->stacks[i];
+        if(stack->method_indices == NULL) {
+            continue;
+        }
+        if(stack->truncated) {
+            fprintf(fp, "[truncated];");
+        }
+        for(uint32_t j = 0; j < stack->depth; j++) {
+            if(j > 0) {
+                fprintf(fp, ";");
+            }
+            pf_print_method_name(fp, &sampler->program->methods[stack->method_indices[j]]);
+        }
+        fprintf(fp, " %lu\n", stack->count);
+    }
+    unsigned long dropped = atomic_load(&sampler->dropped);
+    if(dropped > 0) {
+        fprintf(fp, "[dropped] %lu\n", dropped);
+    }
+    fclose(fp);
+}
+void sp_finish() {
+    if(sp_sampler == NULL) {
+        return;
+    }
+    struct itimerval stop = {{0, 0}, {0, 0}};
+    setitimer(ITIMER_PROF, &stop, NULL);
+    signal(SIGPROF, SIG_IGN);
+    atomic_store(&sp_sampler->stopping, true);
+    pthread_join(sp_sampler->drain_thread, NULL);
+    sp_drain();
+    sp_write_collapsed_stacks();
+    for(uint32_t i = 0; i < sp_sampler->stacks_capacity; i++) {
+        free(sp_sampler->stacks[i].method_indices);
+    }
+    free(sp_sampler->stacks);
+    free(sp_sampler);
+    sp_sampler = NULL;
+}
+void sp_begin(struct it_PROGRAM* program, char* output_prefix) {
+    // Like the opcode profiler, the samples are written out by an atexit(..)
+    // handler, since programs can exit from inside a native method
+    sp_sampler = mm_malloc(sizeof(struct sp_SAMPLER));
+    sp_sampler->program = program;
+    sp_sampler->output_prefix = output_prefix;
+    atomic_init(&sp_sampler->head, 0);
+    atomic_init(&sp_sampler->tail, 0);
+    atomic_init(&sp_sampler->dropped, 0);
+    atomic_init(&sp_sampler->stopping, false);
+    sp_grow_stacks();
+
+    // SIGPROF should only ever interrupt the interpreter, so it's blocked
+    // while creating the background thread, which inherits the mask
+    sigset_t sigprof;
+    sigset_t old_mask;
+    sigemptyset(&sigprof);
+    sigaddset(&sigprof, SIGPROF);
+    pthread_sigmask(SIG_BLOCK, &sigprof, &old_mask);
+    if(pthread_create(&sp_sampler->drain_thread, NULL, sp_drain_periodically, NULL) != 0) {
+        fatal("Failed to start the sampling profiler");
+    }
+    pthread_sigmask(SIG_SETMASK, &old_mask, NULL);
+    atexit(sp_finish);
+
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_handler = sp_handle_signal;
+    // Don't make the program's own system calls fail with EINTR
+    action.sa_flags = SA_RESTART;
+    sigemptyset(&action.sa_mask);
+    sigaction(SIGPROF, &action, NULL);
+    struct itimerval interval = {{0, SP_INTERVAL_US}, {0, SP_INTERVAL_US}};
+    setitimer(ITIMER_PROF, &interval, NULL);
+}
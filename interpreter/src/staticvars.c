@@ -8,42 +8,35 @@ void sv_add_static_var(struct it_PROGRAM* program, struct ts_TYPE* type, char* n
     program->static_vars[program->static_var_index].type = type;
     program->static_vars[program->static_var_index].name = name;
     program->static_vars[program->static_var_index].value = value;
+    // If there's more than one variable with this name, the first one wins
+    if(sy_lookup(&program->static_vars, name) < 0) {
+        sy_define(&program->static_vars, name, program->static_var_index);
+    }
     program->static_var_index++;
 }
+int sv_find_var(struct it_PROGRAM* program, char* name, char* uninitialized_message) {
+    // This returns the index of the variable, or -1 if there isn't one
+    if(program->static_var_index < program->static_varsc) {
+        fatal(uninitialized_message);
+    }
+    return sy_lookup(&program->static_vars, name);
+}
 struct sv_STATIC_VAR* sv_get_var_by_name(struct it_PROGRAM* program, char* name) {
-    for(int i = 0; i < program->static_varsc; i++) {
-        if(program->static_vars[i].name == NULL) {
-            fatal("Attempt to get variable by name when not all variables are initialized");
-        }
-        if(strcmp(name, program->static_vars[i].name) == 0) {
-            return &program->static_vars[i];
-        }
+    int index = sv_find_var(program, name, "Attempt to get variable by name when not all variables are initialized");
+    if(index < 0) {
+        printf("Static variable name: %s\n", name);
+        fatal("Attempt to resolve static variable that doesn't exist");
     }
-    printf("Static variable name: %s\n", name);
-    fatal("Attempt to resolve static variable that doesn't exist");
-    return NULL; // Unreachable
+    return &program->static_vars[index];
 }
 bool sv_has_var(struct it_PROGRAM* program, char* name) {
-    for(int i = 0; i < program->static_varsc; i++) {
-        if(program->static_vars[i].name == NULL) {
-            fatal("Attempt to check for existence of static variable by name when not all variables are initialized");
-        }
-        if(strcmp(name, program->static_vars[i].name) == 0) {
-            return true;
-        }
-    }
-    return false;
+    return sv_find_var(program, name, "Attempt to check for existence of static variable by name when not all variables are initialized") >= 0;
 }
 uint32_t sv_get_static_var_index_by_name(struct it_PROGRAM* program, char* name) {
-    for(uint32_t i = 0; i < program->static_varsc; i++) {
-        if(program->static_vars[i].name == NULL) {
-            fatal("Attempt to get variable index by name when not all variables are initialized");
-        }
-        if(strcmp(name, program->static_vars[i].name) == 0) {
-            return i;
-        }
+    int index = sv_find_var(program, name, "Attempt to get variable index by name when not all variables are initialized");
+    if(index < 0) {
+        printf("Static variable name: %s\n", name);
+        fatal("Attempt to resolve static variable that doesn't exist");
     }
-    printf("Static variable name: %s\n", name);
-    fatal("Attempt to resolve static variable that doesn't exist");
-    return -1; // Unreachable
-}
\ No newline at end of file
+    return index;
+}
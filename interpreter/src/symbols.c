@@ -0,0 +1,165 @@
+#include <string.h>
+#include <stdlib.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include "interpreter.h"
+#include "common.h"
+
+// This is the load-time symbol table, which maps names to indices within a
+// scope (a program's global methods or static variables, a class's fields, or
+// a method table) so that resolving a name doesn't scan every member of the
+// scope. Names are interned, so the table itself only hashes and compares
+// pointers.
+//
+// Scopes are filled in one of two ways. A program's global methods and static
+// variables are defined one at a time with sy_define as they're loaded (by
+// bc_scan_methods and sv_add_static_var), so those scopes are always up to
+// date. A class's fields and method table are instead built in one go on
+// their first lookup (see cl_define_field_symbols): sy_begin_scope adds a
+// header entry (with a NULL name) recording how many members the scope had
+// when it was built, and sy_scope_is_current tells whether it has grown since,
+// as it does when the class inherits from its superclass, so that it's built
+// again.
+
+struct sy_INTERNED_STRINGS {
+    char** strings;
+    uint32_t capacity;
+    uint32_t size;
+};
+struct sy_SYMBOL {
+    // This is NULL iff the entry is empty
+    void* scope;
+    // This is NULL for scope headers
+    char* name;
+    uint32_t index;
+};
+struct sy_SYMBOL_TABLE {
+    struct sy_SYMBOL* symbols;
+    uint32_t capacity;
+    uint32_t size;
+};
+static struct sy_INTERNED_STRINGS sy_interned = {NULL, 0, 0};
+static struct sy_SYMBOL_TABLE sy_table = {NULL, 0, 0};
+
+uint32_t sy_hash_symbol(void* scope, char* name) {
+    uint64_t hash = ((uint64_t) (uintptr_t) scope) * 0x9e3779b97f4a7c15ull;
+    hash ^= ((uint64_t) (uintptr_t) name) * 0xc2b2ae3d27d4eb4full;
+    return (uint32_t) (hash ^ (hash >> 32));
+}
+void sy_insert_interned(char* str) {
+    uint32_t mask = sy_interned.capacity - 1;
+    uint32_t slot = fnv1a_hash_string(str) & mask;
+    while(sy_interned.strings[slot] != NULL) {
+        slot = (slot + 1) & mask;
+    }
+    sy_interned.strings[slot] = str;
+}
+char* sy_find_interned(char* str) {
+    // This returns the interned copy of str, or NULL if it hasn't been interned
+    if(sy_interned.capacity == 0) {
+        return NULL;
+    }
+    uint32_t mask = sy_interned.capacity - 1;
+    for(uint32_t slot = fnv1a_hash_string(str) & mask; sy_interned.strings[slot] != NULL; slot = (slot + 1) & mask) {
+        if(strcmp(sy_interned.strings[slot], str) == 0) {
+            return sy_interned.strings[slot];
+        }
+    }
+    return NULL;
+}
+char* sy_intern(char* str) {
+    // This returns a copy of str that is shared with every other string with
+    // the same contents. str itself isn't retained.
+    char* existing = sy_find_interned(str);
+    if(existing != NULL) {
+        return existing;
+    }
+    if(sy_interned.capacity == 0) {
+        sy_interned.capacity = 1024;
+        sy_interned.strings = mm_malloc(sizeof(char*) * sy_interned.capacity);
+    }
+    if((sy_interned.size + 1) * 2 > sy_interned.capacity) {
+        char** old_strings = sy_interned.strings;
+        uint32_t old_capacity = sy_interned.capacity;
+        sy_interned.capacity *= 2;
+        sy_interned.strings = mm_malloc(sizeof(char*) * sy_interned.capacity);
+        for(uint32_t i = 0; i < old_capacity; i++) {
+            if(old_strings[i] != NULL) {
+                sy_insert_interned(old_strings[i]);
+            }
+        }
+        free(old_strings);
+    }
+    char* result = strdup(str);
+    if(result == NULL) {
+        fatal("Memory allocation failed");
+    }
+    sy_insert_interned(result);
+    sy_interned.size++;
+    return result;
+}
+struct sy_SYMBOL* sy_find_slot(void* scope, char* name) {
+    // This returns the entry for (scope, name), or the empty entry where it
+    // would go. name must be interned (or NULL).
+    uint32_t mask = sy_table.capacity - 1;
+    uint32_t slot = sy_hash_symbol(scope, name) & mask;
+    while(sy_table.symbols[slot].scope != NULL) {
+        if(sy_table.symbols[slot].scope == scope && sy_table.symbols[slot].name == name) {
+            break;
+        }
+        slot = (slot + 1) & mask;
+    }
+    return &sy_table.symbols[slot];
+}
+void sy_grow_table() {
+    struct sy_SYMBOL* old_symbols = sy_table.symbols;
+    uint32_t old_capacity = sy_table.capacity;
+    sy_table.capacity = old_capacity == 0 ? 1024 : old_capacity * 2;
+    sy_table.symbols = mm_malloc(sizeof(struct sy_SYMBOL) * sy_table.capacity);
+    for(uint32_t i = 0; i < old_capacity; i++) {
+        if(old_symbols[i].scope != NULL) {
+            *sy_find_slot(old_symbols[i].scope, old_symbols[i].name) = old_symbols[i];
+        }
+    }
+    free(old_symbols);
+}
+void sy_set(void* scope, char* name, uint32_t index) {
+    if((sy_table.size + 1) * 2 > sy_table.capacity) {
+        sy_grow_table();
+    }
+    struct sy_SYMBOL* symbol = sy_find_slot(scope, name);
+    if(symbol->scope == NULL) {
+        symbol->scope = scope;
+        symbol->name = name;
+        sy_table.size++;
+    }
+    symbol->index = index;
+}
+bool sy_scope_is_current(void* scope, uint32_t size) {
+    // This is true iff scope was last built when it had size members
+    if(sy_table.capacity == 0) {
+        return false;
+    }
+    struct sy_SYMBOL* header = sy_find_slot(scope, NULL);
+    return header->scope != NULL && header->index == size;
+}
+void sy_begin_scope(void* scope, uint32_t size) {
+    sy_set(scope, NULL, size);
+}
+void sy_define(void* scope, char* name, uint32_t index) {
+    // This replaces any existing definition of name in scope. To match a
+    // linear search, scopes with duplicate names are defined from the back.
+    sy_set(scope, sy_intern(name), index);
+}
+int sy_lookup(void* scope, char* name) {
+    // This returns the index of name in scope, or -1 if it isn't defined
+    char* interned = sy_find_interned(name);
+    if(interned == NULL || sy_table.capacity == 0) {
+        return -1;
+    }
+    struct sy_SYMBOL* symbol = sy_find_slot(scope, interned);
+    if(symbol->scope == NULL) {
+        return -1;
+    }
+    return symbol->index;
+}
@@ -4,51 +4,93 @@
 #include "common.h"
 #include "opcodes.h"
 #include "typesys.h"
+#include "bytecode.h"
 
-struct ts_TYPE_REGISTRY {
+// Types are registered by name in a chained hash table. Several types can
+// share a name (arrays of type parameters from different contexts, for
+// instance), so lookups check every entry in the chain, and chains are kept
+// in registration order so that the first matching type wins.
+struct ts_TYPE_REGISTRY_ENTRY {
     char* name;
     struct ts_TYPE* type;
-    struct ts_TYPE_REGISTRY* next;
+    struct ts_TYPE_REGISTRY_ENTRY* next;
+};
+struct ts_TYPE_REGISTRY {
+    struct ts_TYPE_REGISTRY_ENTRY** buckets;
+    // This is the last entry of each bucket, so appending is constant time
+    struct ts_TYPE_REGISTRY_ENTRY** bucket_ends;
+    uint32_t bucketc;
+    uint32_t size;
+    // These are indexed by type id. Ids are allocated densely, so these are
+    // only ever a little bigger than the number of types.
+    struct ts_TYPE** types_by_id;
+    uint32_t types_by_idc;
+    struct ts_TYPE** array_types_by_element_id;
+    uint32_t array_types_by_element_idc;
 };
 static struct ts_TYPE_REGISTRY* global_registry = NULL;
 static uint32_t type_id = 3;
+void ts_append_to_bucket(struct ts_TYPE_REGISTRY_ENTRY* entry) {
+    uint32_t bucket = fnv1a_hash_string(entry->name) & (global_registry->bucketc - 1);
+    entry->next = NULL;
+    if(global_registry->buckets[bucket] == NULL) {
+        global_registry->buckets[bucket] = entry;
+    } else {
+        global_registry->bucket_ends[bucket]->next = entry;
+    }
+    global_registry->bucket_ends[bucket] = entry;
+}
+void ts_grow_buckets() {
+    struct ts_TYPE_REGISTRY_ENTRY** old_buckets = global_registry->buckets;
+    uint32_t old_bucketc = global_registry->bucketc;
+    global_registry->bucketc = old_bucketc == 0 ? 256 : old_bucketc * 2;
+    global_registry->buckets = mm_malloc(sizeof(struct ts_TYPE_REGISTRY_ENTRY*) * global_registry->bucketc);
+    free(global_registry->bucket_ends);
+    global_registry->bucket_ends = mm_malloc(sizeof(struct ts_TYPE_REGISTRY_ENTRY*) * global_registry->bucketc);
+    // Entries with the same name are always in the same bucket, so moving
+    // the buckets over in order keeps them in registration order.
+    for(uint32_t i = 0; i < old_bucketc; i++) {
+        struct ts_TYPE_REGISTRY_ENTRY* entry = old_buckets[i];
+        while(entry != NULL) {
+            struct ts_TYPE_REGISTRY_ENTRY* next = entry->next;
+            ts_append_to_bucket(entry);
+            entry = next;
+        }
+    }
+    free(old_buckets);
+}
+void ts_set_by_id(struct ts_TYPE*** array, uint32_t* arrayc, uint32_t id, struct ts_TYPE* type) {
+    if(id >= *arrayc) {
+        uint32_t new_arrayc = *arrayc == 0 ? 64 : *arrayc;
+        while(new_arrayc <= id) {
+            new_arrayc *= 2;
+        }
+        *array = realloc(*array, sizeof(struct ts_TYPE*) * new_arrayc);
+        if(*array == NULL) {
+            fatal("Memory allocation failed");
+        }
+        memset(*array + *arrayc, 0, sizeof(struct ts_TYPE*) * (new_arrayc - *arrayc));
+        *arrayc = new_arrayc;
+    }
+    (*array)[id] = type;
+}
+struct ts_TYPE* ts_create_primitive_type(uint32_t id, char* name) {
+    struct ts_TYPE* type = mm_malloc(sizeof(struct ts_TYPE));
+    type->id = id;
+    type->name = strdup(name);
+    type->heirarchy_len = 1;
+    type->heirarchy = mm_malloc(sizeof(struct ts_TYPE*));
+    type->heirarchy[0] = type;
+    type->category = ts_CATEGORY_PRIMITIVE;
+    ts_register_type(type, type->name);
+    return type;
+}
 void ts_init_global_registry() {
-    // Create and initialize an int type
     global_registry = mm_malloc(sizeof(struct ts_TYPE_REGISTRY));
-    global_registry->name = strdup("int");
-    global_registry->type = mm_malloc(sizeof(struct ts_TYPE));
-    struct ts_TYPE* int_type = global_registry->type;
-    int_type->id = 0;
-    int_type->name = strdup("int");
-    int_type->heirarchy_len = 1;
-    int_type->heirarchy = mm_malloc(sizeof(struct ts_TYPE*));
-    int_type->heirarchy[0] = int_type;
-    int_type->category = ts_CATEGORY_PRIMITIVE;
-
-    // Create and initialize a bool type
-    global_registry->next = mm_malloc(sizeof(struct ts_TYPE_REGISTRY));
-    global_registry->next->next = NULL;
-    global_registry->next->name = strdup("bool");
-    global_registry->next->type = mm_malloc(sizeof(struct ts_TYPE));
-    struct ts_TYPE* bool_type = global_registry->next->type;
-    bool_type->id = 1;
-    bool_type->name = strdup("bool");
-    bool_type->heirarchy_len = 1;
-    bool_type->heirarchy = mm_malloc(sizeof(struct ts_TYPE*));
-    bool_type->heirarchy[0] = bool_type;
-    bool_type->category = ts_CATEGORY_PRIMITIVE;
-
-    global_registry->next->next = mm_malloc(sizeof(struct ts_TYPE_REGISTRY));
-    global_registry->next->next->next = NULL;
-    global_registry->next->next->name = strdup("void");
-    global_registry->next->next->type = mm_malloc(sizeof(struct ts_TYPE));
-    struct ts_TYPE* void_type = global_registry->next->next->type;
-    void_type->id = 2;
-    bool_type->name = strdup("bool");
-    void_type->heirarchy_len = 1;
-    void_type->heirarchy = mm_malloc(sizeof(struct ts_TYPE*));
-    void_type->heirarchy[0] = void_type;
-    void_type->category = ts_CATEGORY_PRIMITIVE;
+    ts_grow_buckets();
+    ts_create_primitive_type(0, "int");
+    ts_create_primitive_type(1, "bool");
+    ts_create_primitive_type(2, "void");
 }
 uint32_t ts_allocate_type_id() {
     return type_id++;
@@ -62,14 +104,15 @@ void ts_register_type(struct ts_TYPE* type, char* name) {
     if(global_registry == NULL) {
         ts_init_global_registry();
     }
-    struct ts_TYPE_REGISTRY* end = global_registry;
-    while(end->next != NULL) {
-        end = end->next;
+    if(global_registry->size >= global_registry->bucketc) {
+        ts_grow_buckets();
     }
-    end->next = mm_malloc(sizeof(struct ts_TYPE_REGISTRY));
-    end->next->name = name;
-    end->next->type = type;
-    end->next->next = NULL;
+    struct ts_TYPE_REGISTRY_ENTRY* entry = mm_malloc(sizeof(struct ts_TYPE_REGISTRY_ENTRY));
+    entry->name = name;
+    entry->type = type;
+    ts_append_to_bucket(entry);
+    global_registry->size++;
+    ts_set_by_id(&global_registry->types_by_id, &global_registry->types_by_idc, type->id, type);
 }
 bool ts_is_subcontext(struct ts_GENERIC_TYPE_CONTEXT* child, struct ts_GENERIC_TYPE_CONTEXT* parent) {
     if(child == parent) {
@@ -89,14 +132,10 @@ bool ts_is_from_context(struct ts_TYPE* type, struct ts_GENERIC_TYPE_CONTEXT* co
     return true;
 }
 struct ts_TYPE* ts_get_type_by_id_optional(int id) {
-    struct ts_TYPE_REGISTRY* registry = global_registry;
-    while(registry != NULL) {
-        if(registry->type->id == id) {
-            return registry->type;
-        }
-        registry = registry->next;
+    if(global_registry == NULL || id < 0 || id >= global_registry->types_by_idc) {
+        return NULL;
     }
-    return NULL;
+    return global_registry->types_by_id[id];
 }
 struct ts_TYPE* ts_get_type_inner(char* name, struct ts_GENERIC_TYPE_CONTEXT* context) {
     #if DEBUG
@@ -105,14 +144,13 @@ struct ts_TYPE* ts_get_type_inner(char* name, struct ts_GENERIC_TYPE_CONTEXT* co
     if(global_registry == NULL) {
         ts_init_global_registry();
     }
-    struct ts_TYPE_REGISTRY* registry = global_registry;
-    while(registry != NULL) {
-        if(strcmp(registry->name, name) == 0) {
-            if(ts_is_from_context(registry->type, context)) {
-                return registry->type;
+    uint32_t bucket = fnv1a_hash_string(name) & (global_registry->bucketc - 1);
+    for(struct ts_TYPE_REGISTRY_ENTRY* entry = global_registry->buckets[bucket]; entry != NULL; entry = entry->next) {
+        if(strcmp(entry->name, name) == 0) {
+            if(ts_is_from_context(entry->type, context)) {
+                return entry->type;
             }
         }
-        registry = registry->next;
     }
     return NULL;
 }
@@ -126,28 +164,20 @@ struct ts_TYPE* ts_create_array_type(struct ts_TYPE* parent_type) {
     size_t parent_name_length = strlen(parent_type->name);
     result->name = mm_malloc(sizeof(char) * (parent_name_length + 3));
     sprintf(result->name, "[%s]", parent_type->name);
-    ts_register_type(result, result->name);
     result->heirarchy_len = 1;
     result->heirarchy = mm_malloc(sizeof(struct ts_TYPE*) * 1);
     result->heirarchy[0] = result;
     result->data.array.parent_type = parent_type;
     ts_register_type(result, result->name);
+    ts_set_by_id(&global_registry->array_types_by_element_id, &global_registry->array_types_by_element_idc, parent_type->id, result);
     return result;
 }
 struct ts_TYPE* ts_get_or_create_array_type(struct ts_TYPE* parent_type) {
     if(global_registry == NULL) {
         ts_init_global_registry();
     }
-    struct ts_TYPE_REGISTRY* registry = global_registry;
-    while(registry != NULL) {
-        if(registry->type->category != ts_CATEGORY_ARRAY) {
-            registry = registry->next;
-            continue;
-        }
-        if(registry->type->data.array.parent_type->id == parent_type->id) {
-            return registry->type;
-        }
-        registry = registry->next;
+    if(parent_type->id < global_registry->array_types_by_element_idc && global_registry->array_types_by_element_id[parent_type->id] != NULL) {
+        return global_registry->array_types_by_element_id[parent_type->id];
     }
     return ts_create_array_type(parent_type);
 }
@@ -579,6 +609,14 @@ void ts_reify_generic_references(struct it_METHOD* method) {
     }
     for(int i = 0; i < method->opcodec; i++) {
         struct it_OPCODE* opcode = &method->opcodes[i];
+        // The opcodes may have been copied from a method whose calls have
+        // already been specialised, and the specialised call would skip
+        // reifying the new callee
+        if(opcode->type == OPCODE_CALL_DIRECT || opcode->type == OPCODE_CALL_REPLACED) {
+            bc_set_opcode_type(opcode, OPCODE_CALL);
+        } else if(opcode->type == OPCODE_CLASSCALLSPECIAL_DIRECT) {
+            bc_set_opcode_type(opcode, OPCODE_CLASSCALLSPECIAL);
+        }
         if(opcode->type == OPCODE_CALL) {
             if(!ts_method_is_generic(opcode->data.call.callee)) {
                 if(method->typeargs != NULL) {
@@ -1,5 +1,6 @@
 import os
 import os.path
+import shutil
 import sys
 
 # Pytest maintains the same interpreter instance throughout all test suites as
@@ -20,6 +21,45 @@ class TestInterpreterCommandLineArgs:
         assert "0x00000005" in util.interpret(path, "--print-return-value")
         assert "0x00000005" not in util.interpret(path)
 
+    def test_command_line_arguments_instruction_count(self):
+        path = util.assert_compile_succeeds("resources/interpreter_command_line_options/returnval.slg")
+        assert "Executed 2 instructions" in util.interpret(path, "--print-instruction-count")
+        assert "Executed" not in util.interpret(path)
+
+    def test_command_line_arguments_no_fusion(self):
+        def instruction_count(output):
+            return int(output.split("Executed ")[1].split()[0])
+        path = util.assert_compile_succeeds("resources/integration_kitchensink/kitchensink.slg")
+        fused = util.interpret(path, "--print-return-value", "--print-instruction-count")
+        unfused = util.interpret(path, "--print-return-value", "--print-instruction-count", "--no-fusion")
+        assert "0x00100000" in fused
+        assert "0x00100000" in unfused
+        assert instruction_count(fused) < instruction_count(unfused)
+
+    def test_command_line_arguments_profile(self):
+        path = util.assert_compile_succeeds("resources/interpreter_command_line_options/profile.slg")
+        profile = util.resolve_temp_path("profile")
+        assert "0x0000138d" in util.interpret(path, "--print-return-value", "--profile", profile)
+        with open(profile + ".txt", "r") as f:
+            report = f.read()
+        assert "Executed" in report
+        assert "Counter.increment" in report
+        assert "fib, line 15" in report
+        with open(profile + ".folded", "r") as f:
+            stacks = dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+        assert int(stacks["main;Counter.increment"]) > 0
+        assert "main;fib;fib;fib" in stacks
+
+    def test_command_line_arguments_sample_profile(self):
+        path = util.assert_compile_succeeds("resources/interpreter_command_line_options/sample_profile.slg")
+        profile = util.resolve_temp_path("sample_profile")
+        util.interpret(path, "--sample-profile", profile)
+        with open(profile + ".folded", "r") as f:
+            stacks = dict(line.rsplit(" ", 1) for line in f.read().splitlines())
+        assert len(stacks) > 0
+        assert all(stack == "main" or stack == "main;step" for stack in stacks)
+        assert all(int(count) > 0 for count in stacks.values())
+
     def test_invalid_arg(self):
         assert "Invalid command line argument" in util.interpret("--does-not-exist", expect_fail=True)
 
@@ -43,6 +83,131 @@ class TestInterpreterRecursion:
         path = util.assert_compile_succeeds("resources/interpreter_recursion/recursion.slg")
         assert "0x00000001" in util.interpret(path, "--print-return-value")
 
+class TestRegisterAllocation:
+    def test_liveness(self):
+        path = util.assert_compile_succeeds("resources/register_allocation/liveness.slg")
+        assert "0x000000af" in util.interpret(path, "--print-return-value")
+
+    def test_liveness_without_register_allocation(self):
+        path = util.assert_compile_succeeds("resources/register_allocation/liveness.slg", no_register_allocation=True)
+        assert "0x000000af" in util.interpret(path, "--print-return-value")
+
+    def test_registers_are_reused(self):
+        def count_main_registers(**kwargs):
+            outfile = util.resolve_temp_path("liveness.slb")
+            stdout = util.do_compile("resources/register_allocation/liveness.slg", outfile, **kwargs).stdout.decode("utf8")
+            lines = stdout.splitlines()
+            for i, line in enumerate(lines):
+                if line.startswith("MethodSegment") and "fn main()" in line:
+                    return lines[i + 1].count("RegisterHandle")
+            assert False
+        assert count_main_registers() < count_main_registers(no_register_allocation=True)
+
+class TestConstantFolding:
+    def test_folding(self):
+        path = util.assert_compile_succeeds("resources/constant_folding/folding.slg", message="constant -3")
+        assert "0x00000145" in util.interpret(path, "--print-return-value")
+
+class TestDeadCodeElimination:
+    def test_unreachable(self):
+        path = util.assert_compile_succeeds("resources/dead_code/unreachable.slg")
+        assert "0x000000a1" in util.interpret(path, "--print-return-value")
+
+    def test_unreachable_without_dead_code_elimination(self):
+        path = util.assert_compile_succeeds("resources/dead_code/unreachable.slg", no_dead_code_elimination=True)
+        assert "0x000000a1" in util.interpret(path, "--print-return-value")
+
+    def test_fewer_instructions_are_executed(self):
+        def count_instructions(**kwargs):
+            path = util.assert_compile_succeeds("resources/dead_code/unreachable.slg", **kwargs)
+            output = util.interpret(path, "--print-instruction-count")
+            return int(output.split("Executed ")[1].split(" ")[0])
+        assert count_instructions() < count_instructions(no_dead_code_elimination=True)
+
+class TestCopyPropagation:
+    def test_copies(self):
+        path = util.assert_compile_succeeds("resources/copy_propagation/copies.slg")
+        assert "0x00000065" in util.interpret(path, "--print-return-value")
+
+    def test_copies_without_copy_propagation(self):
+        path = util.assert_compile_succeeds("resources/copy_propagation/copies.slg", no_copy_propagation=True)
+        assert "0x00000065" in util.interpret(path, "--print-return-value")
+
+    def test_movs_are_removed(self):
+        def count_movs(**kwargs):
+            outfile = util.resolve_temp_path("copies.slb")
+            stdout = util.do_compile("resources/copy_propagation/copies.slg", outfile, **kwargs).stdout.decode("utf8")
+            return stdout.count("mneumonic=MOV")
+        assert count_movs() < count_movs(no_copy_propagation=True) / 2
+
+class TestBuildCache:
+    def test_unchanged_file_is_reused(self):
+        cache_dir = util.resolve_temp_path("build_cache_reuse")
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        path = util.assert_compile_succeeds("resources/integration_kitchensink/kitchensink.slg", message="Build cache miss: 0 hits, 1 misses, 1 entries", cache_dir=cache_dir)
+        with open(path, "rb") as f:
+            compiled = f.read()
+        path = util.assert_compile_succeeds("resources/integration_kitchensink/kitchensink.slg", message="Build cache hit: 1 hits, 1 misses, 1 entries", cache_dir=cache_dir)
+        with open(path, "rb") as f:
+            assert f.read() == compiled
+        assert "0x00100000" in util.interpret(path, "--print-return-value")
+
+    def test_options_and_includes_are_part_of_the_key(self):
+        cache_dir = util.resolve_temp_path("build_cache_key")
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        lib = util.assert_compile_succeeds("resources/integration_include/lib.slg", cache_dir=cache_dir)
+        util.assert_compile_succeeds("resources/integration_include/main.slg", message="Build cache miss", include=[lib], cache_dir=cache_dir)
+        util.assert_compile_succeeds("resources/integration_include/main.slg", message="Build cache miss", include=[lib], no_copy_propagation=True, cache_dir=cache_dir)
+        main = util.assert_compile_succeeds("resources/integration_include/main.slg", message="Build cache hit", include=[lib], cache_dir=cache_dir)
+        assert "0x00000003" in util.interpret(lib, main, "--print-return-value")
+        lib = util.assert_compile_succeeds("resources/integration_include/lib.slg", no_register_allocation=True, cache_dir=cache_dir)
+        util.assert_compile_succeeds("resources/integration_include/main.slg", message="Build cache miss", include=[lib], cache_dir=cache_dir)
+
+class TestParallelEmission:
+    def test_output_is_unchanged(self):
+        def compile(**kwargs):
+            path = util.assert_compile_succeeds("resources/integration_kitchensink/kitchensink.slg", **kwargs)
+            with open(path, "rb") as f:
+                return f.read()
+        assert compile(jobs=3) == compile(jobs=1)
+        path = util.assert_compile_succeeds("resources/integration_kitchensink/kitchensink.slg", jobs=3)
+        assert "0x00100000" in util.interpret(path, "--print-return-value")
+
+    def test_warnings_and_errors(self):
+        util.assert_compile_succeeds("resources/types_instanceof_casts/impossible_cast.slg", message="Impossible cast", no_warnings=False, jobs=2)
+        util.assert_compile_fails("resources/types_wrong_operator_types/arithmetic_needs_int.slg", message="is not numerical", jobs=2)
+
+class TestBatch:
+    def test_output_is_unchanged(self):
+        output_dir = util.resolve_temp_path("batch_unchanged")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        filenames = ["resources/integration_kitchensink/kitchensink.slg", "resources/integration_kitchensink/linkedlist.slg"]
+        completed_process = util.do_batch_compile(filenames, output_dir)
+        stdout = completed_process.stdout.decode("utf8")
+        assert completed_process.returncode == 0
+        assert stdout.count("ok ") == 2 and "Compiled 2 files" in stdout
+        for filename in filenames:
+            with open(util.assert_compile_succeeds(filename), "rb") as f:
+                expected = f.read()
+            with open(os.path.join(output_dir, os.path.basename(filename)[:-4] + ".slb"), "rb") as f:
+                assert f.read() == expected
+        assert "0x00100000" in util.interpret(os.path.join(output_dir, "kitchensink.slb"), "--print-return-value")
+
+    def test_failures_are_reported(self):
+        output_dir = util.resolve_temp_path("batch_failures")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+        manifest = "%s\n# Comments are ignored\n\n%s\n" % (
+            util.resolve_filename("resources/types_wrong_operator_types/arithmetic_needs_int.slg"),
+            util.resolve_filename("resources/integration_kitchensink/forloop.slg")
+        )
+        completed_process = util.do_batch_compile([], output_dir, manifest="-", stdin=manifest.encode("utf8"))
+        stdout = completed_process.stdout.decode("utf8")
+        assert completed_process.returncode != 0
+        assert "is not numerical" in stdout and "Compiled 1 files" in stdout and "1 failed" in stdout
+        assert "0x0000000a" in util.interpret(os.path.join(output_dir, "forloop.slb"), "--print-return-value")
+
 class TestIntegrationInclude:
     def test_include(self):
         lib = util.assert_compile_succeeds("resources/integration_include/lib.slg")
@@ -425,6 +590,24 @@ class TestStaticVariables:
         path = util.assert_compile_succeeds("resources/static_variables/initializer_garbage_collection.slg", no_warnings=False)
         assert "Garbage collecting" in util.interpret(path, "--gc-verbose")
 
+class TestGarbageCollection:
+    def test_generational(self):
+        path = util.assert_compile_succeeds("resources/garbage_collection/generational.slg")
+        output = util.interpret(path, "--gc-verbose", "--print-return-value")
+        assert "Garbage collecting (minor)" in output
+        assert "0x000001f0" in output
+
+    def test_incremental(self):
+        path = util.assert_compile_succeeds("resources/garbage_collection/generational.slg")
+        output = util.interpret(path, "--gc-verbose", "--gc-pause-target", "0.1", "--print-return-value")
+        assert "Incremental mark slice" in output
+        assert "Incremental sweep slice" in output
+        assert "0x000001f0" in output
+
+    def test_generational_no_gc(self):
+        path = util.assert_compile_succeeds("resources/garbage_collection/generational.slg")
+        assert "0x000001f0" in util.interpret(path, "--no-gc", "--print-return-value")
+
 class TestObject:
     def test_object_extension(self):
         path = util.assert_compile_succeeds("resources/object/object_extension.slg", no_warnings=False)
@@ -481,6 +664,10 @@ class TestInterfaces:
         path = util.assert_compile_succeeds("resources/interfaces/instanceof.slg", no_warnings=False)
         util.interpret(path)
 
+    def test_megamorphic(self):
+        path = util.assert_compile_succeeds("resources/interfaces/megamorphic.slg")
+        util.interpret(path)
+
 class TestGenericMethods:
     def test_basic(self):
         path = util.assert_compile_succeeds("resources/generic_methods/basic.slg")
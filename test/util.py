@@ -13,18 +13,39 @@ tmpdir = resolve_filename("tmp")
 def resolve_temp_path(temp_path):
     return os.path.join(tmpdir, temp_path)
 
-def do_compile(filename, outfile, include=[], include_json=[], parse_only=False, no_stdlib=False):
-    arguments = ["python3", resolve_filename("../compiler/compiler.py"), "-o", outfile, "--ast", "--segments"]
+def do_compile(filename, outfile, include=[], include_json=[], parse_only=False, no_stdlib=False, no_register_allocation=False, no_dead_code_elimination=False, no_copy_propagation=False, cache_dir=None, jobs=1):
+    arguments = ["python3", resolve_filename("../compiler/compiler.py"), "-o", outfile]
+    if cache_dir is not None:
+        arguments += ["--cache-dir", cache_dir, "--cache-stats"]
+    if jobs != 1:
+        arguments += ["--jobs", str(jobs)]
+    if cache_dir is None and jobs == 1:
+        # These would stop the cache from being used, and the methods from
+        # being emitted in parallel
+        arguments += ["--ast", "--segments"]
     arguments += list(itertools.chain.from_iterable([["--include", incl] for incl in include]))
     arguments += list(itertools.chain.from_iterable([["--include-json", incl] for incl in include_json]))
     if parse_only:
         arguments.append("--parse-only")
     if no_stdlib:
         arguments.append("--no-stdlib")
+    if no_register_allocation:
+        arguments.append("--no-register-allocation")
+    if no_dead_code_elimination:
+        arguments.append("--no-dead-code-elimination")
+    if no_copy_propagation:
+        arguments.append("--no-copy-propagation")
     arguments += [resolve_filename(filename)]
     return subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
-def assert_compile_succeeds(filename, message="", include=[], include_json=[], parse_only=False, no_warnings=True, no_stdlib=False):
+def do_batch_compile(filenames, output_dir, manifest=None, stdin=None):
+    arguments = ["python3", resolve_filename("../compiler/batch.py"), "--output-dir", output_dir]
+    if manifest is not None:
+        arguments += ["--manifest", manifest]
+    arguments += [resolve_filename(filename) for filename in filenames]
+    return subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, input=stdin)
+
+def assert_compile_succeeds(filename, message="", include=[], include_json=[], parse_only=False, no_warnings=True, no_stdlib=False, no_register_allocation=False, no_dead_code_elimination=False, no_copy_propagation=False, cache_dir=None, jobs=1):
     if not os.path.isdir(tmpdir):
         os.makedirs(tmpdir)
     assert isinstance(include, list)
@@ -32,7 +53,7 @@ def assert_compile_succeeds(filename, message="", include=[], include_json=[], p
     if not isinstance(message, list):
         message = [message]
     outfile = resolve_temp_path(os.path.split(filename)[1])
-    completed_process = do_compile(filename, outfile, include=include, include_json=include_json, parse_only=parse_only, no_stdlib=no_stdlib)
+    completed_process = do_compile(filename, outfile, include=include, include_json=include_json, parse_only=parse_only, no_stdlib=no_stdlib, no_register_allocation=no_register_allocation, no_dead_code_elimination=no_dead_code_elimination, no_copy_propagation=no_copy_propagation, cache_dir=cache_dir, jobs=jobs)
     # I know, I shouldn't just coerce to utf8...
     stdout = completed_process.stdout.decode("utf8")
     if completed_process.returncode != 0 or any(msg not in stdout for msg in message) or ("Warning" in stdout and no_warnings):
@@ -40,11 +61,11 @@ def assert_compile_succeeds(filename, message="", include=[], include_json=[], p
         assert False
     return outfile
 
-def assert_compile_fails(filename, message="", include=[], no_stdlib=False):
+def assert_compile_fails(filename, message="", include=[], no_stdlib=False, jobs=1):
     if not isinstance(message, list):
         message = [message]
     outfile = resolve_temp_path(os.path.split(filename)[1])
-    completed_process = do_compile(filename, outfile, include, no_stdlib=no_stdlib)
+    completed_process = do_compile(filename, outfile, include, no_stdlib=no_stdlib, jobs=jobs)
     stdout = completed_process.stdout.decode("utf8")
     if completed_process.returncode == 0 or any(msg not in stdout for msg in message):
         print(stdout)